@@ -0,0 +1,108 @@
+import time
+
+
+class AutosaveScheduler:
+    """ Decides when to autosave. A save happens once there have been no changes for the debounce delay, or once the oldest unsaved
+    change reaches the maximum latency, whichever comes first, so continuous typing can't hold off saving forever. A single timer is
+    kept running while there are unsaved changes, instead of restarting one on every keystroke. """
+
+    # Constructor. Save is called to save the document, and returns False if there was nothing to write. CallLater is called with a delay
+    # in milliseconds and a function, like wx.CallLater, and returns a timer with a Stop() method.
+    def __init__(self, save, callLater, delay=1.0, maxLatency=5.0):
+
+        # Store save function and timer factory
+        self.save = save
+        self.callLater = callLater
+
+        # Debounce delay and maximum latency, in seconds
+        self.delay = delay
+        self.maxLatency = maxLatency
+
+        # Incremented on every change. The document has unsaved changes if it's different from the generation last saved.
+        self.generation = 0
+        self.savedGeneration = 0
+
+        # Time of the first unsaved change and the latest change
+        self.firstChangeTime = None
+        self.lastChangeTime = None
+
+        # Running timer, if any
+        self.timer = None
+
+        # Number of saves attempted, changes coalesced into a save that was already pending, and saves skipped because the text hadn't changed
+        self.savesAttempted = 0
+        self.savesCoalesced = 0
+        self.savesSkipped = 0
+
+
+    # Returns True if there are changes which haven't been saved
+    def isDirty(self):
+        return self.generation != self.savedGeneration
+
+
+    # Called when the document changes
+    def markDirty(self):
+
+        # Update generation and change times
+        now = time.monotonic()
+        if self.isDirty():
+            self.savesCoalesced += 1
+        else:
+            self.firstChangeTime = now
+        self.generation += 1
+        self.lastChangeTime = now
+
+        # Start the timer if it's not running. If it is, it checks when the save is due when it fires.
+        if not self.timer:
+            self.startTimer(self.delay)
+
+
+    # Called when the document has been saved some other way, or its changes should be forgotten
+    def markClean(self):
+        self.stopTimer()
+        self.savedGeneration = self.generation
+        self.firstChangeTime = None
+
+
+    # Saves now if there are unsaved changes
+    def flush(self):
+
+        # Stop if nothing has changed
+        self.stopTimer()
+        if not self.isDirty():
+            return
+
+        # Save it
+        self.savesAttempted += 1
+        self.markClean()
+        if self.save() is False:
+            self.savesSkipped += 1
+
+
+    # Called when the timer fires
+    def onTimer(self):
+
+        # Stop if there's nothing to save
+        self.timer = None
+        if not self.isDirty():
+            return
+
+        # Save if it's due, otherwise wait until it is
+        due = min(self.lastChangeTime + self.delay, self.firstChangeTime + self.maxLatency)
+        remaining = due - time.monotonic()
+        if remaining <= 0:
+            self.flush()
+        else:
+            self.startTimer(remaining)
+
+
+    # Starts the timer for the specified number of seconds
+    def startTimer(self, seconds):
+        self.timer = self.callLater(max(1, int(seconds * 1000)), self.onTimer)
+
+
+    # Stops the timer if it's running
+    def stopTimer(self):
+        if self.timer:
+            self.timer.Stop()
+            self.timer = None
@@ -0,0 +1,22 @@
+from LexerTables import LexerTables
+from MarkdownStreamingTokenizer import TokenTypes
+
+# Matchers for JavaScript, TypeScript and JSON code in fenced code blocks
+TokenMatchers = [
+
+    # Match: // line comments and /* block comments */
+    { 'name': 'code-comment', 'pattern': r"//[^\n]*|/\*[\s\S]*?(?:\*/|\Z)" },
+
+    # Match: "strings", 'strings' and `template strings`
+    { 'name': 'code-string', 'pattern': r"\"(?:\\.|[^\"\\\n])*\"?|'(?:\\.|[^'\\\n])*'?|`(?:\\.|[^`\\])*`?" },
+
+    # Match: keywords
+    { 'name': 'code-keyword', 'pattern': r"\b(?:async|await|break|case|catch|class|const|continue|debugger|default|delete|do|else|export|extends|false|finally|for|from|function|if|import|in|instanceof|interface|let|new|null|of|return|static|super|switch|this|throw|true|try|type|typeof|undefined|var|void|while|with|yield)\b" },
+
+    # Match: numbers
+    { 'name': 'code-number', 'pattern': r"\b(?:0[xX][0-9a-fA-F_]+|0[bB][01_]+|0[oO][0-7_]+|\d[\d_]*(?:\.\d*)?(?:[eE][+-]?\d+)?n?)\b" }
+
+]
+
+# Build the lexer tables
+Tables = LexerTables(TokenMatchers, TokenTypes)
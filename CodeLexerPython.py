@@ -0,0 +1,22 @@
+from LexerTables import LexerTables
+from MarkdownStreamingTokenizer import TokenTypes
+
+# Matchers for Python code in fenced code blocks
+TokenMatchers = [
+
+    # Match: # comments
+    { 'name': 'code-comment', 'pattern': r"#[^\n]*" },
+
+    # Match: """ docstrings """ and 'strings', with an optional prefix
+    { 'name': 'code-string', 'pattern': r"(?<![\w])[rRbBuUfF]{0,2}(?:\"\"\"[\s\S]*?(?:\"\"\"|\Z)|'''[\s\S]*?(?:'''|\Z)|\"(?:\\.|[^\"\\\n])*\"?|'(?:\\.|[^'\\\n])*'?)" },
+
+    # Match: keywords
+    { 'name': 'code-keyword', 'pattern': r"\b(?:False|None|True|and|as|assert|async|await|break|class|continue|def|del|elif|else|except|finally|for|from|global|if|import|in|is|lambda|nonlocal|not|or|pass|raise|return|try|while|with|yield|self)\b" },
+
+    # Match: numbers
+    { 'name': 'code-number', 'pattern': r"\b(?:0[xX][0-9a-fA-F_]+|0[bB][01_]+|0[oO][0-7_]+|\d[\d_]*(?:\.\d*)?(?:[eE][+-]?\d+)?j?)\b" }
+
+]
+
+# Build the lexer tables
+Tables = LexerTables(TokenMatchers, TokenTypes)
@@ -0,0 +1,22 @@
+from LexerTables import LexerTables
+from MarkdownStreamingTokenizer import TokenTypes
+
+# Matchers for shell scripts in fenced code blocks
+TokenMatchers = [
+
+    # Match: # comments, which must start a word
+    { 'name': 'code-comment', 'pattern': r"(?<![^\s;|&(])#[^\n]*" },
+
+    # Match: "strings" and 'strings'
+    { 'name': 'code-string', 'pattern': r"\"(?:\\.|[^\"\\])*\"?|'[^']*'?" },
+
+    # Match: keywords and common builtins
+    { 'name': 'code-keyword', 'pattern': r"\b(?:if|then|else|elif|fi|for|while|until|do|done|case|esac|in|function|return|exit|export|local|readonly|source|echo|cd|set|unset|sudo)\b" },
+
+    # Match: $variables and ${variables}, styled like numbers
+    { 'name': 'code-number', 'pattern': r"\$(?:\{[^}\n]*\}?|[A-Za-z_][A-Za-z0-9_]*|[0-9@#?$!*-])" }
+
+]
+
+# Build the lexer tables
+Tables = LexerTables(TokenMatchers, TokenTypes)
@@ -0,0 +1,117 @@
+
+import threading
+import collections
+import Instrumentation
+from NoteIndex import readDescription
+
+# Number of characters read from the start of each note
+READ_SIZE = 4096
+
+
+class DescriptionLoader:
+    """ Reads the descriptions shown under each note's name in the file list on a small pool of threads, so drawing the list never waits
+    for the disk. Descriptions are kept in a cache of limited size, keyed on the note's path and modification time so changed notes are
+    read again. Only the notes asked for most recently are read, so scrolling quickly past notes doesn't leave a backlog. """
+
+    # Constructor
+    def __init__(self, callAfter, onLoaded, threadCount=2, cacheSize=20000):
+
+        # Store settings
+        self.callAfter = callAfter
+        self.onLoaded = onLoaded
+        self.threadCount = threadCount
+        self.cacheSize = cacheSize
+
+        # Descriptions by (path, mtime), least recently used first. Only used on the UI thread.
+        self.cache = collections.OrderedDict()
+
+        # Notes waiting to be read, in the order they're needed, notes being read, and the number of threads running
+        self.pending = collections.OrderedDict()
+        self.loading = set()
+        self.threads = 0
+        self.lock = threading.Lock()
+
+
+    # Returns the description of a note, or None if it hasn't been read yet
+    def get(self, path, mtime):
+
+        # Check cache
+        key = (path, mtime)
+        description = self.cache.get(key)
+        if description is not None:
+            self.cache.move_to_end(key)
+
+        # Done
+        return description
+
+
+    # Stores a description, for example one from the note index
+    def store(self, path, mtime, description):
+
+        # Add it
+        self.cache[(path, mtime)] = description
+        self.cache.move_to_end((path, mtime))
+
+        # Remove the least recently used descriptions
+        while len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+
+
+    # Reads the descriptions of notes which aren't cached yet, as a list of (path, mtime) tuples, most urgent first. Replaces the notes
+    # passed to any earlier call which haven't been read yet.
+    def prefetch(self, notes):
+
+        with self.lock:
+
+            # Replace the queue
+            self.pending = collections.OrderedDict((key, True) for key in notes if key not in self.cache and key not in self.loading)
+
+            # Start threads if needed. They're daemons, since there's nothing to finish when the app exits.
+            while self.threads < min(self.threadCount, len(self.pending)):
+                self.threads += 1
+                threading.Thread(target=self.run, daemon=True).start()
+
+
+    # Runs on each reader thread
+    def run(self):
+
+        while True:
+
+            # Get the next note, or stop if there are none
+            with self.lock:
+                if not self.pending:
+                    self.threads -= 1
+                    return
+                key = self.pending.popitem(last=False)[0]
+                self.loading.add(key)
+
+            # Read it
+            try:
+                description = self.load(key[0])
+            except (OSError, ValueError):
+                description = "(none)"
+
+            # Pass it to the UI thread
+            self.callAfter(self.deliver, key, description)
+
+
+    # Reads a note's description
+    def load(self, path):
+        return readDescription(path, READ_SIZE)
+
+
+    # Stores a description which has been read. Runs on the UI thread.
+    def deliver(self, key, description):
+
+        # Store it
+        with self.lock:
+            self.loading.discard(key)
+        self.store(key[0], key[1], description)
+
+        # Let the owner know
+        self.onLoaded()
+
+
+
+# Timers for reading descriptions
+Instrumentation.instrument(DescriptionLoader, 'load', 'DescriptionLoader.load', lambda self, path: path)
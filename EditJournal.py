@@ -0,0 +1,303 @@
+import os
+import sys
+import zlib
+import struct
+import hashlib
+from NoteWriter import writeFileAtomic, FSYNC_FILE
+
+# Journal file header: magic, then the CRC32 and length of the base text, then the length of the note path, followed by the path itself
+JOURNAL_MAGIC = b'MDNJ1'
+HEADER_FORMAT = struct.Struct('<IQH')
+
+# Record header: record type, byte position, byte length and CRC32 of the record. Inserts are followed by the inserted text.
+RECORD_FORMAT = struct.Struct('<BIII')
+RECORD_INSERT = 1
+RECORD_DELETE = 2
+
+
+class EditJournal:
+    """ Appends the edits made to a note to a journal, so a large note doesn't need to be rewritten on every save. The journal is a
+    series of segment files. Each segment starts with a checksum of the text it applies to, its base, followed by insert and delete
+    records in Scintilla byte positions. When the note is compacted into its file, a new segment is started with the compacted text
+    as its base, and the old segments can be removed once the file has been written. """
+
+    # Constructor. Starts a journal for a note whose current text is the specified text.
+    def __init__(self, folder, path, text):
+
+        # Store folder and note path
+        self.folder = folder
+        self.path = os.path.abspath(path)
+
+        # Path and file of the current segment
+        self.segmentPath = None
+        self.file = None
+
+        # Number of records in the current segment
+        self.records = 0
+
+        # Start the first segment
+        os.makedirs(folder, exist_ok=True)
+        self.startSegment(text)
+
+
+    # Starts a new segment with the specified text as its base
+    def startSegment(self, text):
+
+        # Find the next segment number
+        existing = segmentPaths(self.folder, self.path)
+        number = segmentNumber(existing[-1]) + 1 if existing else 0
+        self.segmentPath = os.path.join(self.folder, journalKey(self.path) + '.' + str(number).zfill(8) + '.journal')
+
+        # Write the header
+        data = text.encode('utf-8')
+        pathData = self.path.encode('utf-8')
+        self.file = open(self.segmentPath, 'wb')
+        self.file.write(JOURNAL_MAGIC + HEADER_FORMAT.pack(zlib.crc32(data), len(data), len(pathData)) + pathData)
+        self.file.flush()
+        self.records = 0
+
+
+    # Records text inserted at a byte position
+    def insert(self, pos, text):
+        self.append(RECORD_INSERT, pos, text.encode('utf-8'))
+
+
+    # Records a number of bytes deleted at a byte position
+    def delete(self, pos, length):
+        self.append(RECORD_DELETE, pos, b'', length)
+
+
+    # Appends a record and flushes it to the OS, so it survives the app crashing
+    def append(self, recordType, pos, data, length=None):
+
+        # Build the record
+        if length is None:
+            length = len(data)
+        crc = zlib.crc32(data, zlib.crc32(struct.pack('<BII', recordType, pos, length)))
+
+        # Write it
+        self.file.write(RECORD_FORMAT.pack(recordType, pos, length, crc) + data)
+        self.file.flush()
+        self.records += 1
+
+
+    # Makes sure the records written so far survive a power cut
+    def sync(self):
+        os.fsync(self.file.fileno())
+
+
+    # Starts a new segment with the compacted text as its base. Returns the paths of the old segments, which can be removed once the
+    # compacted text has been written to the note.
+    def rotate(self, text):
+
+        # Close the current segment
+        self.file.close()
+        retired = segmentPaths(self.folder, self.path)
+
+        # Start a new one
+        self.startSegment(text)
+        return retired
+
+
+    # Closes the journal. The current segment is removed if it has no records, since the note file already contains its base.
+    def close(self):
+
+        # Close file
+        self.file.close()
+
+        # Remove it if empty
+        if self.records == 0:
+            removeFiles([self.segmentPath])
+
+
+    # Closes the journal and removes all of its segments, for example when the note is deleted
+    def discard(self):
+        self.file.close()
+        removeFiles(segmentPaths(self.folder, self.path))
+
+
+
+# Returns the file name prefix for the journal of a note
+def journalKey(path):
+    return hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:20]
+
+
+# Returns the segment number from a segment path
+def segmentNumber(segmentPath):
+    return int(os.path.basename(segmentPath).split('.')[1])
+
+
+# Returns the paths of the journal segments for a note, oldest first
+def segmentPaths(folder, path):
+
+    # List files with the note's prefix
+    prefix = journalKey(path) + '.'
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return []
+
+    # Sort by segment number
+    paths = [os.path.join(folder, name) for name in names if name.startswith(prefix) and name.endswith('.journal')]
+    return sorted(paths, key=segmentNumber)
+
+
+# Removes files, ignoring any which are already gone
+def removeFiles(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# Reads a journal segment. Returns a tuple of (note path, base CRC32, base length, list of records), where each record is a
+# (type, position, length, data) tuple. Reading stops at the first incomplete or corrupt record, which is what a crash mid-write leaves.
+def readSegment(segmentPath):
+
+    # Read file
+    with open(segmentPath, 'rb') as file:
+        data = file.read()
+
+    # Read header
+    if not data.startswith(JOURNAL_MAGIC):
+        raise ValueError("Not a journal file: " + segmentPath)
+    index = len(JOURNAL_MAGIC)
+    baseCrc, baseLength, pathLength = HEADER_FORMAT.unpack_from(data, index)
+    index += HEADER_FORMAT.size
+    path = data[index:index + pathLength].decode('utf-8')
+    index += pathLength
+
+    # Read records
+    records = []
+    while index + RECORD_FORMAT.size <= len(data):
+
+        # Read record header
+        recordType, pos, length, crc = RECORD_FORMAT.unpack_from(data, index)
+        dataLength = length if recordType == RECORD_INSERT else 0
+        recordEnd = index + RECORD_FORMAT.size + dataLength
+        if recordEnd > len(data):
+            break
+
+        # Check it
+        recordData = data[index + RECORD_FORMAT.size:recordEnd]
+        if zlib.crc32(recordData, zlib.crc32(struct.pack('<BII', recordType, pos, length))) != crc:
+            break
+
+        # Add it
+        records.append((recordType, pos, length, recordData))
+        index = recordEnd
+
+    # Done
+    return path, baseCrc, baseLength, records
+
+
+# Replays the journal of a note into its file, if it has one. Returns True if the file was changed. If the journal can't be replayed
+# completely, the note is left as it is, what could be replayed is written next to it, and the journal is set aside.
+def recoverJournal(folder, path, fsyncPolicy=FSYNC_FILE):
+
+    # Stop if there's no journal
+    segments = segmentPaths(folder, path)
+    if not segments:
+        return False
+
+    # Read the note the same way the editor does
+    try:
+        with open(path) as file:
+            data = file.read().encode('utf-8')
+    except OSError:
+        data = None
+
+    # Read the segments. Ones which can't be read are None.
+    parsed = []
+    for segment in segments:
+        try:
+            parsed.append(readSegment(segment))
+        except (OSError, ValueError, struct.error, UnicodeDecodeError):
+            parsed.append(None)
+
+    # Find the newest segment whose base is the text in the file. Older segments were already compacted into it. If none match,
+    # the note was changed or removed outside the app, and the edits can't be replayed, so the journal is kept for the user.
+    start = None
+    if data is not None:
+        crc = zlib.crc32(data)
+        for i in range(len(parsed)):
+            if parsed[i] and parsed[i][1] == crc and parsed[i][2] == len(data):
+                start = i
+    if start is None:
+        print('EditJournal: The journal of ' + path + " doesn't match the note, keeping it", file=sys.stderr)
+        setAside(segments)
+        return False
+
+    # Replay the records from there. Each segment applies to the text left by the ones before it, so replaying stops at a segment
+    # which can't be read or whose base isn't the text replayed so far.
+    buffer = bytearray(data)
+    changed = False
+    complete = True
+    for i, segment in enumerate(parsed[start:]):
+        if not segment or (i > 0 and (zlib.crc32(buffer) != segment[1] or len(buffer) != segment[2])):
+            complete = False
+            break
+        notePath, baseCrc, baseLength, records = segment
+        for recordType, pos, length, recordData in records:
+            if recordType == RECORD_INSERT:
+                buffer[pos:pos] = recordData
+            else:
+                del buffer[pos:pos + length]
+            changed = True
+
+    # If only part of the journal could be replayed, write the result next to the note instead of over it, and keep the journal
+    if not complete:
+        recoveredPath = os.path.splitext(path)[0] + '.recovered.md'
+        print('EditJournal: The journal of ' + path + ' is incomplete, writing what could be recovered to ' + recoveredPath, file=sys.stderr)
+        writeFileAtomic(recoveredPath, buffer.decode('utf-8', errors='replace'), fsyncPolicy)
+        setAside(segments)
+        return False
+
+    # Write the result
+    if changed:
+        writeFileAtomic(path, buffer.decode('utf-8'), fsyncPolicy)
+
+    # Remove the journal
+    removeFiles(segments)
+    return changed
+
+
+# Renames journal segments which can't be replayed, so they're kept for the user but aren't mixed up with the note's next journal
+def setAside(segments):
+    for segment in segments:
+        try:
+            os.replace(segment, segment + '.orphaned')
+        except OSError:
+            pass
+
+
+# Replays all journals left in the folder, for example after a crash. Returns the paths of the notes which were changed.
+def recoverJournals(folder, fsyncPolicy=FSYNC_FILE):
+
+    # Find the notes with journals
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return []
+    paths = []
+    for name in sorted(names):
+        if name.endswith('.journal'):
+            try:
+                path = readSegment(os.path.join(folder, name))[0]
+            except Exception:
+                continue
+            if path not in paths:
+                paths.append(path)
+
+    # Recover each of them. A journal which can't be replayed is set aside.
+    changed = []
+    for path in paths:
+        try:
+            if recoverJournal(folder, path, fsyncPolicy):
+                changed.append(path)
+        except Exception:
+            pass
+
+    # Done
+    return changed
@@ -1,10 +1,19 @@
 
 import wx
 import wx.stc
+import time
+import collections
 import Config
 from Theme import *
 from MarkdownStreamingTokenizer import *
+from MarkdownLexer import *
+from MarkdownDocument import *
+from NoteWriter import *
+from AutosaveScheduler import *
+from OutlinePopup import *
+from EditJournal import *
 from send2trash import send2trash
+import Instrumentation
 
 # Define scintilla built-in style codes TODO: Shouldn't this be defined somewhere in wx.stc?
 STYLE_DEFAULT               = 32
@@ -24,6 +33,56 @@ CUSTOMSTYLE_HEADER1         = 1
 CUSTOMSTYLE_HEADER2         = 2
 CUSTOMSTYLE_HEADER3         = 3
 CUSTOMSTYLE_UNIMPORTANT     = 4
+CUSTOMSTYLE_EMPHASIS        = 5
+CUSTOMSTYLE_STRONG          = 6
+CUSTOMSTYLE_CODE            = 7
+CUSTOMSTYLE_LINK            = 8
+CUSTOMSTYLE_IMAGE           = 9
+CUSTOMSTYLE_LIST            = 10
+CUSTOMSTYLE_QUOTE           = 11
+CUSTOMSTYLE_TABLE           = 12
+CUSTOMSTYLE_CODE_KEYWORD    = 13
+CUSTOMSTYLE_CODE_STRING     = 14
+CUSTOMSTYLE_CODE_COMMENT    = 15
+CUSTOMSTYLE_CODE_NUMBER     = 16
+
+# Largest distance, in bytes, from a checkpoint to the requested position which is styled right away. Further than this, only the visible
+# text is styled right away, and the rest is styled in the background.
+SYNC_STYLE_DISTANCE         = 256 * 1024
+
+# Number of bytes to style in each step while idle, and the time in seconds to spend styling in each idle event
+IDLE_STYLE_CHUNK            = 32 * 1024
+IDLE_STYLE_TIME             = 0.008
+
+# Number of characters to add to the editor in each step when loading a large note, and the time in seconds to spend loading before letting
+# the event loop run. Read only notes are loaded in larger steps, since there's no undo history or journal to keep up to date.
+LOAD_CHUNK                  = 1024 * 1024
+LOAD_CHUNK_READ_ONLY        = 8 * 1024 * 1024
+LOAD_TIME                   = 0.016
+
+# Map of token type names to style codes
+TOKEN_STYLES = {
+    'header1': CUSTOMSTYLE_HEADER1,
+    'header2': CUSTOMSTYLE_HEADER2,
+    'header3': CUSTOMSTYLE_HEADER3,
+    'header4': CUSTOMSTYLE_HEADER3,
+    'header5': CUSTOMSTYLE_HEADER3,
+    'header6': CUSTOMSTYLE_HEADER3,
+    'unimportant': CUSTOMSTYLE_UNIMPORTANT,
+    'emphasis': CUSTOMSTYLE_EMPHASIS,
+    'strong': CUSTOMSTYLE_STRONG,
+    'code': CUSTOMSTYLE_CODE,
+    'link': CUSTOMSTYLE_LINK,
+    'image': CUSTOMSTYLE_IMAGE,
+    'list': CUSTOMSTYLE_LIST,
+    'quote': CUSTOMSTYLE_QUOTE,
+    'table': CUSTOMSTYLE_TABLE,
+    'table-delimiter': CUSTOMSTYLE_UNIMPORTANT,
+    'code-keyword': CUSTOMSTYLE_CODE_KEYWORD,
+    'code-string': CUSTOMSTYLE_CODE_STRING,
+    'code-comment': CUSTOMSTYLE_CODE_COMMENT,
+    'code-number': CUSTOMSTYLE_CODE_NUMBER
+}
 
 
 class EditorPanel(wx.Panel):
@@ -36,6 +95,7 @@ class EditorPanel(wx.Panel):
         self.onMenuPressed = None
         self.onFileRenamed = None
         self.onFileDeleted = None
+        self.onFileSaved = None
 
         # Setup panel
         self.SetBackgroundColour(Theme.getColor('root/editor', 'background-color'))
@@ -49,12 +109,41 @@ class EditorPanel(wx.Panel):
         self.setupHeaderBar()
         self.setupTextBox()
 
-        # Currently opened file
+        # Currently opened file, and its modification time when it was opened
         self.currentFile = None
+        self.currentFileTime = None
 
-        # Save timer
-        self.saveTimer = wx.CallLater(1000, self.save)
-        self.saveTimer.Stop()
+        # Saves after a pause in typing, or after the maximum latency if typing continues
+        self.autosave = AutosaveScheduler(self.saveIfModified, wx.CallLater, Config.getfloat('editor', 'autosave_delay', 1.0), Config.getfloat('editor', 'autosave_max_latency', 5.0))
+
+        # Writes saved notes on a background thread
+        self.writer = NoteWriter(wx.CallAfter, Config.get('editor', 'save_fsync', FSYNC_FILE))
+        self.writer.onSaved = self.onSaved
+
+        # Notes at least this size save edits to a journal, which is compacted into the note every so often. Zero disables it.
+        self.journal = None
+        self.journalFolder = os.path.join(Config.path, 'journals')
+        self.journalSize = Config.getint('editor', 'journal_min_size', 0)
+        self.journalCompactInterval = Config.getfloat('editor', 'journal_compact_interval', 60.0)
+        self.journalCompactTime = 0
+
+        # Notes at least this size are loaded a piece at a time between events, and notes at least the read only size are opened read only.
+        # Zero disables either of them.
+        self.loadJob = None
+        self.progressiveLoadSize = Config.getint('editor', 'progressive_load_size', 4 * 1024 * 1024)
+        self.readOnlySize = Config.getint('editor', 'read_only_size', 0)
+
+        # Recently used notes, kept as live Scintilla documents so switching back to them is instant. Oldest first.
+        self.noteCache = collections.OrderedDict()
+        self.noteCacheCount = Config.getint('editor', 'note_cache_count', 8)
+        self.noteCacheMemory = Config.getint('editor', 'note_cache_memory', 64 * 1024 * 1024)
+
+        # Replay any journals left over from a crash
+        recoverJournals(self.journalFolder, self.writer.fsyncPolicy)
+
+        # Show autosave and cache counters in the performance overlay
+        Instrumentation.addSource('autosave', lambda: { 'attempted': self.autosave.savesAttempted, 'coalesced': self.autosave.savesCoalesced, 'skipped': self.autosave.savesSkipped })
+        Instrumentation.addSource('noteCache', lambda: { 'notes': len(self.noteCache), 'memory': sum(n.memory() for n in self.noteCache.values()) })
 
 
     # Sets up the header
@@ -81,6 +170,13 @@ class EditorPanel(wx.Panel):
         self.nameLbl.SetForegroundColour(Theme.getColor('root/editor/filename', 'foreground-color'))
         toolbarSizer.Add(self.nameLbl, proportion=1, flag=wx.ALIGN_CENTER_VERTICAL)
 
+        # Show the outline when the file name is clicked, or Ctrl+Shift+O is pressed
+        self.nameLbl.SetCursor(wx.Cursor(wx.CURSOR_HAND))
+        self.nameLbl.Bind(wx.EVT_LEFT_DOWN, lambda e: self.showOutline())
+        outlineId = wx.NewIdRef()
+        self.Bind(wx.EVT_MENU, lambda e: self.showOutline(), id=outlineId)
+        self.SetAcceleratorTable(wx.AcceleratorTable([(wx.ACCEL_CTRL | wx.ACCEL_SHIFT, ord('O'), outlineId)]))
+
         # Add rename button
         renameBtn = wx.StaticBitmap(header, bitmap=Theme.getIcon('rename', 16), size=wx.Size(44, 44))
         renameBtn.SetCursor(wx.Cursor(wx.CURSOR_HAND))
@@ -109,9 +205,25 @@ class EditorPanel(wx.Panel):
         self.text.SetWrapIndentMode(1)
         self.GetSizer().Add(self.text, proportion=1, flag=wx.EXPAND)
 
+        # Create lexer. Notes larger than the configured size are styled on a background thread.
+        self.lexer = MarkdownLexer(self.text, TOKEN_STYLES, STYLE_DEFAULT)
+        self.backgroundLexer = BackgroundLexer(self.lexer, wx.CallAfter)
+        self.backgroundLexingSize = Config.getint('editor', 'background_lexing_size', 2 * 1024 * 1024)
+
+        # Position up to which text has been styled properly while idle, or None if idle styling is not needed
+        self.idleStylePos = None
+
+        # Create block model of the document
+        self.document = MarkdownDocument(self.text.GetLine, self.text.GetLineCount, self.text.PositionFromLine)
+
+        # Only send modified events for text changes, we don't need to hear about style changes
+        self.text.SetModEventMask(wx.stc.STC_MOD_INSERTTEXT | wx.stc.STC_MOD_DELETETEXT)
+
         # Bind events
         self.text.Bind(wx.stc.EVT_STC_CHANGE, self.onTextChange)
+        self.text.Bind(wx.stc.EVT_STC_MODIFIED, self.onTextModified)
         self.text.Bind(wx.stc.EVT_STC_STYLENEEDED, self.onStyleNeeded)
+        self.Bind(wx.EVT_IDLE, self.onIdle)
 
         # Apply style to text control
         self.applyTheme()
@@ -132,104 +244,537 @@ class EditorPanel(wx.Panel):
         Theme.applySciStyle(self.text, 'root/editor/header2', code=CUSTOMSTYLE_HEADER2)
         Theme.applySciStyle(self.text, 'root/editor/header3', code=CUSTOMSTYLE_HEADER3)
         Theme.applySciStyle(self.text, 'root/editor/unimportant', code=CUSTOMSTYLE_UNIMPORTANT)
+        Theme.applySciStyle(self.text, 'root/editor/emphasis', code=CUSTOMSTYLE_EMPHASIS)
+        Theme.applySciStyle(self.text, 'root/editor/strong', code=CUSTOMSTYLE_STRONG)
+        Theme.applySciStyle(self.text, 'root/editor/code', code=CUSTOMSTYLE_CODE)
+        Theme.applySciStyle(self.text, 'root/editor/link', code=CUSTOMSTYLE_LINK)
+        Theme.applySciStyle(self.text, 'root/editor/image', code=CUSTOMSTYLE_IMAGE)
+        Theme.applySciStyle(self.text, 'root/editor/list', code=CUSTOMSTYLE_LIST)
+        Theme.applySciStyle(self.text, 'root/editor/quote', code=CUSTOMSTYLE_QUOTE)
+        Theme.applySciStyle(self.text, 'root/editor/table', code=CUSTOMSTYLE_TABLE)
+        Theme.applySciStyle(self.text, 'root/editor/code/keyword', code=CUSTOMSTYLE_CODE_KEYWORD)
+        Theme.applySciStyle(self.text, 'root/editor/code/string', code=CUSTOMSTYLE_CODE_STRING)
+        Theme.applySciStyle(self.text, 'root/editor/code/comment', code=CUSTOMSTYLE_CODE_COMMENT)
+        Theme.applySciStyle(self.text, 'root/editor/code/number', code=CUSTOMSTYLE_CODE_NUMBER)
         
     
     # Opens a file for editing
     def openFile(self, path):
 
-        # Check if save timer was running
-        if self.saveTimer.IsRunning():
-
-            # Cancel save timer
-            self.saveTimer.Stop()
+        # Stop loading the previous note, save any unsaved changes now, and compact its journal
+        partial = self.cancelLoad()
+        self.autosave.flush()
+        self.closeJournal()
 
-            # Save now
-            self.save()
+        # Keep the previous note's document for later, unless only part of it was loaded, and stop styling it
+        if partial:
+            self.dropCachedNote(self.currentFile)
+        else:
+            self.cacheNote()
+        self.backgroundLexer.cancel()
+        self.idleStylePos = None
 
         # Store file path
         self.currentFile = path
 
-        # Open file
-        with open(self.currentFile) as file:
+        # If the file is still being saved, wait for it so we don't read an old version
+        self.writer.wait(path)
+
+        # Remember its modification time, so we can tell when something else changes it
+        self.currentFileTime = os.stat(path).st_mtime_ns
+
+        # Switch to the cached document if we have one
+        restored = self.restoreNote(path)
+        if Instrumentation.enabled:
+            Instrumentation.increment('noteCache.hits' if restored else 'noteCache.misses')
+        if restored:
+            self.updateTitle()
+            return
+
+        # Create a new document
+        self.newDocument()
+
+        # Check if it's a large note
+        size = os.path.getsize(path)
+        readOnly = self.readOnlySize > 0 and size >= self.readOnlySize
+        if readOnly or (self.progressiveLoadSize > 0 and size >= self.progressiveLoadSize):
+
+            # Load it a piece at a time
+            self.startLoad(path, size, readOnly)
+
+        else:
 
-            # Read file contents
-            content = file.read()
+            # Open file
+            with open(self.currentFile) as file:
 
-            # Set editor content
-            self.text.SetText(content)
+                # Read file contents
+                content = file.read()
+
+                # Set editor content
+                self.text.SetText(content)
+
+            # Done
+            self.finishOpen()
+
+        # Set filename label
+        self.updateTitle()
+
+
+    # Called when the note's content has been loaded
+    def finishOpen(self):
+
+        # The content matches the file, so there's nothing to save
+        self.text.SetSavePoint()
+        self.autosave.markClean()
+        self.startJournal()
+
+
+    # Starts a journal if the note is large enough
+    def startJournal(self):
+        if self.journalSize > 0 and not self.text.GetReadOnly() and self.text.GetLength() >= self.journalSize:
+            self.journal = EditJournal(self.journalFolder, self.currentFile, self.text.GetText())
+            self.journalCompactTime = time.monotonic()
+
+
+    # Switches the editor to a new, empty document
+    def newDocument(self):
+
+        # Create the document. The editor holds a reference to it, so we can release ours.
+        doc = self.text.CreateDocument()
+        self.text.SetDocPointer(doc)
+        self.text.ReleaseDocument(doc)
+        self.text.SetCodePage(wx.stc.STC_CP_UTF8)
+
+        # Reset styling state, and create a new block model
+        self.lexer.checkpoints = [0]
+        self.lexer.version += 1
+        self.document = MarkdownDocument(self.text.GetLine, self.text.GetLineCount, self.text.PositionFromLine)
+
+
+    # Stores the current note's document in the cache, along with its styling state and scroll position
+    def cacheNote(self):
+
+        # Don't cache notes which are still loading, or have been moved or deleted
+        if not self.currentFile or self.loadJob or self.noteCacheCount <= 0 or not os.path.exists(self.currentFile):
+            return
+
+        # Take a reference to the document, so it's kept when the editor switches to another one
+        doc = self.text.GetDocPointer()
+        self.text.AddRefDocument(doc)
+
+        # If the note was being styled in the background, finish styling it while idle when it's shown again
+        idleStylePos = self.idleStylePos
+        if idleStylePos is None and self.backgroundLexer.isRunning():
+            idleStylePos = self.lexer.checkpoints[-1]
+
+        # Store it
+        note = CachedNote(doc, os.stat(self.currentFile).st_mtime_ns, self.text.GetLength())
+        note.checkpoints = self.lexer.checkpoints
+        note.document = self.document
+        note.idleStylePos = idleStylePos
+        note.firstLine = self.text.GetFirstVisibleLine()
+        note.anchor = self.text.GetAnchor()
+        note.caret = self.text.GetCurrentPos()
+        self.dropCachedNote(self.currentFile)
+        self.noteCache[self.currentFile] = note
+
+        # Remove the least recently used notes until we're within the limits
+        memory = sum(n.memory() for n in self.noteCache.values())
+        while self.noteCache and (len(self.noteCache) > self.noteCacheCount or memory > self.noteCacheMemory):
+            path, note = self.noteCache.popitem(last=False)
+            self.text.ReleaseDocument(note.doc)
+            memory -= note.memory()
+
+
+    # Switches to the cached document for a note. Returns False if it's not cached, or the file has changed since it was cached.
+    def restoreNote(self, path):
+
+        # Get it from the cache
+        note = self.noteCache.pop(path, None)
+        if not note:
+            return False
+
+        # Check the file hasn't changed, other than by our own saves
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime is None or (mtime != note.mtime and mtime != self.writer.writtenTime(path)):
+            self.text.ReleaseDocument(note.doc)
+            return False
+
+        # Switch to it. The editor takes over our reference.
+        self.text.SetDocPointer(note.doc)
+        self.text.ReleaseDocument(note.doc)
+
+        # Restore styling state and the block model
+        self.lexer.checkpoints = note.checkpoints
+        self.lexer.version += 1
+        self.document = note.document
+        self.idleStylePos = note.idleStylePos
+
+        # Restore selection and scroll position
+        self.text.SetSelection(note.anchor, note.caret)
+        self.text.SetFirstVisibleLine(note.firstLine)
+
+        # Done
+        self.autosave.markClean()
+        self.startJournal()
+        return True
+
+
+    # Removes a note from the cache if it's there
+    def dropCachedNote(self, path):
+        note = self.noteCache.pop(path, None)
+        if note:
+            self.text.ReleaseDocument(note.doc)
+
+
+    # Shows the note's name in the header, with the loading progress or if it's read only
+    def updateTitle(self):
 
         # Remove .md extension from filename
-        filename = os.path.basename(path)
+        filename = os.path.basename(self.currentFile)
         if filename.lower().endswith('.md'):
             filename = filename[:-3]
 
+        # Add status
+        if self.loadJob:
+            filename += ' (loading ' + str(min(99, self.loadJob.progress())) + '%)'
+        elif self.text.GetReadOnly():
+            filename += ' (read only)'
+
         # Set filename label
         self.nameLbl.SetLabelText(filename)
 
 
+    # Starts loading a large note a piece at a time. The loaded part can be edited while the rest loads.
+    def startLoad(self, path, size, readOnly):
+
+        # Clear the editor. Loading isn't recorded in the undo history.
+        self.text.SetUndoCollection(False)
+        self.text.ClearAll()
+        self.text.EmptyUndoBuffer()
+        self.text.SetUndoCollection(True)
+        self.text.SetReadOnly(readOnly)
+
+        # Start loading
+        self.loadJob = FileLoadJob(open(path), size, readOnly)
+        wx.CallAfter(self.loadMore, self.loadJob)
+
+
+    # Loads the next part of a large note, until we run out of time or user input arrives
+    def loadMore(self, job):
+
+        # Stop if the load was cancelled
+        if self.loadJob is not job:
+            return
+
+        # Add chunks to the editor
+        deadline = time.perf_counter() + LOAD_TIME
+        while True:
+
+            # Check if done
+            chunk = job.file.read(LOAD_CHUNK_READ_ONLY if job.readOnly else LOAD_CHUNK)
+            if not chunk:
+                self.finishLoad()
+                return
+
+            # Add it
+            self.appendLoaded(chunk)
+
+            # Give the event loop a turn if needed
+            if time.perf_counter() >= deadline or wx.GetApp().Pending():
+                break
+
+        # Show progress, and continue after pending events
+        self.updateTitle()
+        wx.CallAfter(self.loadMore, job)
+
+
+    # Adds loaded text to the end of the editor
+    def appendLoaded(self, chunk):
+
+        # Append it without recording it in the undo history or marking the load as edited
+        self.loadJob.appending = True
+        self.text.SetUndoCollection(False)
+        self.text.SetReadOnly(False)
+        self.text.AppendText(chunk)
+        self.text.SetReadOnly(self.loadJob.readOnly)
+        self.text.SetUndoCollection(True)
+        self.loadJob.appending = False
+
+
+    # Called when a large note has finished loading
+    def finishLoad(self):
+
+        # Close the file
+        job = self.loadJob
+        job.file.close()
+        self.loadJob = None
+
+        # Done, and save now if it was edited while loading
+        self.finishOpen()
+        if job.edited:
+            self.save()
+        self.updateTitle()
+
+
+    # Stops loading a large note. If the loaded part was edited, the rest is loaded first so the edits can be saved, unless keepEdits is False.
+    # Returns True if the editor was left with only part of the note.
+    def cancelLoad(self, keepEdits=True):
+
+        # Stop if not loading
+        job = self.loadJob
+        if not job:
+            return False
+
+        # Finish loading if the edits need to be kept
+        if keepEdits and job.edited:
+            chunk = job.file.read()
+            if chunk:
+                self.appendLoaded(chunk)
+            self.finishLoad()
+            return False
+
+        # Stop loading
+        job.file.close()
+        self.loadJob = None
+        return True
+
+
     # Called when the contexts of the text area changes
     def onTextChange(self, e):
 
+        # Note changes made by the user while a large note is loading
+        if self.loadJob and not self.loadJob.appending:
+            self.loadJob.edited = True
+
         # Schedule a save
-        self.saveTimer.Start(1000)
+        self.autosave.markDirty()
+
 
+    # Called when text is inserted or deleted in the text area
+    def onTextModified(self, e):
 
-    # Saves the document.
+        # Tokenizer state after this position is no longer valid
+        if e.GetModificationType() & (wx.stc.STC_MOD_INSERTTEXT | wx.stc.STC_MOD_DELETETEXT):
+
+            # Record the edit in the journal
+            if self.journal:
+                if e.GetModificationType() & wx.stc.STC_MOD_INSERTTEXT:
+                    self.journal.insert(e.GetPosition(), e.GetText())
+                else:
+                    self.journal.delete(e.GetPosition(), e.GetLength())
+
+            self.lexer.invalidate(e.GetPosition())
+            if self.idleStylePos is not None:
+                self.idleStylePos = min(self.idleStylePos, e.GetPosition())
+
+            # Reparse the changed blocks. The line containing the change is replaced by itself plus any added lines, or deleted lines are merged into it.
+            linesAdded = e.GetLinesAdded()
+            firstLine = self.text.LineFromPosition(e.GetPosition())
+            self.document.update(firstLine, 1 + max(0, -linesAdded), 1 + max(0, linesAdded))
+
+        # Let other handlers see it
+        e.Skip()
+
+
+    # Saves the document. The file is written in the background, call writer.wait() to wait for it.
     def save(self):
 
-        # Stop if no active document
-        if not self.currentFile:
+        # Stop if no active document, or it's read only or hasn't finished loading
+        if not self.currentFile or self.loadJob or self.text.GetReadOnly():
+            return
+
+        # Nothing is left to autosave
+        self.autosave.markClean()
+
+        # Take a snapshot of the content. If there's a journal, start a new segment from here, and remove the old ones once the snapshot is written.
+        text = self.text.GetText()
+        onWritten = None
+        if self.journal:
+            retired = self.journal.rotate(text)
+            onWritten = lambda: removeFiles(retired)
+            self.journalCompactTime = time.monotonic()
+
+        # Queue it to be written
+        self.writer.save(self.currentFile, text, onWritten)
+        self.text.SetSavePoint()
+
+
+    # Saves the document if the text is different from when it was last saved, for example not if an edit was undone.
+    # Returns False if there was nothing to save.
+    def saveIfModified(self):
+
+        # Check if modified. Notes which are loading are saved once loaded.
+        if not self.currentFile or self.loadJob or not self.text.GetModify():
+            return False
+
+        # If there's a journal the edits are already in it, so just make sure they're on disk, and only compact it every so often
+        if self.journal and time.monotonic() - self.journalCompactTime < self.journalCompactInterval:
+            if self.writer.fsyncPolicy != FSYNC_NONE:
+                self.journal.sync()
+            self.text.SetSavePoint()
+            return True
+
+        # Save it
+        self.save()
+        return True
+
+
+    # Compacts the journal into the note if it has any edits, and closes it
+    def closeJournal(self):
+
+        # Stop if there's no journal
+        if not self.journal:
             return
 
-        # Stop save timer
-        if self.saveTimer.IsRunning():
-            self.saveTimer.Stop()
+        # Compact it
+        if self.journal.records > 0:
+            self.save()
+
+        # Close it
+        self.journal.close()
+        self.journal = None
+
+
+    # Called on the UI thread when a note has been written
+    def onSaved(self, path, error):
+
+        # Let the user know if it failed
+        if error:
+            wx.MessageBox("Unable to save '" + os.path.basename(path) + "'.\n\n" + str(error), caption="Save Failed", style=wx.OK | wx.CENTER | wx.ICON_ERROR, parent=self)
+            return
+
+        # Let the owner know, so the file list and search index can be updated
+        if self.onFileSaved:
+            self.onFileSaved(path)
 
-        # Open the file for writing
-        with open(self.currentFile, 'w') as file:
 
-            # Write the content
-            text = self.text.GetText()
-            file.write(text)
-            
+    # Called when the current note may have been changed on disk by another app. It's reloaded if it has, unless it has unsaved edits,
+    # in which case they're kept and will overwrite the other app's changes when saved.
+    def reloadIfChanged(self):
+
+        # Stop if no note is open, or it's being saved right now
+        path = self.currentFile
+        if not path or self.writer.isPending(path):
+            return
+
+        # Check if it was changed by something other than our own saves. It may have been removed, which the file list deals with.
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self.currentFileTime or mtime == self.writer.writtenTime(path):
+            return
+
+        # Keep unsaved edits
+        if self.text.GetModify() or self.autosave.isDirty() or (self.journal and self.journal.records > 0) or (self.loadJob and self.loadJob.edited):
+            return
+
+        # Reload it, keeping the selection and scroll position where possible
+        firstLine = self.text.GetFirstVisibleLine()
+        anchor = self.text.GetAnchor()
+        caret = self.text.GetCurrentPos()
+        self.cancelLoad(keepEdits=False)
+        self.closeJournal()
+        self.dropCachedNote(path)
+        self.currentFile = None
+        self.openFile(path)
+        self.text.SetSelection(anchor, caret)
+        self.text.SetFirstVisibleLine(firstLine)
+
 
     # Called by Scintilla when we have text which needs to be styled
     def onStyleNeeded(self, event):
-        
-        # Get range of text which needs to be styled
-        startPos = self.text.GetEndStyled()
-        lineNum = self.text.LineFromPosition(startPos)
-        startPos = self.text.PositionFromLine(lineNum)
+
+        # Get requested end position
         endPos = event.GetPosition()
 
-        # Style this line
-        stylePos = startPos
-        self.text.StartStyling(stylePos, 31)
+        # If we're styling while idle and the request is close to where we're up to, style up to it right away
+        if self.idleStylePos is not None and endPos - self.lexer.restartPosition(self.idleStylePos) <= SYNC_STYLE_DISTANCE:
+            self.idleStylePos = max(self.idleStylePos, self.lexer.styleTo(endPos, startPos=self.idleStylePos))
+            return
 
-        # Go through entire document until we get to where we need to be
-        for token in MarkdownTokens(self.text.GetText()):
+        # Style right away if there's a checkpoint nearby, and the note isn't being styled in the background
+        if not self.isStylingPending() and endPos - self.lexer.restartPosition() <= SYNC_STYLE_DISTANCE:
+            self.lexer.styleTo(endPos)
+            return
 
-            # Stop if current token is before our requested region
-            if token.toIndex <= stylePos:
-                continue
+        # Start styling the rest of the note. Large notes are styled on a background thread, others while idle.
+        if not self.isStylingPending():
+            if self.backgroundLexingSize > 0 and self.text.GetLength() >= self.backgroundLexingSize:
+                self.backgroundLexer.start()
+            else:
+                self.idleStylePos = self.lexer.restartPosition()
 
-            # Stop if we've gone past the end of our requested style region
-            if token.fromIndex >= endPos:
-                break
+        # Meanwhile, style the visible part now
+        self.styleVisible(endPos)
+
+
+    # Returns True if the note is being styled in the background or while idle
+    def isStylingPending(self):
+        return self.idleStylePos is not None or self.backgroundLexer.isRunning()
+
+
+    # Styles the visible text up to the requested position, without waiting for the text before it to be styled
+    def styleVisible(self, endPos):
+
+        # Start at the first visible line, unless the requested range is before it
+        firstLine = self.text.DocLineFromVisible(self.text.GetFirstVisibleLine())
+        startPos = max(self.text.GetEndStyled(), self.text.PositionFromLine(firstLine))
+        if startPos >= endPos:
+            startPos = self.text.GetEndStyled()
+
+        # Style it
+        self.lexer.styleRange(startPos, endPos)
 
-            # Get length of this token
-            length = token.toIndex - stylePos
 
-            # Get style code
-            code = STYLE_DEFAULT
-            if token.typeName == 'header1': code = CUSTOMSTYLE_HEADER1
-            if token.typeName == 'header2': code = CUSTOMSTYLE_HEADER2
-            if token.typeName == 'header3': code = CUSTOMSTYLE_HEADER3
-            if token.typeName == 'unimportant': code = CUSTOMSTYLE_UNIMPORTANT
+    # Called when the app is idle
+    def onIdle(self, e):
 
-            # Apply style
-            stylePos += length
-            self.text.SetStyling(length, code)
+        # Stop if there's nothing to style
+        if self.idleStylePos is None:
+            return
+
+        # Style in small chunks until we run out of time, or user input arrives
+        deadline = time.perf_counter() + IDLE_STYLE_TIME
+        while time.perf_counter() < deadline and not wx.GetApp().Pending():
+
+            # Check if done
+            length = self.text.GetLength()
+            if self.idleStylePos >= length:
+                self.idleStylePos = None
+                return
+
+            # Style the next chunk
+            self.idleStylePos = self.lexer.styleTo(min(length, self.idleStylePos + IDLE_STYLE_CHUNK), startPos=self.idleStylePos)
+
+        # Ask for another idle event to continue
+        e.RequestMore()
+
+
+    # Shows the outline of the note under the file name
+    def showOutline(self):
+
+        # Stop if there are no headings
+        if not self.currentFile or self.document.headingCount() == 0:
+            return
+
+        # Show it
+        currentLine = self.text.LineFromPosition(self.text.GetCurrentPos())
+        popup = OutlinePopup(self, self.document, currentLine, self.jumpToHeading)
+        popup.Position(self.nameLbl.ClientToScreen(wx.Point(0, self.nameLbl.GetSize().height)), wx.Size(0, 0))
+        popup.Popup()
+
+
+    # Moves the cursor to a heading in the outline, and scrolls it to the top
+    def jumpToHeading(self, index):
+        level, text, line, position = self.document.heading(index)
+        self.text.GotoPos(position)
+        self.text.SetFirstVisibleLine(self.text.VisibleFromDocLine(line))
+        self.text.SetFocus()
 
 
     # Called when the use presses the rename button
@@ -257,14 +802,16 @@ class EditorPanel(wx.Panel):
         oldPath = self.currentFile
         newPath = os.path.abspath(os.path.join(oldPath, '..', newFilename))
 
-        # Save now, just in case
-        self.save()
+        # Save now, just in case, and wait for it to be written. If only part of it was loaded there are no edits, and saving would cut it short.
+        if not self.cancelLoad():
+            self.save()
+        self.writer.wait(oldPath)
 
         # Move file
         os.rename(oldPath, newPath)
 
-        # Inform file list to reload.
-        self.onFileRenamed(newPath)
+        # Inform file list it has moved
+        self.onFileRenamed(oldPath, newPath)
 
         # Open it again
         self.openFile(newPath)
@@ -321,14 +868,16 @@ class EditorPanel(wx.Panel):
         oldPath = self.currentFile
         newPath = os.path.abspath(os.path.join(folder, os.path.basename(self.currentFile)))
 
-        # Save now, just in case
-        self.save()
+        # Save now, just in case, and wait for it to be written. If only part of it was loaded there are no edits, and saving would cut it short.
+        if not self.cancelLoad():
+            self.save()
+        self.writer.wait(oldPath)
 
         # Move file
         os.rename(oldPath, newPath)
 
-        # Inform file list to reload
-        self.onFileRenamed(newPath)
+        # Inform file list it has moved
+        self.onFileRenamed(oldPath, newPath)
 
         # Open it again
         self.openFile(newPath)
@@ -342,12 +891,77 @@ class EditorPanel(wx.Panel):
         if not response == wx.OK:
             return
 
-        # Cancel save timer if any
-        if self.saveTimer.IsRunning():
-            self.saveTimer.Stop()
+        # Cancel any autosave, and stop loading
+        self.autosave.markClean()
+        self.cancelLoad(keepEdits=False)
+
+        # Drop any pending save, and wait for one in progress so it doesn't recreate the file
+        self.writer.cancel(self.currentFile)
+        self.writer.wait(self.currentFile)
+
+        # Remove the journal
+        if self.journal:
+            self.journal.discard()
+            self.journal = None
 
         # Delete it!
         send2trash(self.currentFile)
 
-        # Get file list to refresh and open us another file
-        self.onFileDeleted()
\ No newline at end of file
+        # Get file list to remove it and open us another file
+        self.onFileDeleted(self.currentFile)
+
+
+
+# Timers for the hot paths
+Instrumentation.instrument(EditorPanel, 'onStyleNeeded', 'EditorPanel.onStyleNeeded', lambda self, event: self.currentFile)
+Instrumentation.instrument(EditorPanel, 'save', 'EditorPanel.save', lambda self: self.currentFile)
+Instrumentation.instrument(EditorPanel, 'openFile', 'EditorPanel.openFile', lambda self, path: path)
+
+
+# A large note which is being loaded a piece at a time
+class FileLoadJob:
+
+    # Constructor
+    def __init__(self, file, size, readOnly):
+
+        # File being read, and its size in bytes
+        self.file = file
+        self.size = size
+
+        # True if the note is opened read only
+        self.readOnly = readOnly
+
+        # True while loaded text is being added to the editor, and once the user has edited the loaded part
+        self.appending = False
+        self.edited = False
+
+
+    # Returns the percentage of the file which has been read
+    def progress(self):
+        return int(self.file.buffer.tell() * 100 / self.size) if self.size else 100
+
+
+
+# A note whose document is kept in the cache
+class CachedNote:
+
+    # Constructor
+    def __init__(self, doc, mtime, length):
+
+        # Scintilla document, the file's modification time when it was cached, and the document length in bytes
+        self.doc = doc
+        self.mtime = mtime
+        self.length = length
+
+        # Lexer checkpoints, block model, idle styling position, and view state
+        self.checkpoints = None
+        self.document = None
+        self.idleStylePos = None
+        self.firstLine = 0
+        self.anchor = 0
+        self.caret = 0
+
+
+    # Returns the approximate memory used by the document, which stores a style byte for each byte of text
+    def memory(self):
+        return self.length * 2
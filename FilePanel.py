@@ -2,9 +2,20 @@
 import wx
 import os
 import sys
+import time
 from Theme import *
 import Config
 import AppInfo
+import Instrumentation
+from PerformanceOverlay import *
+from NoteIndex import *
+from DescriptionLoader import *
+from FolderScanner import *
+from FolderWatcher import *
+from NoteList import *
+
+# Number of rows before and after the visible ones whose descriptions are read ahead of time
+PREFETCH_ROWS = 40
 
 
 class FilePanel(wx.VListBox):
@@ -24,6 +35,20 @@ class FilePanel(wx.VListBox):
         # Custom events
         self.onFileOpen = None
         self.onClose = None
+        self.onFoldersChanged = None
+
+        # Saved note metadata and text, used to fill the list at startup and to search. Changes found while the index is being checked
+        # are kept as { path: kind } and applied again once it's done.
+        self.index = None
+        if Config.getboolean('ui', 'note_index', True):
+            self.index = NoteIndex(os.path.join(Config.path, 'index.sqlite'), wx.CallAfter)
+            self.index.onUpdated = self.onIndexUpdated
+        self.indexLoaded = False
+        self.indexChanges = {}
+
+        # Current search, or None if not searching. The selected file is kept here if it's not in the search results.
+        self.searchQuery = None
+        self.hiddenFile = None
 
         # Header bar panel
         self.header = wx.Panel(self)
@@ -46,8 +71,17 @@ class FilePanel(wx.VListBox):
         # openBtn.Bind(wx.EVT_LEFT_DOWN, lambda e: self.openNote())
         # toolbarSizer.Add(openBtn)
 
+        # Add search box, if search is available
+        if self.index and self.index.searchable:
+            self.searchBox = wx.SearchCtrl(self.header)
+            self.searchBox.ShowCancelButton(True)
+            self.searchBox.Bind(wx.EVT_TEXT, lambda e: self.onSearchChanged())
+            self.searchBox.Bind(wx.EVT_SEARCHCTRL_CANCEL_BTN, lambda e: self.searchBox.SetValue(''))
+            toolbarSizer.Add(self.searchBox, proportion=1, flag=wx.ALIGN_CENTER_VERTICAL)
+
         # Add flex space
-        toolbarSizer.AddStretchSpacer()
+        else:
+            toolbarSizer.AddStretchSpacer()
 
         # Add settings button
         self.settingsBtn = wx.StaticBitmap(self.header, bitmap=Theme.getIcon('settings', 16), size=wx.Size(44, 44))
@@ -58,8 +92,19 @@ class FilePanel(wx.VListBox):
         # Build menu
         self.menu = self.buildMenu()
 
-        # Store first line of each file
-        self.descriptionCache = {}
+        # Reads the first line of each file in the background. The visible rows they were last read for are kept, so they're only
+        # requested once per scroll position.
+        self.descriptions = DescriptionLoader(wx.CallAfter, self.onDescriptionLoaded, cacheSize=Config.getint('ui', 'description_cache_count', 20000))
+        self.prefetchRange = None
+
+        # Contents of each folder and its subfolders from the last refresh, as (tree, { path: (mtime, size) }) tuples by folder, where
+        # tree is the FolderScanner listing of each subfolder. The tree is None if the contents came from the note index and are still
+        # being checked.
+        self.folderCache = {}
+        self.scanner = FolderScanner(wx.CallAfter, Config.getint('ui', 'scan_depth', 8), Config.get('ui', 'scan_ignore', DEFAULT_IGNORE))
+
+        # Notes shown in the list, in the chosen order
+        self.notes = NoteList(Config.get('ui', 'sort', SORT_MODIFIED))
 
         # Refresh file list (in the next run loop)
         wx.CallAfter(lambda: self.refreshFiles())
@@ -80,6 +125,10 @@ class FilePanel(wx.VListBox):
         smenu = self.buildFolderMenu(menu)
         menu.AppendSubMenu(smenu, text="Folders")
 
+        # Create sort order submenu
+        smenu = self.buildSortMenu(menu)
+        menu.AppendSubMenu(smenu, text="Sort by")
+
         # Create close to task tray option
         closeTrayItem = menu.Append(-1, item='Close to system tray', kind=wx.ITEM_CHECK)
         closeTrayItem.Check(Config.getboolean('ui', 'close_to_tray'))
@@ -92,6 +141,10 @@ class FilePanel(wx.VListBox):
         smenu = self.buildAboutMenu(menu)
         menu.AppendSubMenu(smenu, text="About")
 
+        # Performance overlay
+        itm = menu.Append(-1, item="Performance")
+        menu.Bind(wx.EVT_MENU, lambda e: PerformanceOverlay(self.GetTopLevelParent()).Show(), id=itm.GetId())
+
         # Exit button
         itm = menu.Append(-1, item="Quit")
         menu.Bind(wx.EVT_MENU, lambda e: self.onClose(), id=itm.GetId())
@@ -153,6 +206,34 @@ class FilePanel(wx.VListBox):
         return menu
 
 
+    # Creates the sort order menu
+    def buildSortMenu(self, mainMenu):
+
+        # Create menu
+        menu = wx.Menu()
+
+        # Add an option for each order
+        for order, label in ((SORT_MODIFIED, 'Date modified'), (SORT_TITLE, 'Name'), (SORT_FOLDER, 'Folder')):
+            itm = menu.Append(-1, item=label, kind=wx.ITEM_RADIO)
+            itm.Check(order == self.notes.order)
+            mainMenu.Bind(wx.EVT_MENU, lambda e, order=order: self.setSortOrder(order), id=itm.GetId())
+
+        # Done
+        return menu
+
+
+    # Called to change the order of the file list
+    def setSortOrder(self, order):
+
+        # Update config
+        Config.set('ui', 'sort', order)
+
+        # Sort the list, keeping the selected file selected
+        currentFile = self.selectedFile()
+        self.notes.setOrder(order)
+        self.updateRows(currentFile)
+
+
     # Called to toggle the close to tray menu option
     def toggleCloseToTray(self, menuitem):
 
@@ -242,36 +323,265 @@ class FilePanel(wx.VListBox):
         # Add the config folder to it
         folders.insert(0, Config.path)
 
+        # Let the owner watch the folders. This is done before listing them, so changes made while they're listed aren't missed.
+        self.watchFolders(folders)
+
         # Get currently selected file, if any
-        idx = self.GetSelection()
-        currentFile = None
-        if idx != wx.NOT_FOUND and idx-1 >= 0 and idx-1 < len(self.files):
-            currentFile = self.files[idx-1]
+        currentFile = self.selectedFile()
 
-        # Load files
-        self.files = []
-        self.descriptionCache = {}
+        # Set the order of the folders when sorting by folder
+        self.notes.setFolders([folder for folder in folders if folder])
+
+        # On the first refresh, start with the folder contents saved in the index, and check them in the background
+        if self.index and not self.indexLoaded:
+            self.loadIndex([folder for folder in folders if folder])
+
+        # Load files. The notes which changed are collected as { path: folder }, so only they are moved in the list.
+        changes = {}
+        folderCache = {}
         for folder in folders:
 
             # Skip blank folders
             if not folder:
                 continue
 
-            # Go through contents of the folder
-            for filename in os.listdir(folder):
+            # Contents from the index which are still being checked are used as they are
+            if Instrumentation.enabled:
+                startTime = time.perf_counter_ns()
+            cached = self.folderCache.get(folder)
+            if cached and cached[0] is None:
+                tree, entries = cached
+
+            # List folders which have changed since the last refresh. Adding, removing, renaming or atomically saving a file changes
+            # the folder's mtime, so unchanged folders only cost one stat call each. New subfolders are walked in the background.
+            else:
+                tree, entries = cached or ({}, {})
+                walk, changed = self.scanner.refresh(folder, tree, entries)
+                if walk:
+                    self.scanner.walk(folder, walk, self.onFolderScanned)
+                self.reindex(folder, changed)
+                changes.update(dict.fromkeys(changed, folder))
+
+            # Store its files
+            folderCache[folder] = (tree, entries)
+
+            # Record how long the folder took, so slow folders can be found
+            if Instrumentation.enabled:
+                Instrumentation.record('FilePanel.listFolder', time.perf_counter_ns() - startTime, folder)
+
+        # Remove the files of folders which are no longer listed
+        for folder, (tree, entries) in self.folderCache.items():
+            if folder not in folderCache:
+                changes.update(dict.fromkeys(entries, folder))
+
+        # Store folder contents for next time, and watch any new subfolders
+        self.folderCache = folderCache
+        self.syncNotes(changes)
+        self.watchFolders()
+
+        # Update the list
+        self.updateRows(currentFile, then_select)
+
+
+    # Called with the listings of subfolders found by a background walk
+    def onFolderScanned(self, root, batch, done):
+
+        # Stop if the folder has been removed from the list, or is being checked against the index
+        cached = self.folderCache.get(root)
+        if not cached or cached[0] is None:
+            return
+
+        # Add the listings, skipping folders which have been listed since or whose parent has been removed
+        tree, entries = cached
+        changed = set()
+        for folder, listing in batch.items():
+            if folder not in tree and os.path.dirname(folder) in tree:
+                self.scanner.applyListing(tree, entries, folder, listing, changed)
+        self.reindex(root, changed)
+
+        # Update the list, and watch the new subfolders
+        currentFile = self.selectedFile()
+        self.syncNotes(dict.fromkeys(changed, root))
+        self.updateRows(currentFile)
+        self.watchFolders()
+
+
+    # Updates the list from the changes found by a folder watcher, as a { path: kind } dict, and selects then_select if set. If changes
+    # is None, everything is rescanned.
+    def applyChanges(self, changes, then_select=None):
+
+        # Rescan if needed
+        if changes is None:
+            self.refreshFiles(then_select)
+            return
+
+        # Get currently selected file, if any
+        currentFile = self.selectedFile()
+
+        # Update the listing of each changed file's folder. The folder's mtime is left as it was, so a full refresh still lists it again.
+        indexed = {}
+        for path, kind in changes.items():
+
+            # Skip files which aren't in a listed folder
+            path = os.path.abspath(path)
+            folder = self.folderOf(path)
+            if folder is None:
+                continue
+
+            # If the folder is still being checked against the index, apply the change again once it's done
+            if self.folderCache[folder][0] is None:
+                self.indexChanges[path] = kind
+
+            # Update its entry, and reindex it
+            if self.updateEntry(folder, path):
+                indexed[path] = folder
+
+        # Update the index
+        if self.index and indexed:
+            self.index.update(indexed)
+
+        # Update the list
+        self.syncNotes(indexed)
+        self.updateRows(currentFile, then_select)
+
+
+    # Updates or removes the entry of a file in a folder's listing, returning False if it's in a subfolder which isn't scanned. Its
+    # description is keyed on its mtime, so it's read again if it changed.
+    def updateEntry(self, folder, path):
+
+        # Find the listing of its subfolder, unless the contents came from the index
+        tree, entries = self.folderCache[folder]
+        listing = None
+        if tree is not None:
+            listing = tree.get(os.path.dirname(path))
+            if listing is None:
+                return False
+
+        # Update or remove it
+        try:
+            stat = os.stat(path)
+            entries[path] = (stat.st_mtime_ns, stat.st_size)
+            if listing:
+                listing.files[path] = entries[path]
+        except OSError:
+            entries.pop(path, None)
+            if listing:
+                listing.files.pop(path, None)
+
+        # Done
+        return True
+
+
+    # Moves notes which were added, changed or removed to their place in the list, as a { path: folder } dict
+    def syncNotes(self, paths):
+
+        # Get each note's current entry
+        changes = {}
+        for path, folder in paths.items():
+            cached = self.folderCache.get(folder)
+            stamp = cached[1].get(path) if cached else None
+            if stamp:
+                changes[path] = (folder, stamp[0])
+
+            # If a note was removed from one folder but is still listed from another nested one, keep it
+            elif self.notes.folder(path) in (folder, None):
+                changes[path] = None
+
+        # Update the list
+        self.notes.apply(changes)
+
+
+    # Fills the folder contents and descriptions from the note index, and starts checking them against the folders
+    def loadIndex(self, folders):
 
-                # Check if file is markdown
-                if not filename.lower().endswith('.md'):
-                    continue
+        # Load it
+        self.indexLoaded = True
+        loaded = {}
+        for folder, (entries, descriptions) in self.index.load(folders).items():
+            self.folderCache[folder] = (None, entries)
+            loaded.update(dict.fromkeys(entries, folder))
+            for path, description in descriptions.items():
+                self.descriptions.store(path, entries[path][0], description)
 
-                # Get absolute path to file
-                path = os.path.abspath(os.path.join(folder, filename))
+        # Add the notes to the list
+        self.syncNotes(loaded)
 
-                # Add it
-                self.files.append(path)
+        # Check it in the background. Folders which weren't in the index are listed now instead.
+        self.index.reconcile([folder for folder in folders if folder in self.folderCache], folders, self.scanner.scan, self.onFolderIndexed)
+
+
+    # Called when the index has checked a folder, with its actual contents and the descriptions of new and changed notes
+    def onFolderIndexed(self, folder, tree, entries, descriptions):
+
+        # Stop if the folder has been removed from the list
+        cached = self.folderCache.get(folder)
+        if not cached or cached[0] is not None:
+            return
+
+        # Store descriptions of changed notes
+        currentFile = self.selectedFile()
+        for path, description in descriptions.items():
+            self.descriptions.store(path, entries[path][0], description)
+
+        # Store the folder contents, and move the notes which were added, changed or removed since the index was saved
+        previous = cached[1]
+        self.folderCache[folder] = (tree, entries)
+        self.syncNotes({ path: folder for path in previous.keys() | entries.keys() if previous.get(path) != entries.get(path) })
+
+        # Watch its subfolders
+        self.watchFolders()
+
+        # Apply changes the folder watcher found while the folder was being checked
+        changes = { path: kind for path, kind in self.indexChanges.items() if self.folderOf(path) == folder }
+        for path in changes:
+            del self.indexChanges[path]
+        if changes:
+            self.applyChanges(changes)
+        else:
+            self.updateRows(currentFile)
+
+
+    # Queues notes which were added, changed or removed in a folder to be reindexed
+    def reindex(self, folder, paths):
+        if self.index and paths:
+            self.index.update({ path: folder for path in paths })
+
+
+    # Tells the owner which folders to watch, which are the note folders and all the subfolders found in them
+    def watchFolders(self, folders=None):
+        if self.onFoldersChanged:
+            roots = [os.path.abspath(folder) for folder in (folders or self.folderCache) if folder]
+            subfolders = [subfolder for tree, entries in self.folderCache.values() if tree for subfolder in tree]
+            self.onFoldersChanged(list(dict.fromkeys(roots + subfolders)))
+
+
+    # Returns the note folder containing a path, or None if it's not in one. If folders are nested, the innermost one is used.
+    def folderOf(self, path):
+        found = None
+        for folder in self.folderCache:
+            root = os.path.abspath(folder)
+            if path.startswith(root + os.sep) and (found is None or len(root) > len(os.path.abspath(found))):
+                found = folder
+        return found
+
+
+    # Returns the path of the selected file, or None if nothing is selected
+    def selectedFile(self):
+        idx = self.GetSelection()
+        if idx != wx.NOT_FOUND and idx-1 >= 0 and idx-1 < len(self.notes):
+            return self.notes[idx-1]
+        return None
+
+
+    # Updates the rows after the file list has changed, keeping the selected file selected, or selecting then_select
+    def updateRows(self, currentFile, then_select=None):
+
+        # Get the file to select
+        currentFile = then_select or currentFile or self.hiddenFile
+        self.hiddenFile = None
 
         # If there are no files, add the starter file now
-        if len(self.files) == 0:
+        if len(self.notes) == 0 and not self.searchQuery:
 
             # Create default note if not exists
             notePath = os.path.join(Config.path, "My Notes.md")
@@ -280,31 +590,78 @@ class FilePanel(wx.VListBox):
                     file.write("# Welcome to MDNotes!\nThis area is entirely yours, go ahead and write stuff here.")
 
             # Add to file list
-            self.files.append(notePath)
+            folder = self.folderOf(notePath)
+            if folder and self.updateEntry(folder, notePath):
+                self.reindex(folder, [notePath])
+                self.syncNotes({ notePath: folder })
 
         # Update number of rows
-        self.SetRowCount(len(self.files) + 1)
+        rowCount = self.GetRowCount()
+        if rowCount != len(self.notes) + 1:
+            self.SetRowCount(len(self.notes) + 1)
+
+        # Redraw the rows which have changed, and read descriptions for the new rows when they're drawn. Every row after the first
+        # change may have moved, but only the visible ones are drawn. If rows were removed, the space below the last one is cleared too.
+        firstChanged = self.notes.takeChanged()
+        if firstChanged is not None:
+            self.prefetchRange = None
+            if rowCount > len(self.notes) + 1:
+                self.RefreshAll()
+            else:
+                self.RefreshRows(firstChanged + 1, self.GetVisibleRowsEnd())
+
+        # Keep the selected file selected, since files before it may have been added or removed
+        row = self.notes.rowOf(currentFile)
+        if row is not None:
+            self.SetSelection(row + 1)
+
+        # If the selected file isn't in the search results, keep it open and select it again once the search changes
+        elif self.searchQuery and self.notes.hasNote(currentFile):
+            self.SetSelection(wx.NOT_FOUND)
+            self.hiddenFile = currentFile
+
+        # If nothing is selected, or the selected file has been removed, select the first file
+        else:
 
-        # If we want to open a file, open it
-        if then_select:
+            # If nothing is listed, open the first note without selecting it, so a removed note isn't left open in the editor
+            if len(self.notes) == 0:
+                self.SetSelection(wx.NOT_FOUND)
+                path = self.notes.firstNote()
+                if path:
+                    self.hiddenFile = path
+                    self.onFileOpen(path)
+                return
 
-            # Find it
-            i = self.files.index(then_select)
+            # Find the first file which exists, since files listed from the index may have been removed since
+            i = next((i for i in range(len(self.notes)) if os.path.exists(self.notes[i])), 0)
 
             # Select it
             self.SetSelection(i+1)
 
-        # If nothing is selected, or the selected file has been removed, select the first file
-        elif self.GetSelection() == wx.NOT_FOUND or currentFile not in self.files:
+            # And open it
+            self.onFileOpen(self.notes[i])
 
-            # Select it
-            self.SetSelection(1)
 
-            # And open it
-            self.onFileOpen(self.files[0])
+    # Called when the text in the search box changes
+    def onSearchChanged(self):
+
+        # Store query
+        currentFile = self.selectedFile()
+        self.searchQuery = self.searchBox.GetValue().strip() or None
+
+        # While searching, only show the matching files, best first
+        self.notes.setFilter(self.index.search(self.searchQuery) if self.searchQuery else None)
+        self.updateRows(currentFile)
+
+
+    # Called when notes have been reindexed
+    def onIndexUpdated(self):
 
-        # Redraw UI
-        self.RefreshAll()
+        # Update the search results
+        if self.searchQuery:
+            currentFile = self.selectedFile()
+            self.notes.setFilter(self.index.search(self.searchQuery))
+            self.updateRows(currentFile)
 
 
     # Event: Called when the window is resized
@@ -318,6 +675,32 @@ class FilePanel(wx.VListBox):
         self.header.SetSize(fullSize[0], 44)
 
 
+    # Reads the descriptions of the visible rows and the rows around them in the background, visible rows first
+    def prefetchDescriptions(self):
+
+        # Stop if already requested for these rows
+        first = self.GetVisibleRowsBegin()
+        last = self.GetVisibleRowsEnd()
+        if (first, last) == self.prefetchRange:
+            return
+        self.prefetchRange = (first, last)
+
+        # Get rows, minus the padding row
+        visible = range(max(0, first - 1), min(len(self.notes), last))
+        after = range(visible.stop, min(len(self.notes), visible.stop + PREFETCH_ROWS))
+        before = range(max(0, visible.start - PREFETCH_ROWS), visible.start)
+
+        # Request them
+        self.descriptions.prefetch([(self.notes[i], self.notes.mtime(self.notes[i])) for rows in (visible, after, reversed(before)) for i in rows])
+
+
+    # Called when a description has been read
+    def onDescriptionLoaded(self):
+
+        # Redraw the visible rows. Refreshes are combined, so this is cheap even when many descriptions arrive at once.
+        self.RefreshRows(self.GetVisibleRowsBegin(), self.GetVisibleRowsEnd())
+
+
     # Called to determine the height of each row
     def OnMeasureItem(self, n):
 
@@ -340,38 +723,18 @@ class FilePanel(wx.VListBox):
         n -= 1
 
         # Get file name
-        path = os.path.abspath(self.files[n])
+        path = self.notes[n]
         name = os.path.basename(path)
 
         # Remove .md from filename
         if name[-3:].lower() == '.md':
             name = name[:-3]
 
-        # Get first line of file from the cache
-        description = self.descriptionCache.get(path)
-        if not description:
-
-            # Open file
-            with open(path) as file:
-
-                # Read valid line
-                description = "(none)"
-                for line in file.readlines():
-                
-                    # Ignore blank lines
-                    if not line.strip():
-                        continue
-
-                    # Ignore headings
-                    if line[0] == '#':
-                        continue
-
-                    # Use this line
-                    description = line.strip()
-                    break
-
-                # Store in cache
-                self.descriptionCache[path] = description
+        # Get first line of file from the cache. If it's not there, read it and the nearby rows in the background, and leave it blank for now.
+        description = self.descriptions.get(path, self.notes.mtime(path))
+        if description is None:
+            self.prefetchDescriptions()
+            description = ''
 
         # Draw title
         dc.SetFont(Theme.getFont('root/file-list/title'))
@@ -396,7 +759,7 @@ class FilePanel(wx.VListBox):
         n -= 1
 
         # Get selected file
-        file = self.files[n]
+        file = self.notes[n]
         
         # Open file
         self.onFileOpen(file)
@@ -420,17 +783,20 @@ class FilePanel(wx.VListBox):
         with open(path, 'w') as f:
             f.write("")
 
-        # Add to file list
-        self.files.insert(0, path)
-        self.SetRowCount(1 + len(self.files))
-
-        # Select it
-        self.SetSelection(1)
+        # Show all files, so it's listed
+        if self.searchQuery:
+            self.searchBox.SetValue('')
 
-        # Refresh UI
-        self.RefreshAll()
+        # Add it to the list and select it
+        self.applyChanges({ path: ADDED }, then_select=path)
 
         # Open it
         self.onFileOpen(path)
 
         
+
+
+# Timers for the hot paths
+Instrumentation.instrument(FilePanel, 'refreshFiles', 'FilePanel.refreshFiles')
+Instrumentation.instrument(FilePanel, 'OnDrawItem', 'FilePanel.OnDrawItem', lambda self, dc, rect, n: self.notes[n - 1] if 0 < n <= len(self.notes) else None)
+Instrumentation.instrument(FilePanel, 'applyChanges', 'FilePanel.applyChanges')
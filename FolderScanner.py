@@ -0,0 +1,223 @@
+
+import os
+import time
+import fnmatch
+import threading
+import concurrent.futures
+
+# Names of subfolders which are skipped by default, as comma separated patterns
+DEFAULT_IGNORE = '.*,node_modules,__pycache__'
+
+# Longest time the results of a background walk are held before being passed on
+BATCH_TIME = 0.1
+
+
+class FolderListing:
+    """ Contents of one folder in a note tree """
+
+    # Constructor
+    def __init__(self, mtime, depth, files, subfolders):
+
+        # Modification time of the folder when it was listed, and how deep it is below the note folder
+        self.mtime = mtime
+        self.depth = depth
+
+        # Notes in it, as a { path: (mtime, size) } dict, and the paths of the subfolders which are scanned
+        self.files = files
+        self.subfolders = subfolders
+
+
+
+class FolderScanner:
+    """ Lists the notes in a folder and its subfolders. A tree of listings is kept for each note folder as a { path: FolderListing }
+    dict, along with a flat { path: (mtime, size) } dict of all its notes. Refreshing only lists folders whose mtime has changed, and new
+    subfolders are walked on a thread pool with the results passed back in batches, so the notes found so far can be shown straight away. """
+
+    # Constructor
+    def __init__(self, callAfter, maxDepth=8, ignore=DEFAULT_IGNORE, threadCount=4):
+
+        # Store settings
+        self.callAfter = callAfter
+        self.maxDepth = maxDepth
+        self.ignore = [pattern.strip() for pattern in ignore.split(',') if pattern.strip()]
+        self.threadCount = threadCount
+
+        # Thread pool for walking folders, created when first needed
+        self.pool = None
+        self.lock = threading.Lock()
+
+
+    # Returns True if a subfolder should be skipped
+    def isIgnored(self, name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.ignore)
+
+
+    # Lists one folder
+    def listFolder(self, folder, depth):
+
+        # Get its mtime first, so changes made while it's listed make it look changed later
+        mtime = os.stat(folder).st_mtime_ns
+
+        # Go through its contents
+        files = {}
+        subfolders = []
+        with os.scandir(folder) as it:
+            for entry in it:
+
+                # Add notes
+                if entry.name.lower().endswith('.md'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    files[os.path.abspath(entry.path)] = (stat.st_mtime_ns, stat.st_size)
+
+                # Add subfolders, without following links so loops aren't possible
+                elif depth < self.maxDepth and not self.isIgnored(entry.name) and entry.is_dir(follow_symlinks=False):
+                    subfolders.append(os.path.abspath(entry.path))
+
+        # Done
+        return FolderListing(mtime, depth, files, subfolders)
+
+
+    # Brings a tree up to date, listing folders which have changed on this thread. Returns a tuple of (list of new (folder, depth)
+    # tuples which need walking, set of paths of notes which were added, changed or removed).
+    def refresh(self, root, tree, entries):
+
+        # Go through the tree, starting at the root
+        root = os.path.abspath(root)
+        walk = []
+        changed = set()
+        stack = [(root, 0)]
+        while stack:
+
+            # New subfolders are walked in the background
+            folder, depth = stack.pop()
+            listing = tree.get(folder)
+            if listing is None and folder != root:
+                walk.append((folder, depth))
+                continue
+
+            # List it again if it has changed. If it can't be read, it's removed along with everything below it.
+            try:
+                if listing is None or listing.mtime != os.stat(folder).st_mtime_ns:
+                    listing = self.listFolder(folder, depth)
+                    self.applyListing(tree, entries, folder, listing, changed)
+            except OSError:
+                self.removeTree(tree, entries, folder, changed)
+                continue
+
+            # Check its subfolders
+            stack.extend((subfolder, depth + 1) for subfolder in listing.subfolders)
+
+        # Done
+        return walk, changed
+
+
+    # Stores a new listing of a folder in a tree, updating the flat list of notes. Paths of notes which changed are added to changed.
+    def applyListing(self, tree, entries, folder, listing, changed):
+
+        # Update notes
+        previous = tree.get(folder)
+        previousFiles = previous.files if previous else {}
+        for path, stamp in listing.files.items():
+            if previousFiles.get(path) != stamp:
+                entries[path] = stamp
+                changed.add(path)
+        for path in previousFiles:
+            if path not in listing.files:
+                entries.pop(path, None)
+                changed.add(path)
+
+        # Store it
+        tree[folder] = listing
+
+        # Remove subfolders which are gone
+        if previous:
+            for subfolder in previous.subfolders:
+                if subfolder not in listing.subfolders:
+                    self.removeTree(tree, entries, subfolder, changed)
+
+
+    # Removes a folder and everything below it from a tree
+    def removeTree(self, tree, entries, folder, changed):
+        listing = tree.pop(folder, None)
+        if listing:
+            for path in listing.files:
+                entries.pop(path, None)
+                changed.add(path)
+            for subfolder in listing.subfolders:
+                self.removeTree(tree, entries, subfolder, changed)
+
+
+    # Walks folders and everything below them in the background. onBatch is called on the UI thread with (root, { folder: FolderListing },
+    # done) as listings arrive, with done set on the last call.
+    def walk(self, root, folders, onBatch):
+        threading.Thread(target=self.runWalk, args=(root, folders, lambda batch, done: self.callAfter(onBatch, root, batch, done)), daemon=True).start()
+
+
+    # Lists a whole tree, using the thread pool. Returns a tuple of (tree, entries).
+    def scan(self, root):
+
+        # List the root here, and walk the rest
+        tree = {}
+        entries = {}
+        walk, changed = self.refresh(root, tree, entries)
+        listings = {}
+        self.runWalk(root, walk, lambda batch, done: listings.update(batch))
+
+        # Add the listings, parents first
+        for folder, listing in listings.items():
+            self.applyListing(tree, entries, folder, listing, changed)
+
+        # Done
+        return tree, entries
+
+
+    # Stops the thread pool's threads. It's created again if needed.
+    def close(self):
+        with self.lock:
+            if self.pool:
+                self.pool.shutdown()
+                self.pool = None
+
+
+    # Lists folders and their subfolders on the thread pool, passing the listings to onBatch(batch, done) a batch at a time. Parents are
+    # always passed before their subfolders.
+    def runWalk(self, root, folders, onBatch):
+
+        # Create the pool if needed
+        with self.lock:
+            if not self.pool:
+                self.pool = concurrent.futures.ThreadPoolExecutor(self.threadCount, thread_name_prefix='FolderScanner')
+
+        # List the first folders
+        futures = { self.pool.submit(self.listFolder, folder, depth): folder for folder, depth in folders }
+        batch = {}
+        batchTime = time.monotonic()
+        while futures:
+
+            # Wait for some to finish
+            done = concurrent.futures.wait(futures, timeout=BATCH_TIME, return_when=concurrent.futures.FIRST_COMPLETED)[0]
+            for future in done:
+
+                # Add it to the batch. Folders which can't be read are skipped.
+                folder = futures.pop(future)
+                try:
+                    listing = future.result()
+                except OSError:
+                    continue
+                batch[folder] = listing
+
+                # List its subfolders
+                for subfolder in listing.subfolders:
+                    futures[self.pool.submit(self.listFolder, subfolder, listing.depth + 1)] = subfolder
+
+            # Pass on the batch every so often
+            if batch and futures and time.monotonic() - batchTime >= BATCH_TIME:
+                onBatch(batch, False)
+                batch = {}
+                batchTime = time.monotonic()
+
+        # Pass on the rest
+        onBatch(batch, True)
@@ -0,0 +1,439 @@
+#
+# Watches the note folders for notes being added, removed or changed by other apps. On Linux this uses inotify, through a small ctypes
+# binding, so changes are seen straight away without scanning anything. Elsewhere, or if inotify isn't available, a thread lists the
+# folders every few seconds and compares each note's modification time and size.
+
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+# Watch methods. 'auto' uses inotify if available and polling otherwise, and 'none' disables watching.
+WATCH_AUTO = 'auto'
+WATCH_INOTIFY = 'inotify'
+WATCH_POLL = 'poll'
+WATCH_NONE = 'none'
+
+# Kinds of change
+ADDED = 'added'
+REMOVED = 'removed'
+MODIFIED = 'modified'
+
+# inotify flags, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_FOLDER_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+# Header of each inotify event: watch descriptor, mask, cookie and name length
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class FolderWatcher:
+    """ Watches a list of folders for markdown files being added, removed or modified. Changes are collected for a short time and
+    coalesced, then passed to onChanges on the UI thread as a { path: kind } dict. If the changes couldn't be tracked, for example if
+    the kernel's event queue overflowed, onChanges is called with None and everything should be rescanned. """
+
+    # Constructor. If set, isIgnored is called with the name of each subfolder, and returns True for subfolders which aren't scanned,
+    # so adding or removing them doesn't cause a rescan.
+    def __init__(self, callAfter, onChanges, method=WATCH_AUTO, pollInterval=2.0, batchDelay=0.2, isIgnored=None):
+
+        # Store settings
+        self.callAfter = callAfter
+        self.onChanges = onChanges
+        self.method = method
+        self.pollInterval = pollInterval
+        self.batchDelay = batchDelay
+        self.isIgnored = isIgnored or (lambda name: False)
+
+        # Folders to watch, and the watch method in use once started
+        self.folders = ()
+        self.backend = None
+
+        # Lock protecting the folder list, and set when the watcher thread should stop
+        self.lock = threading.Lock()
+        self.stopped = False
+
+
+    # Returns True if folders are being watched, so there's no need to rescan them to find changes
+    def isActive(self):
+        return self.method != WATCH_NONE and not self.stopped
+
+
+    # Sets the folders to watch, starting the watcher thread if needed
+    def watch(self, folders):
+
+        # Stop if disabled or nothing changed
+        folders = tuple(os.path.abspath(f) for f in folders if f)
+        if not self.isActive() or folders == self.folders:
+            return
+
+        with self.lock:
+
+            # Store folders
+            self.folders = folders
+
+            # Start watching. The thread is a daemon, since there's nothing to finish when the app exits.
+            if not self.backend:
+                self.backend = createBackend(self.method, self.pollInterval, self.isIgnored)
+                threading.Thread(target=self.run, daemon=True).start()
+
+        # Wake the thread so it picks up the new folders
+        self.backend.wake()
+
+
+    # Stops watching
+    def stop(self):
+        self.stopped = True
+        if self.backend:
+            self.backend.wake()
+
+
+    # Runs on the watcher thread
+    def run(self):
+
+        # Coalesced changes waiting to be delivered, and when the first of them arrived
+        changes = {}
+        firstChangeTime = None
+        folders = None
+
+        while not self.stopped:
+
+            # Update the watched folders if they've changed
+            with self.lock:
+                if folders != self.folders:
+                    folders = self.folders
+                    self.backend.setFolders(folders)
+
+            # Wait for events. Once there are some, only wait until the batch is due.
+            timeout = None if firstChangeTime is None else max(0, firstChangeTime + self.batchDelay - time.monotonic())
+            events = self.backend.read(timeout)
+
+            # Add them to the batch
+            for path, kind in events:
+                if changes is not None:
+                    if path is None:
+                        changes = None
+                    else:
+                        mergeChange(changes, path, kind)
+                if firstChangeTime is None:
+                    firstChangeTime = time.monotonic()
+
+            # Deliver the batch once it's due
+            if firstChangeTime is not None and time.monotonic() >= firstChangeTime + self.batchDelay:
+                if changes is None or changes:
+                    self.callAfter(self.deliver, changes)
+                changes = {}
+                firstChangeTime = None
+
+        # Done
+        self.backend.close()
+
+
+    # Passes changes to the owner. Runs on the UI thread.
+    def deliver(self, changes):
+        if not self.stopped:
+            self.onChanges(changes)
+
+
+
+# Adds a change to a batch, combining it with any earlier change to the same file
+def mergeChange(changes, path, kind):
+
+    # Check the earlier change
+    previous = changes.get(path)
+    if previous == ADDED and kind == REMOVED:
+
+        # Created and removed again, so nothing has changed
+        del changes[path]
+
+    elif previous == ADDED:
+
+        # Still a new file
+        pass
+
+    elif previous == REMOVED and kind == ADDED:
+
+        # Replaced by a new file
+        changes[path] = MODIFIED
+
+    else:
+
+        # Use the latest change
+        changes[path] = kind
+
+
+# Returns True if a file name is a note
+def isNote(name):
+    return name.lower().endswith('.md')
+
+
+# Creates the backend for a watch method
+def createBackend(method, pollInterval, isIgnored):
+
+    # Try inotify first on Linux
+    if method in (WATCH_AUTO, WATCH_INOTIFY) and sys.platform.startswith('linux'):
+        try:
+            return InotifyBackend(pollInterval, isIgnored)
+        except OSError as e:
+            print('FolderWatcher: inotify is not available, polling instead: ' + str(e), file=sys.stderr)
+
+    # Fall back to polling
+    return PollingBackend(pollInterval, isIgnored)
+
+
+
+class InotifyBackend:
+    """ Reports changes using Linux's inotify API. Each folder has a watch, and the events are read from a single file descriptor. Folders
+    which can't be watched, for example once the user's limit on watches is reached, are polled instead. """
+
+    # Constructor
+    def __init__(self, pollInterval, isIgnored):
+
+        # Load functions from the C library
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.inotifyAddWatch = libc.inotify_add_watch
+        self.inotifyAddWatch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.inotifyRemoveWatch = libc.inotify_rm_watch
+        self.inotifyRemoveWatch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        # Create the inotify instance
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        # Pipe used to wake the thread when the folders change or the watcher stops
+        self.wakeRead, self.wakeWrite = os.pipe()
+
+        # Watched folders by watch descriptor
+        self.watches = {}
+
+        # Subfolders which aren't scanned
+        self.isIgnored = isIgnored
+
+        # Polls the folders which couldn't be watched, and when it's next due
+        self.polling = PollingBackend(pollInterval, isIgnored)
+        self.nextPoll = None
+
+
+    # Changes the watched folders
+    def setFolders(self, folders):
+
+        # Remove watches for folders which are no longer in the list
+        folders = set(folders)
+        for wd, folder in list(self.watches.items()):
+            if folder not in folders:
+                self.inotifyRemoveWatch(self.fd, wd)
+                del self.watches[wd]
+
+        # Add watches for new folders. Folders which can't be watched are polled instead.
+        watched = set(self.watches.values())
+        polled = [folder for folder in self.polling.listings if folder in folders]
+        failed = []
+        for folder in folders - watched - set(polled):
+            wd = self.inotifyAddWatch(self.fd, os.fsencode(folder), IN_FOLDER_MASK)
+            if wd < 0:
+                failed.append((folder, os.strerror(ctypes.get_errno())))
+                continue
+            self.watches[wd] = folder
+
+        # Update the polled folders
+        if failed:
+            print('FolderWatcher: Unable to watch %d folders, polling them instead. %s: %s' % (len(failed), *failed[0]), file=sys.stderr)
+            polled.extend(folder for folder, error in failed)
+        self.polling.setFolders(polled)
+        self.nextPoll = time.monotonic() + self.polling.interval if polled else None
+
+
+    # Waits for events, and returns them as a list of (path, kind) tuples. A path of None means everything should be rescanned.
+    def read(self, timeout):
+
+        # Wait until there's something to read, or the polled folders are due to be listed
+        if self.nextPoll is not None:
+            untilPoll = max(0, self.nextPoll - time.monotonic())
+            timeout = untilPoll if timeout is None else min(timeout, untilPoll)
+        ready = select.select([self.fd, self.wakeRead], [], [], timeout)[0]
+        if self.wakeRead in ready:
+            os.read(self.wakeRead, 4096)
+
+        # List the polled folders if it's time
+        events = []
+        if self.nextPoll is not None and time.monotonic() >= self.nextPoll:
+            events.extend(self.polling.poll())
+            self.nextPoll = time.monotonic() + self.polling.interval
+        if self.fd not in ready:
+            return events
+
+        # Read all available events
+        data = b''
+        while True:
+            try:
+                chunk = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            data += chunk
+
+        # Go through them
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+
+            # Read the header and name
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b'\0'))
+            offset += INOTIFY_EVENT.size + length
+
+            # If events were lost, or a watched folder was moved or deleted, everything needs rescanning
+            if mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF):
+                events.append((None, None))
+                continue
+
+            # Ignore watches which have been removed
+            folder = self.watches.get(wd)
+            if not folder or mask & IN_IGNORED:
+                continue
+
+            # If a subfolder was added or removed, everything needs rescanning so it can be listed and watched
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM) and not self.isIgnored(name):
+                    events.append((None, None))
+                continue
+
+            # Ignore other files
+            if not isNote(name):
+                continue
+
+            # Add it
+            path = os.path.join(folder, name)
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                events.append((path, ADDED))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                events.append((path, REMOVED))
+            elif mask & IN_CLOSE_WRITE:
+                events.append((path, MODIFIED))
+
+        # Done
+        return events
+
+
+    # Wakes the thread if it's waiting for events
+    def wake(self):
+        os.write(self.wakeWrite, b'\0')
+
+
+    # Releases the inotify instance
+    def close(self):
+        os.close(self.fd)
+        os.close(self.wakeRead)
+        os.close(self.wakeWrite)
+
+
+
+class PollingBackend:
+    """ Finds changes by listing the folders every so often and comparing each note's modification time and size with the previous
+    listing. This runs on the watcher thread, so the UI never waits for it. """
+
+    # Constructor
+    def __init__(self, interval, isIgnored):
+
+        # Store settings
+        self.interval = interval
+        self.isIgnored = isIgnored
+
+        # Contents of each folder from the last listing, as ({ path: (mtime, size) }, set of subfolder names) tuples by folder
+        self.listings = {}
+
+        # Set to wake the thread early
+        self.wakeEvent = threading.Event()
+
+
+    # Changes the watched folders. New folders are listed now, so only changes made after this are reported.
+    def setFolders(self, folders):
+        self.listings = { folder: self.listings.get(folder) or listFolder(folder, self.isIgnored) for folder in folders }
+
+
+    # Waits for the next poll, and returns the changes found as a list of (path, kind) tuples
+    def read(self, timeout):
+
+        # Wait until the next poll is due, or we're woken
+        self.wakeEvent.wait(self.interval if timeout is None else min(timeout, self.interval))
+        if self.wakeEvent.is_set():
+            self.wakeEvent.clear()
+            return []
+
+        # Poll
+        return self.poll()
+
+
+    # Lists the folders now, and returns the changes found as a list of (path, kind) tuples
+    def poll(self):
+
+        # List each folder and compare it with the previous listing. If its subfolders have changed, everything needs rescanning.
+        events = []
+        for folder, (previous, previousSubfolders) in self.listings.items():
+            current, subfolders = listFolder(folder, self.isIgnored)
+            if subfolders != previousSubfolders:
+                events.append((None, None))
+            for path, stamp in current.items():
+                if path not in previous:
+                    events.append((path, ADDED))
+                elif previous[path] != stamp:
+                    events.append((path, MODIFIED))
+            for path in previous:
+                if path not in current:
+                    events.append((path, REMOVED))
+            self.listings[folder] = (current, subfolders)
+
+        # Done
+        return events
+
+
+    # Wakes the thread if it's waiting for the next poll
+    def wake(self):
+        self.wakeEvent.set()
+
+
+    # Nothing to release
+    def close(self):
+        pass
+
+
+
+# Lists the notes in a folder, returning a tuple of ({ path: (mtime, size) }, set of subfolder names). Returns nothing if the folder
+# can't be read.
+def listFolder(folder, isIgnored):
+
+    # Go through contents of the folder
+    entries = {}
+    subfolders = set()
+    try:
+        with os.scandir(folder) as it:
+            for entry in it:
+                if isNote(entry.name):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries[entry.path] = (stat.st_mtime_ns, stat.st_size)
+                elif not isIgnored(entry.name) and entry.is_dir(follow_symlinks=False):
+                    subfolders.add(entry.name)
+    except OSError:
+        pass
+
+    # Done
+    return entries, subfolders
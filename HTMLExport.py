@@ -0,0 +1,345 @@
+#
+# Exports note folders to HTML without the GUI. Run from the project root with:
+#
+#   python HTMLExport.py OUTPUT_FOLDER [--folders FOLDER ...] [--depth N] [--ignore PATTERNS] [--jobs N] [--chunk-size N] [--force]
+#
+# Subfolders are exported too, using the same depth limit and ignored folder names as the file list, and keep their place in the output.
+# Each note is tokenized with the same tokenizer the editor uses, and written as a page which looks like the note does in the editor,
+# styled with CSS built from the theme. Notes are converted in parallel worker processes. A manifest in the output folder records the
+# modification time, size and hash of each note, so notes which haven't changed since the last export are skipped.
+
+import os
+import sys
+import html
+import json
+import time
+import hashlib
+import argparse
+import configparser
+from concurrent.futures import ProcessPoolExecutor
+from MarkdownStreamingTokenizer import *
+from FolderScanner import FolderScanner, DEFAULT_IGNORE
+
+# Name of the manifest file in the output folder
+MANIFEST_NAME = '.export-manifest.json'
+
+# Version of the exported pages. Increase this when the output changes, so everything is exported again.
+EXPORT_VERSION = 1
+
+# Theme selector for each token type, matching the styles the editor uses
+TOKEN_SELECTORS = {
+    'header1': 'root/editor/header1',
+    'header2': 'root/editor/header2',
+    'header3': 'root/editor/header3',
+    'header4': 'root/editor/header3',
+    'header5': 'root/editor/header3',
+    'header6': 'root/editor/header3',
+    'unimportant': 'root/editor/unimportant',
+    'emphasis': 'root/editor/emphasis',
+    'strong': 'root/editor/strong',
+    'code': 'root/editor/code',
+    'link': 'root/editor/link',
+    'image': 'root/editor/image',
+    'list': 'root/editor/list',
+    'quote': 'root/editor/quote',
+    'table': 'root/editor/table',
+    'table-delimiter': 'root/editor/unimportant',
+    'code-keyword': 'root/editor/code/keyword',
+    'code-string': 'root/editor/code/string',
+    'code-comment': 'root/editor/code/comment',
+    'code-number': 'root/editor/code/number'
+}
+
+
+# Returns a style value from a theme config, falling back to more generic groups like ThemeManager.getStyle does
+def getThemeStyle(config, selector, name, fallback=None):
+
+    # Check each style group, getting more and more generic, until it's found
+    groups = ('style/' + selector).split('/')
+    for i in reversed(range(len(groups))):
+        value = config.get(section='/'.join(groups[0:i+1]), option=name, fallback=None)
+        if value:
+            return value
+
+    # Done
+    return fallback
+
+
+# Converts a theme color like "249, 243, 229" to CSS
+def cssColor(value):
+    components = [int(c) for c in value.split(',')]
+    if len(components) >= 4:
+        return 'rgba(%d, %d, %d, %.3f)' % (components[0], components[1], components[2], components[3] / 255)
+    return 'rgb(%d, %d, %d)' % tuple(components[0:3])
+
+
+# Returns the CSS declarations for a theme selector
+def cssDeclarations(config, selector):
+
+    # Get style values
+    fontStyles = getThemeStyle(config, selector, 'font-styles', '')
+    return [
+        'font-family: "' + getThemeStyle(config, selector, 'font-family') + '", monospace',
+        'font-size: ' + getThemeStyle(config, selector, 'font-size') + 'pt',
+        'font-weight: ' + ('bold' if 'bold' in fontStyles else 'normal'),
+        'font-style: ' + ('italic' if 'italic' in fontStyles else 'normal'),
+        'color: ' + cssColor(getThemeStyle(config, selector, 'foreground-color')),
+        'background-color: ' + cssColor(getThemeStyle(config, selector, 'background-color'))
+    ]
+
+
+# Builds the stylesheet for a theme
+def buildCSS(themeName):
+
+    # Load theme
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'themes', themeName, 'manifest.ini'))
+
+    # Page and note styles
+    css = 'body { margin: 0; padding: 2em; ' + '; '.join(cssDeclarations(config, 'root/editor')) + '; }\n'
+    css += '.note { white-space: pre-wrap; overflow-wrap: break-word; }\n'
+
+    # Token styles
+    for typeName, selector in TOKEN_SELECTORS.items():
+        css += '.t-' + typeName + ' { ' + '; '.join(cssDeclarations(config, selector)) + '; }\n'
+
+    # Done
+    return css
+
+
+# Converts Markdown text to the HTML of a page
+def noteToHTML(title, content, cssPath):
+
+    # Build a span for each token. Plain text doesn't need one.
+    tokens = tokenizeToArrays(content)
+    parts = []
+    for i in range(len(tokens)):
+        text = html.escape(content[tokens.starts[i]:tokens.ends[i]], quote=False)
+        typeCode = tokens.types[i]
+        if typeCode == TOKEN_PLAIN:
+            parts.append(text)
+        else:
+            parts.append('<span class="t-' + TokenTypes[typeCode] + '">' + text + '</span>')
+
+    # Build the page
+    return ('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>' + html.escape(title) + '</title>\n'
+        + '<link rel="stylesheet" href="' + html.escape(cssPath) + '">\n</head>\n<body>\n<div class="note">'
+        + ''.join(parts) + '</div>\n</body>\n</html>\n')
+
+
+# Exports a single note. Runs in a worker process. Job is a (note path, output path, CSS path, previous hash or None) tuple.
+# Returns a (note path, status, hash, error) tuple, where status is 'exported', 'unchanged' or 'failed'.
+def exportNote(job):
+
+    # Read the note the same way the editor does
+    path, outputPath, cssPath, previousHash = job
+    try:
+        with open(path) as file:
+            content = file.read()
+
+        # Skip it if the content is the same as last time, and it was only touched
+        noteHash = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        if noteHash == previousHash and os.path.exists(outputPath):
+            return path, 'unchanged', noteHash, None
+
+        # Convert it
+        title = os.path.splitext(os.path.basename(path))[0]
+        page = noteToHTML(title, content, cssPath)
+
+        # Write it
+        os.makedirs(os.path.dirname(outputPath), exist_ok=True)
+        with open(outputPath, 'w', encoding='utf-8') as file:
+            file.write(page)
+
+        # Done
+        return path, 'exported', noteHash, None
+
+    except Exception as e:
+        return path, 'failed', None, str(e)
+
+
+# Returns the note folders from the app's settings, starting with the config folder
+def configuredFolders():
+
+    # Import here, so the exporter can be used without a settings folder when folders are given on the command line
+    import Config
+
+    # Get the config folder and the other folders
+    folders = [Config.path] + Config.get(section='ui', option='folders', fallback='').split('*')
+    return [f for f in folders if f]
+
+
+# Returns the (depth, ignore patterns) the file list scans subfolders with, from the app's settings
+def configuredScan():
+    import Config
+    return Config.getint('ui', 'scan_depth', 8), Config.get('ui', 'scan_ignore', DEFAULT_IGNORE)
+
+
+# Returns the output folder name for each note folder. The config folder is called Local, like in the editor's folder menu.
+def outputFolderNames(folders, localPath=None):
+
+    # Name each folder after its last path component, adding a number if two folders have the same name
+    names = []
+    for folder in folders:
+        name = 'Local' if localPath and os.path.abspath(folder) == os.path.abspath(localPath) else os.path.basename(os.path.abspath(folder))
+        name = name or 'Notes'
+        uniqueName = name
+        index = 1
+        while uniqueName in names:
+            index += 1
+            uniqueName = name + ' (' + str(index) + ')'
+        names.append(uniqueName)
+
+    # Done
+    return names
+
+
+# Writes an index page which links to every exported note
+def writeIndex(outputFolder, notesByFolder):
+
+    # Build a list of links for each folder
+    body = ''
+    for folderName, notes in notesByFolder:
+        body += '<h2>' + html.escape(folderName) + '</h2>\n<ul>\n'
+        for title, relativePath in sorted(notes, key=lambda n: n[0].lower()):
+            body += '<li><a href="' + html.escape(relativePath.replace(os.sep, '/')) + '">' + html.escape(title) + '</a></li>\n'
+        body += '</ul>\n'
+
+    # Write it
+    with open(os.path.join(outputFolder, 'index.html'), 'w', encoding='utf-8') as file:
+        file.write('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>Notes</title>\n<link rel="stylesheet" href="style.css">\n</head>\n<body>\n' + body + '</body>\n</html>\n')
+
+
+# Exports all notes in the folders and their subfolders. Returns a dict of counts of each status.
+def exportFolders(folders, outputFolder, themeName='Sunlight', jobs=None, chunkSize=None, force=False, localPath=None, maxDepth=8, ignore=DEFAULT_IGNORE):
+
+    # Write the stylesheet
+    os.makedirs(outputFolder, exist_ok=True)
+    css = buildCSS(themeName)
+    with open(os.path.join(outputFolder, 'style.css'), 'w', encoding='utf-8') as file:
+        file.write(css)
+
+    # Load the manifest. If the export version, theme or tokenizer tables have changed, everything needs exporting again.
+    generator = hashlib.sha1(repr((EXPORT_VERSION, css, TokenTypes, [m['pattern'] for m in TokenMatchers])).encode('utf-8')).hexdigest()
+    manifestPath = os.path.join(outputFolder, MANIFEST_NAME)
+    manifest = { 'generator': generator, 'notes': {} }
+    if not force:
+        try:
+            with open(manifestPath) as file:
+                previous = json.load(file)
+            if previous.get('generator') == generator:
+                manifest['notes'] = previous.get('notes', {})
+        except (OSError, ValueError):
+            pass
+
+    # Find the notes, skipping ones which have the same modification time and size as last time
+    counts = { 'exported': 0, 'unchanged': 0, 'failed': 0 }
+    work = []
+    stats = {}
+    notesByFolder = []
+    scanner = FolderScanner(None, maxDepth, ignore)
+    for folder, folderName in zip(folders, outputFolderNames(folders, localPath)):
+
+        # List the notes in the folder and its subfolders, the same way the file list does. A folder which can't be read counts as failed.
+        try:
+            os.stat(folder)
+        except OSError as e:
+            print('Failed to export ' + folder + ': ' + str(e), file=sys.stderr)
+            counts['failed'] += 1
+            continue
+        root = os.path.abspath(folder)
+        tree, entries = scanner.scan(root)
+
+        # Go through them
+        notes = []
+        for path in sorted(entries, key=lambda p: os.path.relpath(p, root).lower()):
+
+            # Get paths, keeping the subfolder the note is in
+            notePath = os.path.relpath(path, root)[:-3]
+            relativePath = os.path.join(folderName, notePath + '.html')
+            outputPath = os.path.join(outputFolder, relativePath)
+            cssPath = '../' * (notePath.count(os.sep) + 1) + 'style.css'
+
+            # Skip it if it was removed or renamed after the folder was listed
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            notes.append((notePath.replace(os.sep, '/'), relativePath))
+
+            # Check if it's changed
+            stats[path] = (stat.st_mtime_ns, stat.st_size)
+            entry = manifest['notes'].get(path)
+            if entry and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size and os.path.exists(outputPath):
+                counts['unchanged'] += 1
+                continue
+
+            # Add it to the work list. The hash lets the worker skip notes which were touched but not changed.
+            work.append((path, outputPath, cssPath, entry['hash'] if entry else None))
+
+        # Add to index
+        notesByFolder.append((folderName, notes))
+
+    # Stop the scanner's threads before starting the worker processes
+    scanner.close()
+
+    # Convert notes in worker processes. Work is handed out in chunks so small notes don't spend more time on messaging than converting.
+    if work:
+        jobs = jobs or os.cpu_count() or 1
+        chunkSize = chunkSize or max(1, min(64, len(work) // (jobs * 4)))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for path, status, noteHash, error in executor.map(exportNote, work, chunksize=chunkSize):
+
+                # Record result
+                counts[status] += 1
+                if status == 'failed':
+                    print('Failed to export ' + path + ': ' + error, file=sys.stderr)
+                    manifest['notes'].pop(path, None)
+                else:
+                    mtime, size = stats[path]
+                    manifest['notes'][path] = { 'mtime': mtime, 'size': size, 'hash': noteHash }
+
+    # Forget notes which no longer exist, and write the manifest and index
+    manifest['notes'] = { path: entry for path, entry in manifest['notes'].items() if path in stats }
+    with open(manifestPath, 'w') as file:
+        json.dump(manifest, file)
+    writeIndex(outputFolder, notesByFolder)
+
+    # Done
+    return counts
+
+
+# Entry point
+if __name__ == '__main__':
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Exports note folders to HTML.")
+    parser.add_argument('output', help="folder to write the HTML files to")
+    parser.add_argument('--folders', nargs='+', help="note folders to export, instead of the folders in the app's settings")
+    parser.add_argument('--theme', default='Sunlight', help="theme to build the stylesheet from")
+    parser.add_argument('--depth', type=int, help="how many levels of subfolders to export, the same as the file list by default")
+    parser.add_argument('--ignore', help="comma separated patterns of subfolder names to skip, the same as the file list by default")
+    parser.add_argument('--jobs', type=int, help="number of worker processes, the number of CPUs by default")
+    parser.add_argument('--chunk-size', type=int, help="number of notes handed to a worker at a time")
+    parser.add_argument('--force', action='store_true', help="export every note, even if it hasn't changed")
+    args = parser.parse_args()
+
+    # Get folders, and how their subfolders are scanned
+    localPath = None
+    maxDepth, ignore = 8, DEFAULT_IGNORE
+    if args.folders:
+        folders = args.folders
+    else:
+        folders = configuredFolders()
+        localPath = folders[0]
+        maxDepth, ignore = configuredScan()
+    if args.depth is not None:
+        maxDepth = args.depth
+    if args.ignore is not None:
+        ignore = args.ignore
+
+    # Export them
+    startTime = time.perf_counter()
+    counts = exportFolders(folders, args.output, args.theme, args.jobs, args.chunk_size, args.force, localPath, maxDepth, ignore)
+    print('Exported %d notes, %d unchanged, %d failed in %.2f s' % (counts['exported'], counts['unchanged'], counts['failed'], time.perf_counter() - startTime))
+    sys.exit(1 if counts['failed'] else 0)
@@ -0,0 +1,225 @@
+#
+# Lightweight timers and counters for the hot paths of the app. Modules register the functions to time with instrument(), which
+# does nothing until enable() is called, so there's no cost at all when instrumentation is off. Once enabled, each registered
+# function is replaced by a wrapper which records its duration into a ring buffer.
+
+import json
+import time
+import functools
+import threading
+from collections import deque
+
+# True once enable() has been called. Code recording its own timings should check this first.
+enabled = False
+
+# Number of samples kept for each timer
+sampleCount = 1000
+
+# Number of slowest calls kept for each timer, with their details
+SLOWEST_COUNT = 5
+
+# Functions registered for timing, as (owner, attribute, timer name, detail function) tuples
+targets = []
+
+# Timers and counters by name
+timers = {}
+counters = {}
+
+# Functions which return extra values to include in the results, by name
+sources = {}
+
+# Lock for creating timers and updating counters, since they may be recorded from worker threads
+lock = threading.Lock()
+
+
+class Timer:
+    """ Stores the most recent durations of something, and the slowest calls along with what they were working on. """
+
+    # Constructor
+    def __init__(self, name):
+
+        # Store name
+        self.name = name
+
+        # Lock protecting the recorded calls, since they're recorded from worker threads while the UI thread reads them
+        self.lock = threading.Lock()
+
+        # Clear state
+        self.clear()
+
+
+    # Forgets all recorded calls
+    def clear(self):
+
+        with self.lock:
+
+            # Most recent durations in nanoseconds, and the total number and duration of all calls
+            self.samples = deque(maxlen=sampleCount)
+            self.count = 0
+            self.total = 0
+
+            # Slowest calls, as a list of (duration, detail) tuples sorted slowest first
+            self.slowest = []
+
+
+    # Records a duration in nanoseconds, with optional details like the note being worked on
+    def record(self, duration, detail=None):
+
+        with self.lock:
+
+            # Store it
+            self.samples.append(duration)
+            self.count += 1
+            self.total += duration
+
+            # Check if it's one of the slowest
+            if len(self.slowest) < SLOWEST_COUNT or duration > self.slowest[-1][0]:
+                self.slowest.append((duration, detail))
+                self.slowest.sort(key=lambda s: s[0], reverse=True)
+                del self.slowest[SLOWEST_COUNT:]
+
+
+    # Returns a summary of the timer, with durations in milliseconds
+    def summary(self):
+
+        # Take a copy of the recorded calls, and sort the samples
+        with self.lock:
+            samples = sorted(self.samples)
+            count = self.count
+            total = self.total
+            slowest = list(self.slowest)
+        if not samples:
+            return { 'count': count }
+
+        # Returns a percentile of the samples, using the nearest rank
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(len(samples) * p / 100))] / 1e6
+
+        # Done
+        return {
+            'count': count,
+            'totalMs': total / 1e6,
+            'p50Ms': percentile(50),
+            'p95Ms': percentile(95),
+            'p99Ms': percentile(99),
+            'maxMs': samples[-1] / 1e6,
+            'slowest': [{ 'ms': duration / 1e6, 'detail': detail } for duration, detail in slowest]
+        }
+
+
+
+# Registers a function to be timed when instrumentation is enabled. Owner is a class or module, and attribute is the name of the
+# function on it. If detail is set, it's called with the function's arguments and returns a string describing the call, like the
+# path of the note, which is shown for the slowest calls.
+def instrument(owner, attribute, name, detail=None):
+
+    # Store it
+    targets.append((owner, attribute, name, detail))
+
+    # Wrap it now if already enabled
+    if enabled:
+        wrap(owner, attribute, name, detail)
+
+
+# Adds a function which returns a dict of values to include in the results, like counters kept by another class
+def addSource(name, function):
+    sources[name] = function
+
+
+# Turns on instrumentation. Functions which have already been looked up, like event handlers which are already bound, won't be timed,
+# so this should be called before the app's windows are created.
+def enable(samples=1000):
+
+    # Stop if already enabled
+    global enabled, sampleCount
+    if enabled:
+        return
+
+    # Wrap all the registered functions
+    enabled = True
+    sampleCount = samples
+    for owner, attribute, name, detail in targets:
+        wrap(owner, attribute, name, detail)
+
+
+# Replaces a function with one that times it
+def wrap(owner, attribute, name, detail):
+
+    # Create the wrapper
+    function = getattr(owner, attribute)
+    timer = getTimer(name)
+    perfCounter = time.perf_counter_ns
+
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        start = perfCounter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timer.record(perfCounter() - start, detail(*args, **kwargs) if detail else None)
+
+    # Replace the original
+    setattr(owner, attribute, timed)
+
+
+# Returns the timer with the specified name, creating it if needed
+def getTimer(name):
+    with lock:
+        timer = timers.get(name)
+        if not timer:
+            timer = Timer(name)
+            timers[name] = timer
+        return timer
+
+
+# Records a duration in nanoseconds for a timer. Callers should check enabled first.
+def record(name, duration, detail=None):
+    getTimer(name).record(duration, detail)
+
+
+# Adds to a counter. Callers should check enabled first.
+def increment(name, amount=1):
+    with lock:
+        counters[name] = counters.get(name, 0) + amount
+
+
+# Clears all recorded timings and counters
+def reset():
+
+    # Timers are cleared rather than removed, since the wrappers hold on to them
+    with lock:
+        for timer in timers.values():
+            timer.clear()
+        counters.clear()
+
+
+# Returns all results as a dict which can be saved as JSON
+def results():
+
+    # Take a copy of the timers and counters, since worker threads may be adding to them
+    with lock:
+        timerList = sorted(timers.items())
+        counterList = sorted(counters.items())
+
+    # Get values from other sources
+    extra = {}
+    for name, function in sources.items():
+        try:
+            extra[name] = function()
+        except Exception as e:
+            extra[name] = str(e)
+
+    # Done
+    return {
+        'enabled': enabled,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'timers': { name: timer.summary() for name, timer in timerList },
+        'counters': dict(counterList),
+        'sources': extra
+    }
+
+
+# Saves the results to a JSON file
+def exportJSON(path):
+    with open(path, 'w') as file:
+        json.dump(results(), file, indent=2)
@@ -0,0 +1,110 @@
+import re
+
+# Matches the start of a line
+LINE_START = r"(?:^|(?<=\n))"
+
+
+class LexerTables:
+    """ Lexer tables built from a list of matchers. Each matcher has a 'name', which must be in the list of token types, and a 'pattern'.
+    Matchers whose pattern starts with LINE_START only match at the start of a line, and must come first. If every other matcher lists
+    the characters it can start with in 'start', a first character dispatch table is built. Otherwise a single combined pattern is built. """
+
+    # Constructor
+    def __init__(self, matchers, tokenTypes):
+
+        # Store the type code of each matcher
+        for m in matchers:
+            m['code'] = tokenTypes.index(m['name'])
+
+        # Combine the patterns
+        data = buildTables(matchers)
+
+        # Single pattern matching any token. The type of the token is found with entries[match.lastindex].
+        self.combined = loadPattern(data['combined']) if data['combined'] else None
+
+        # Pattern for the matchers which start at the start of a line
+        self.lineStart = loadPattern(data['lineStart']) if data['lineStart'] else None
+
+        # Pattern for the characters which can start a token, and a map of each of those characters to a (regex, entries, skip) tuple
+        # for the matchers which can start with it. A line break is skipped before matching, and dispatches to the line start matchers.
+        self.startChars = None
+        self.dispatch = None
+        if data['dispatch']:
+            self.startChars = re.compile(data['startChars'])
+            self.dispatch = {}
+            for char, pattern in data['dispatch'].items():
+                regex, entries = loadPattern(pattern)
+                self.dispatch[char] = (regex, entries, 0)
+            if self.lineStart:
+                self.dispatch['\n'] = self.lineStart + (1,)
+
+
+
+# Returns the (type code, skip start, skip end, group, language) table entry for a matcher
+def matcherEntry(matcher):
+    return (matcher['code'], matcher.get('skip_start', 0), matcher.get('skip_end', 0), matcher.get('group'), matcher.get('language'))
+
+
+# Builds the tables for a list of matchers
+def buildTables(matchers):
+
+    # All matchers share one set of flags, since they're combined into single patterns
+    flags = set(m.get('flags', 0) for m in matchers)
+    if len(flags) != 1:
+        raise ValueError("Matchers must all use the same flags")
+    flags = flags.pop()
+
+    # Split off the matchers which start at the start of a line. They're tried first, so they must come first in the list.
+    lineMatchers = [m for m in matchers if m['pattern'].startswith(LINE_START)]
+    otherMatchers = [m for m in matchers if not m['pattern'].startswith(LINE_START)]
+    if matchers[:len(lineMatchers)] != lineMatchers:
+        raise ValueError("Line start matchers must come before the other matchers")
+
+    # Line start matchers are only tried at the start of a line, so they don't need to check for it
+    data = { 'combined': None, 'lineStart': None, 'dispatch': None, 'startChars': None }
+    if lineMatchers:
+        data['lineStart'] = compilePattern([(m, m['pattern'][len(LINE_START):]) for m in lineMatchers], flags)
+
+    # Without line start matchers, a single pattern can find any token
+    if not lineMatchers:
+        data['combined'] = compilePattern([(m, m['pattern']) for m in otherMatchers], flags)
+
+    # If we know which characters each matcher can start with, build a pattern for each start character
+    if all(m.get('start') for m in otherMatchers):
+        chars = ''.join(sorted(set(''.join(m['start'] for m in otherMatchers))))
+        data['startChars'] = '[' + re.escape(('\n' if lineMatchers else '') + chars) + ']'
+        data['dispatch'] = {}
+        for char in chars:
+            data['dispatch'][char] = compilePattern([(m, m['pattern']) for m in otherMatchers if char in m['start']], flags)
+
+    # Line start matchers can only be used through the dispatch table
+    elif lineMatchers:
+        raise ValueError("Matchers must have a 'start' if there are line start matchers")
+
+    # Done
+    return data
+
+
+# Combines a list of (matcher, pattern) tuples into a single alternation. Returns a (pattern, flags, entries) tuple.
+def compilePattern(matchers, flags):
+
+    # Wrap each pattern in its own group. At each position the alternatives are tried in list order,
+    # which gives the same tie-break as picking the first of several equally close matches.
+    # NOTE: Patterns must not use numbered backreferences, since their group numbers shift when combined,
+    # and named groups must be unique across all matchers.
+    pattern = '|'.join('(' + p + ')' for m, p in matchers)
+
+    # Map the outer group of each alternative to the matcher's table entry
+    entries = [None]
+    for m, p in matchers:
+        entries.append(matcherEntry(m))
+        entries += [None] * re.compile(p, flags).groups
+
+    # Done
+    return (pattern, flags, tuple(entries))
+
+
+# Creates the regex for a pattern tuple. Returns a (regex, entries) tuple.
+def loadPattern(data):
+    pattern, flags, entries = data
+    return re.compile(pattern, flags), entries
@@ -5,6 +5,7 @@ import Config
 from Theme import *
 from FilePanel import *
 from EditorPanel import *
+from FolderWatcher import *
 
 class MainWindow(wx.Frame):
     
@@ -27,8 +28,9 @@ class MainWindow(wx.Frame):
         # Create right panel
         self.editor = EditorPanel(self.split)
         self.editor.onMenuPressed = self.onMenuPressed
-        self.editor.onFileRenamed = lambda newPath: self.filePanel.refreshFiles(then_select=newPath)
-        self.editor.onFileDeleted = lambda: self.filePanel.refreshFiles()
+        self.editor.onFileRenamed = lambda oldPath, newPath: self.filePanel.applyChanges({ oldPath: REMOVED, newPath: ADDED }, then_select=newPath)
+        self.editor.onFileDeleted = lambda path: self.filePanel.applyChanges({ path: REMOVED })
+        self.editor.onFileSaved = lambda path: self.filePanel.applyChanges({ path: MODIFIED })
 
         # Set panels into split view
         if Config.getboolean('ui', 'show_file_list', False):
@@ -36,6 +38,10 @@ class MainWindow(wx.Frame):
         else:
             self.split.Initialize(self.editor)
 
+        # Watch the note folders for changes made by other apps. The file list tells it which folders to watch.
+        self.watcher = FolderWatcher(wx.CallAfter, self.onFilesChanged, Config.get('ui', 'folder_watcher', WATCH_AUTO), Config.getfloat('ui', 'folder_poll_interval', 2.0), isIgnored=self.filePanel.scanner.isIgnored)
+        self.filePanel.onFoldersChanged = self.watcher.watch
+
         # Enable or disable the tray
         if Config.getboolean('ui', 'close_to_tray'):
             self.EnableTray()
@@ -53,8 +59,20 @@ class MainWindow(wx.Frame):
         if not e.GetActive():
             return
 
-        # Tell the file list to refresh
-        self.filePanel.refreshFiles()
+        # Tell the file list to refresh, unless the folders are being watched
+        if not self.watcher.isActive():
+            self.filePanel.refreshFiles()
+
+
+    # Called when the folder watcher finds notes which have been added, removed or changed
+    def onFilesChanged(self, changes):
+
+        # Update the file list
+        self.filePanel.applyChanges(changes)
+
+        # Reload the open note if it was changed
+        if changes is None or self.editor.currentFile in changes:
+            self.editor.reloadIfChanged()
 
 
     # Called when the user opens a file from the file list
@@ -0,0 +1,338 @@
+import re
+
+# Line patterns for each kind of block
+HEADING_REGEX = re.compile(r"(#{1,6})(?:[ \t]+(.*?))??(?:[ \t]+#+)?[ \t]*$")
+FENCE_REGEX = re.compile(r" {0,3}(`{3,}|~{3,})[ \t]*([^`\s]*)")
+QUOTE_REGEX = re.compile(r" {0,3}>")
+LIST_REGEX = re.compile(r" {0,3}([-*+]|\d{1,9}[.)])([ \t]|$)")
+INDENT_REGEX = re.compile(r"[ \t]")
+
+
+class MarkdownDocument:
+    """ Block level model of a Markdown document, kept up to date by reparsing only the blocks touched by each edit. Also keeps an
+    outline of the headings in the document, which is updated along with the blocks. """
+
+    # Constructor
+    def __init__(self, getLine, getLineCount, getLinePosition=None):
+
+        # Store functions used to read the document. getLine returns a line of text by line number, and getLinePosition returns
+        # the document position of the start of a line.
+        self.getLine = getLine
+        self.getLineCount = getLineCount
+        self.getLinePosition = getLinePosition
+
+        # Clear state
+        self.reset()
+
+
+    # Forgets all blocks. The document is parsed again the next time it's queried.
+    def reset(self):
+
+        # List of top level blocks
+        self.blocks = []
+
+        # Start line of each block
+        self.starts = LinePartition()
+
+        # Heading blocks in document order, and the line each one is on
+        self.headings = []
+        self.headingLines = LinePartition()
+
+        # Total number of words in all blocks
+        self.words = 0
+
+        # True once the document has been parsed
+        self.parsed = False
+
+
+    # Parses the whole document if needed
+    def ensureParsed(self):
+
+        # Stop if already parsed
+        if self.parsed:
+            return
+
+        # Parse all lines
+        line = 0
+        lineCount = self.getLineCount()
+        while line < lineCount:
+            block, nextLine = self.parseBlock(line, lineCount)
+            self.blocks.append(block)
+            self.starts.append(line)
+            self.words += block.words
+            if block.type == 'heading':
+                self.headings.append(block)
+                self.headingLines.append(line)
+            line = nextLine
+
+        # Done
+        self.parsed = True
+
+
+    # Returns the number of blocks
+    def blockCount(self):
+        self.ensureParsed()
+        return len(self.blocks)
+
+
+    # Returns the start line of the block at the specified index
+    def blockStart(self, index):
+        return self.starts.get(index)
+
+
+    # Returns the index of the block containing the specified line
+    def blockIndex(self, line):
+        self.ensureParsed()
+        return max(0, self.starts.indexAtOrBefore(line))
+
+
+    # Returns the block containing the specified line, or None if the document is empty
+    def blockAt(self, line):
+        self.ensureParsed()
+        if not self.blocks:
+            return None
+        return self.blocks[self.blockIndex(line)]
+
+
+    # Returns the number of headings in the outline
+    def headingCount(self):
+        self.ensureParsed()
+        return len(self.headings)
+
+
+    # Returns a (level, text, line, position) tuple for the heading at the specified index in the outline. Position is the document
+    # position of the start of the line, or None if the document can't provide it.
+    def heading(self, index):
+        self.ensureParsed()
+        block = self.headings[index]
+        line = self.headingLines.get(index)
+        return block.level, block.info, line, self.getLinePosition(line) if self.getLinePosition else None
+
+
+    # Returns the index of the last heading at or before the specified line, which is the section the line is in, or -1 if there isn't one
+    def headingIndex(self, line):
+        self.ensureParsed()
+        return self.headingLines.indexAtOrBefore(line)
+
+
+    # Returns the total number of words in the document
+    def wordCount(self):
+        self.ensureParsed()
+        return self.words
+
+
+    # Called when lines have changed. oldCount lines starting at firstLine were replaced by newCount lines.
+    def update(self, firstLine, oldCount, newCount):
+
+        # Nothing to do if we haven't parsed yet, it will all be parsed when needed
+        if not self.parsed:
+            return
+
+        # If there are no blocks, parse everything
+        if not self.blocks:
+            self.reset()
+            return
+
+        # Start reparsing from the block before the one containing the change, since a change can join it to the previous one
+        delta = newCount - oldCount
+        first = max(0, self.blockIndex(firstLine) - 1)
+        line = self.blockStart(first)
+
+        # Find the first old block after the change. Its old start line is compared with new lines by adding delta.
+        last = first
+        while last < len(self.blocks) and self.blockStart(last) < firstLine + oldCount:
+            last += 1
+
+        # Parse blocks until one ends where an unchanged old block starts
+        newBlocks = []
+        newStarts = []
+        lineCount = self.getLineCount()
+        while line < lineCount:
+
+            # Parse next block
+            block, nextLine = self.parseBlock(line, lineCount)
+            newBlocks.append(block)
+            newStarts.append(line)
+            line = nextLine
+
+            # Check if we've reached an old block which starts after the change
+            if line >= firstLine + newCount:
+                while last < len(self.blocks) and self.blockStart(last) + delta < line:
+                    last += 1
+                if last < len(self.blocks) and self.blockStart(last) + delta == line:
+                    break
+
+        # If we reached the end of the document, all old blocks after the first are replaced
+        if line >= lineCount:
+            last = len(self.blocks)
+
+        # Find the headings in the replaced blocks, using their lines from before the change
+        headingFirst = self.headingLines.indexAtOrBefore(self.blockStart(first) - 1) + 1
+        headingLast = self.headingLines.indexAtOrBefore(self.blockStart(last) - 1) + 1 if last < len(self.blocks) else len(self.headings)
+
+        # Replace blocks. Blocks after the new ones are shifted by the change in line count.
+        for block in self.blocks[first:last]:
+            self.words -= block.words
+        for block in newBlocks:
+            self.words += block.words
+        self.blocks[first:last] = newBlocks
+        self.starts.replace(first, last, newStarts, delta)
+
+        # Replace headings
+        newHeadings = [i for i in range(len(newBlocks)) if newBlocks[i].type == 'heading']
+        self.headings[headingFirst:headingLast] = [newBlocks[i] for i in newHeadings]
+        self.headingLines.replace(headingFirst, headingLast, [newStarts[i] for i in newHeadings], delta)
+
+
+    # Parses the block starting at the specified line. Returns a tuple of (block, next line).
+    def parseBlock(self, line, lineCount):
+
+        # Get line text
+        text = self.getLine(line).rstrip('\r\n')
+
+        # Check for blank lines, and join them into one block
+        if not text.strip():
+            nextLine = line + 1
+            while nextLine < lineCount and not self.getLine(nextLine).strip():
+                nextLine += 1
+            return Block('blank'), nextLine
+
+        # Check for a fenced code block, which continues until a closing fence of at least the same length, or the end of the document
+        match = FENCE_REGEX.match(text)
+        if match:
+            fence = match.group(1)
+            nextLine = line + 1
+            words = 0
+            while nextLine < lineCount:
+                nextText = self.getLine(nextLine).strip()
+                nextLine += 1
+                if nextText.startswith(fence) and not nextText.strip(fence[0]):
+                    break
+                words += len(nextText.split())
+            return Block('code', info=match.group(2), words=words), nextLine
+
+        # Check for a heading, which is always one line
+        match = HEADING_REGEX.match(text)
+        if match:
+            heading = match.group(2) or ''
+            return Block('heading', level=len(match.group(1)), info=heading, words=len(heading.split())), line + 1
+
+        # Check for a block quote, which continues over lines starting with >
+        if QUOTE_REGEX.match(text):
+            return self.parseLines('quote', line, lineCount, lambda t: QUOTE_REGEX.match(t))
+
+        # Check for a list, which continues over list items and indented lines
+        if LIST_REGEX.match(text):
+            return self.parseLines('list', line, lineCount, lambda t: LIST_REGEX.match(t) or (INDENT_REGEX.match(t) and t.strip()))
+
+        # Anything else is a paragraph, which continues until a blank line or the start of another kind of block
+        return self.parseLines('paragraph', line, lineCount, lambda t: t.strip() and not (FENCE_REGEX.match(t) or HEADING_REGEX.match(t) or QUOTE_REGEX.match(t) or LIST_REGEX.match(t)))
+
+
+    # Parses a block made of the line at the specified index and any following lines which pass the check. Returns a tuple of (block, next line).
+    def parseLines(self, blockType, line, lineCount, check):
+
+        # Count words in the first line
+        words = len(self.getLine(line).split())
+
+        # Add following lines
+        nextLine = line + 1
+        while nextLine < lineCount:
+            text = self.getLine(nextLine).rstrip('\r\n')
+            if not check(text):
+                break
+            words += len(text.split())
+            nextLine += 1
+
+        # Done
+        return Block(blockType, words=words), nextLine
+
+
+
+# Stores a sorted list of line numbers, which can be shifted by a number of lines from an index onwards
+class LinePartition:
+    """ Like Scintilla's partitioning, lines at or after stepIndex are stored without the pending stepLength added, so a run of
+    edits in one place doesn't need to shift every line after it. """
+
+    # Constructor
+    def __init__(self):
+        self.lines = []
+        self.stepIndex = 0
+        self.stepLength = 0
+
+
+    # Returns the number of lines
+    def __len__(self):
+        return len(self.lines)
+
+
+    # Adds a line to the end
+    def append(self, line):
+        self.lines.append(line - self.stepLength)
+
+
+    # Returns the line at the specified index
+    def get(self, index):
+        if index >= self.stepIndex:
+            return self.lines[index] + self.stepLength
+        return self.lines[index]
+
+
+    # Returns the index of the last line at or before the specified line, or -1 if there isn't one
+    def indexAtOrBefore(self, line):
+
+        # Binary search the lines
+        low = -1
+        high = len(self.lines) - 1
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.get(mid) <= line:
+                low = mid
+            else:
+                high = mid - 1
+
+        # Done
+        return low
+
+
+    # Replaces the lines from first up to last with new lines, and shifts the lines after them by delta
+    def replace(self, first, last, newLines, delta):
+
+        # Move the pending step to the end of the replaced lines, so all lines from there on are stored relative to it
+        self.moveStep(last)
+
+        # Replace lines
+        self.lines[first:last] = newLines
+
+        # Lines after the new ones are shifted by delta
+        self.stepIndex = first + len(newLines)
+        self.stepLength += delta
+
+
+    # Moves the pending step to the specified index, applying it to the lines in between
+    def moveStep(self, index):
+
+        # Apply step to lines between the old and new step index
+        if index > self.stepIndex:
+            for i in range(self.stepIndex, index):
+                self.lines[i] += self.stepLength
+        else:
+            for i in range(index, self.stepIndex):
+                self.lines[i] -= self.stepLength
+
+        # Store new index
+        self.stepIndex = index
+
+
+
+# Represents a top level block in the document
+class Block:
+    """ A top level block. Type is one of 'blank', 'heading', 'paragraph', 'code', 'list' or 'quote'. """
+
+    __slots__ = ('type', 'level', 'info', 'words')
+
+    def __init__(self, type, level=0, info='', words=0):
+        self.type = type        # Block type
+        self.level = level      # Heading level
+        self.info = info        # Heading text, or the language of a fenced code block
+        self.words = words      # Number of words in the block
@@ -0,0 +1,266 @@
+import bisect
+import threading
+from MarkdownStreamingTokenizer import *
+
+# Minimum distance between two style checkpoints, in bytes
+CHECKPOINT_INTERVAL = 4096
+
+# Number of characters the background lexer styles in each batch
+BACKGROUND_BATCH_SIZE = 256 * 1024
+
+
+class MarkdownLexer:
+    """ Styles a Scintilla control incrementally, restarting from saved checkpoints instead of the start of the document. """
+
+    # Constructor
+    def __init__(self, control, styles, defaultStyle):
+
+        # Store the control to style
+        self.control = control
+
+        # Map of token type name to style code
+        self.styles = styles
+        self.defaultStyle = defaultStyle
+
+        # Style bytes for each token type code, built when needed
+        self.styleBytes = []
+
+        # Sorted list of document positions where the tokenizer can be restarted. These are always at the start of a line,
+        # and the tokenizer state at each of them is empty, so tokenizing from there gives the same tokens as from the start.
+        self.checkpoints = [0]
+        self.checkpointInterval = CHECKPOINT_INTERVAL
+
+        # Incremented whenever the document changes, so work based on an older version can be discarded
+        self.version = 0
+
+
+    # Called when text has been inserted or deleted at the specified position
+    def invalidate(self, pos):
+
+        # Update version
+        self.version += 1
+
+        # Remove all checkpoints at or after the modified position. The first one is always valid.
+        idx = bisect.bisect_left(self.checkpoints, pos)
+        del self.checkpoints[max(1, idx):]
+
+
+    # Returns the closest checkpoint at or before the start of the line containing startPos, or the end of the styled text if not specified
+    def restartPosition(self, startPos=None):
+
+        # Get start of the line where styling needs to start
+        if startPos is None:
+            startPos = self.control.GetEndStyled()
+        lineNum = self.control.LineFromPosition(startPos)
+        startPos = self.control.PositionFromLine(lineNum)
+
+        # Find the closest checkpoint before it
+        idx = bisect.bisect_right(self.checkpoints, startPos) - 1
+        return self.checkpoints[idx]
+
+
+    # Styles the document from startPos, or the current end of styled text, up to the specified position. Returns the position styling stopped at.
+    def styleTo(self, endPos, startPos=None):
+
+        # Find where to start. Forget checkpoints after it, they'll be recorded again as we go.
+        basePos = self.restartPosition(startPos)
+        del self.checkpoints[bisect.bisect_right(self.checkpoints, basePos):]
+
+        # Fetch the text from the checkpoint up to a few lines past the requested end, so tokens which end near it see the same text as in the full document
+        text = self.control.GetTextRange(basePos, self.lookaheadPosition(endPos))
+
+        # Style it
+        tokens = tokenizeToArrays(text, restartInterval=self.checkpointInterval)
+        styleBytes, checkpoints, stylePos = self.buildStyles(text, tokens, basePos, endPos)
+        self.applyStyles(basePos, styleBytes, checkpoints)
+        return stylePos
+
+
+    # Styles a range of the document without using checkpoints, starting at the start of the line containing startPos. This is used to show
+    # text quickly while the rest of the document is still being styled, and may be wrong if a token spans the start of the line.
+    def styleRange(self, startPos, endPos):
+
+        # Fetch the text
+        startPos = self.control.PositionFromLine(self.control.LineFromPosition(startPos))
+        text = self.control.GetTextRange(startPos, self.lookaheadPosition(endPos))
+
+        # Style it
+        tokens = tokenizeToArrays(text)
+        styleBytes, checkpoints, stylePos = self.buildStyles(text, tokens, startPos, endPos)
+        self.applyStyles(startPos, styleBytes, [])
+
+
+    # Returns the position a few lines after the line containing pos, or the end of the document
+    def lookaheadPosition(self, pos):
+
+        # Get line
+        lastLine = self.control.LineFromPosition(pos) + LOOKAHEAD_LINES + 1
+        if lastLine < self.control.GetLineCount():
+            return self.control.PositionFromLine(lastLine)
+        else:
+            return self.control.GetLength()
+
+
+    # Converts tokens into style bytes. The first token starts at document position pos. Stops after the token which reaches endPos, if specified.
+    # Returns a tuple of (style bytes, list of new checkpoint positions, document position after the last styled token). Doesn't touch the control,
+    # so it's safe to call from a background thread.
+    def buildStyles(self, text, tokens, pos, endPos=None):
+
+        # Build style bytes for each token type if there are new ones
+        if len(self.styleBytes) != len(TokenTypes):
+            self.styleBytes = [bytes([self.styles.get(name, self.defaultStyle)]) for name in TokenTypes]
+
+        # Document positions are in bytes, so we need to convert token offsets unless it's plain ASCII
+        isAscii = text.isascii()
+
+        # Get arrays
+        styleBytes = self.styleBytes
+        types = tokens.types
+        starts = tokens.starts
+        ends = tokens.ends
+        restartPoints = tokens.restartPoints
+        nextRestart = 0
+
+        # Go through tokens until we get to the end of the requested region
+        output = bytearray()
+        checkpoints = []
+        for i in range(len(types)):
+
+            # Stop if we've gone past the end of our requested style region
+            if endPos is not None and pos >= endPos:
+                break
+
+            # Get length of this token
+            fromIndex = starts[i]
+            toIndex = ends[i]
+            length = toIndex - fromIndex
+            if not isAscii:
+                length = len(text[fromIndex:toIndex].encode('utf-8'))
+
+            # Record any restart points inside or at the end of this token as checkpoints. Only trust positions
+            # inside the requested region, the text after that may not be complete.
+            while nextRestart < len(restartPoints) and restartPoints[nextRestart] <= toIndex:
+
+                # Get document position
+                restart = restartPoints[nextRestart]
+                offset = restart - fromIndex
+                if not isAscii:
+                    offset = len(text[fromIndex:restart].encode('utf-8'))
+
+                # Add it
+                if endPos is None or pos + offset <= endPos:
+                    checkpoints.append(pos + offset)
+
+                # Continue
+                nextRestart += 1
+
+            # Add style
+            pos += length
+            output += styleBytes[types[i]] * length
+
+        # Done
+        return output, checkpoints, pos
+
+
+    # Applies style bytes starting at the specified position, and records the checkpoints
+    def applyStyles(self, pos, styleBytes, checkpoints):
+
+        # Apply styles
+        self.control.StartStyling(pos, 31)
+        self.control.SetStyleBytes(len(styleBytes), bytes(styleBytes))
+
+        # Add checkpoints which are far enough from the previous one
+        for checkpoint in checkpoints:
+            if checkpoint - self.checkpoints[-1] >= self.checkpointInterval:
+                self.checkpoints.append(checkpoint)
+
+
+
+class BackgroundLexer:
+    """ Styles a snapshot of the document on a worker thread, handing the styles back in batches. """
+
+    # Constructor
+    def __init__(self, lexer, callAfter):
+
+        # Store lexer, and the function used to run code on the UI thread
+        self.lexer = lexer
+        self.callAfter = callAfter
+
+        # Current job, if any. Each job is an object which is only used to tell jobs apart.
+        self.job = None
+
+
+    # Returns True if the background lexer is running for the current document version
+    def isRunning(self):
+        return self.job is not None and self.job.version == self.lexer.version
+
+
+    # Starts styling from the closest checkpoint before the end of the styled text, up to the end of the document.
+    # Must be called on the UI thread.
+    def start(self):
+
+        # Find where to start. Forget checkpoints after it, the worker will send them again.
+        basePos = self.lexer.restartPosition()
+        del self.lexer.checkpoints[bisect.bisect_right(self.lexer.checkpoints, basePos):]
+
+        # Take a snapshot of the text
+        text = self.lexer.control.GetTextRange(basePos, self.lexer.control.GetLength())
+
+        # Start the worker
+        self.job = BackgroundLexerJob(self.lexer.version)
+        threading.Thread(target=self.run, args=(self.job, text, basePos), daemon=True).start()
+
+
+    # Stops the current job
+    def cancel(self):
+        self.job = None
+
+
+    # Runs on the worker thread
+    def run(self, job, text, pos):
+
+        # Go through the text in batches, stopping if the job was cancelled or the document has changed
+        index = 0
+        while index < len(text) and self.job is job and self.lexer.version == job.version:
+
+            # Style the next batch
+            tokens = tokenizeToArrays(text, restartInterval=self.lexer.checkpointInterval, start=index, stop=index + BACKGROUND_BATCH_SIZE)
+            styleBytes, checkpoints, nextPos = self.lexer.buildStyles(text, tokens, pos)
+
+            # Hand it to the UI thread
+            self.callAfter(self.applyBatch, job, pos, styleBytes, checkpoints)
+
+            # Continue
+            index = tokens.endIndex
+            pos = nextPos
+
+        # Done
+        self.callAfter(self.finish, job)
+
+
+    # Applies a batch of styles on the UI thread
+    def applyBatch(self, job, pos, styleBytes, checkpoints):
+
+        # Ignore if the job has been cancelled or the document has changed since
+        if self.job is not job or self.lexer.version != job.version:
+            return
+
+        # Apply it
+        self.lexer.applyStyles(pos, styleBytes, checkpoints)
+
+
+    # Called on the UI thread when a job is complete
+    def finish(self, job):
+        if self.job is job:
+            self.job = None
+
+
+
+# Identifies a background lexer job
+class BackgroundLexerJob:
+
+    # Constructor
+    def __init__(self, version):
+
+        # Document version this job is styling
+        self.version = version
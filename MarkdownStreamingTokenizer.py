@@ -1,5 +1,10 @@
-
 import re
+import codecs
+import importlib
+from array import array
+from collections import deque
+from LexerTables import *
+import Instrumentation
 
 class MarkdownTokens:
 
@@ -13,7 +18,7 @@ class MarkdownTokens:
         self.currentIndex = 0
 
         # Stores queue of next tokens to deliver
-        self.tokenQueue = []
+        self.tokenQueue = deque()
 
 
     # Return iterator
@@ -28,29 +33,14 @@ class MarkdownTokens:
 
         # Check if there's a token in the queue
         if len(self.tokenQueue) > 0:
-            return self.tokenQueue.pop(0)
+            return self.tokenQueue.popleft()
 
         # Stop if no more content
         if self.currentIndex >= len(self.content):
             raise StopIteration
 
-        # Try each regex until we get the closest match
-        matcher = None
-        match = None
-        for m in TokenMatchers:
-
-            # Get info
-            regex = m['regex']
-
-            # Check if regex matches
-            pmatch = regex.search(self.content, self.currentIndex)
-            if not pmatch:
-                continue
-
-            # Check if this match is closer than the previous one
-            if not match or pmatch.start() < match.start():
-                matcher = m
-                match = pmatch
+        # Find the closest match
+        entry, match = findNextMatch(self.content, self.currentIndex)
 
         # If no matches, this is the final part of the document
         if not match:
@@ -61,25 +51,15 @@ class MarkdownTokens:
             return token
 
         # Match was found! Create array of tokens
-        typeName = matcher['name']
-        skip_start = matcher.get('skip_start', 0)
-        skip_end = matcher.get('skip_end', 0)
         tokens = []
 
         # If match was not at the start of the string, add blank token
         if match.start() > self.currentIndex:
             tokens.append(Token('plain', fromIndex=self.currentIndex, toIndex=match.start()))
 
-        # Get range of skippable chars
-        if skip_start > 0:
-            tokens.append(Token('unimportant', fromIndex=match.start(), toIndex=match.start() + skip_start))
-
-        # Add main tokens
-        tokens.append(Token(typeName, fromIndex=match.start() + skip_start, toIndex=match.end() - skip_end))
-
-        # Get range of skippable chars
-        if skip_end > 0:
-            tokens.append(Token('unimportant', fromIndex=match.end() - skip_end, toIndex=match.end()))
+        # Add tokens for the match
+        for typeCode, fromIndex, toIndex in matchTokens(self.content, entry, match):
+            tokens.append(Token(TokenTypes[typeCode], fromIndex=fromIndex, toIndex=toIndex))
 
         # Update current position
         self.currentIndex = match.end()
@@ -93,24 +73,500 @@ class MarkdownTokens:
 
 
 
+# Time each token when instrumentation is enabled
+Instrumentation.instrument(MarkdownTokens, '__next__', 'MarkdownTokens.next')
+
+
+# Tokenizes markdown from a stream, without needing the whole document in memory
+class MarkdownStreamTokens:
+    """ Tokenizes a file object, mmap, or iterable of str or bytes chunks. Gives the same tokens as MarkdownTokens over the
+    full content, with offsets in characters from the start of the stream. Only a few lines of text are kept in memory,
+    unless a single line or token is longer than that. """
+
+    # Constructor
+    def __init__(self, source, chunkSize=65536):
+
+        # Store chunk source
+        self.chunks = readChunks(source, chunkSize)
+        self.endOfStream = False
+
+        # Buffered text, and the stream offset of its first character
+        self.buffer = ''
+        self.bufferOffset = 0
+
+        # Stream offset of the tokenizer position
+        self.currentIndex = 0
+
+        # Start of the plain text run which hasn't been delivered yet, if any
+        self.plainStart = None
+
+        # Stores queue of next tokens to deliver
+        self.tokenQueue = deque()
+
+
+    # Return iterator
+    def __iter__(self):
+        return self
+
+
+    # Get next token
+    def __next__(self):
+
+        # Tokenize more text until we have something to deliver
+        while len(self.tokenQueue) == 0:
+
+            # Stop if no more content
+            if self.endOfStream and self.currentIndex >= self.bufferOffset + len(self.buffer):
+                raise StopIteration
+
+            # Tokenize what we can of the buffer, or read more if nothing could be done
+            if not self.tokenizeBuffer():
+                self.readMore()
+
+        # Return next token
+        return self.tokenQueue.popleft()
+
+
+    # Reads the next chunk into the buffer
+    def readMore(self):
+
+        # Remove text before the current position, keeping one character so lookbehinds still work
+        discard = self.currentIndex - self.bufferOffset - 1
+        if discard > 0:
+            self.buffer = self.buffer[discard:]
+            self.bufferOffset += discard
+
+        # Read next chunk
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.endOfStream = True
+        else:
+            self.buffer += chunk
+
+
+    # Tokenizes the part of the buffer which we know is complete. Returns False if more text is needed.
+    def tokenizeBuffer(self):
+
+        # Find how far we can trust matches. A match on a line depends on the lines after it, so we need a few complete lines after it.
+        if self.endOfStream:
+            safeIndex = len(self.buffer)
+        else:
+            safeIndex = len(self.buffer)
+            for i in range(LOOKAHEAD_LINES + 1):
+                safeIndex = self.buffer.rfind('\n', 0, safeIndex)
+                if safeIndex == -1:
+                    return False
+
+            # Safe up to the start of the line after that
+            safeIndex += 1
+
+        # Stop if we're already there
+        index = self.currentIndex - self.bufferOffset
+        if index >= safeIndex:
+            return False
+
+        # Find the closest match
+        entry, match = findNextMatch(self.buffer, index)
+
+        # If there's no complete match in the safe area, it's all plain text up to there
+        if not match or match.start() >= safeIndex or (match.end() > safeIndex and not self.endOfStream):
+
+            # If we've reached the end of the stream, deliver the final plain text token
+            if self.endOfStream:
+                self.tokenQueue.append(Token('plain', fromIndex=self.plainStart if self.plainStart is not None else self.currentIndex, toIndex=self.bufferOffset + safeIndex))
+                self.plainStart = None
+                self.currentIndex = self.bufferOffset + safeIndex
+                return True
+
+            # If the match started in the safe area, we need more text to complete it
+            if match and match.start() < safeIndex:
+                safeIndex = match.start()
+
+            # Plain text continues up to here
+            if safeIndex > index:
+                if self.plainStart is None:
+                    self.plainStart = self.currentIndex
+                self.currentIndex = self.bufferOffset + safeIndex
+
+            # Need more text
+            return False
+
+        # Match was found! Get stream offsets
+        matchStart = self.bufferOffset + match.start()
+        matchEnd = self.bufferOffset + match.end()
+
+        # Add plain text before the match
+        plainStart = self.plainStart if self.plainStart is not None else self.currentIndex
+        if matchStart > plainStart:
+            self.tokenQueue.append(Token('plain', fromIndex=plainStart, toIndex=matchStart))
+
+        # Add tokens for the match
+        for typeCode, fromIndex, toIndex in matchTokens(self.buffer, entry, match, self.bufferOffset):
+            self.tokenQueue.append(Token(TokenTypes[typeCode], fromIndex=fromIndex, toIndex=toIndex))
+
+        # Update current position
+        self.plainStart = None
+        self.currentIndex = matchEnd
+        return True
+
+
+
 # Represents a matched token
 class Token:
     """ Represents a token. """
 
+    __slots__ = ('typeName', 'fromIndex', 'toIndex')
+
     def __init__(self, typeName, fromIndex, toIndex):
         self.typeName = typeName
         self.fromIndex = fromIndex
         self.toIndex = toIndex
 
 
+# Stores a list of tokens in compact arrays, instead of one object per token
+class TokenArrays:
+    """ Stores tokens as type codes and offsets in flat arrays. Type codes index into TokenTypes. """
+
+    __slots__ = ('types', 'starts', 'ends', 'restartPoints', 'endIndex')
+
+    def __init__(self):
+
+        # Type code, start offset and end offset of each token
+        self.types = array('B')
+        self.starts = array('i')
+        self.ends = array('i')
+
+        # Line start offsets where the tokenizer holds no state, so tokenizing can be restarted from there
+        self.restartPoints = array('i')
+
+        # Offset where tokenizing stopped
+        self.endIndex = 0
+
+
+    # Returns the number of tokens
+    def __len__(self):
+        return len(self.types)
+
+
+    # Iterates the tokens as Token objects
+    def __iter__(self):
+        for i in range(len(self.types)):
+            yield Token(TokenTypes[self.types[i]], fromIndex=self.starts[i], toIndex=self.ends[i])
+
+
 
 
-# Create list of regex expressions to match against
+# Create list of regex expressions to match against. Each matcher has a name, which is the token type of the main part of the match,
+# and the pattern. The rest of the match is 'unimportant'. The main part is the whole match except for skip_start characters at the start and
+# skip_end characters at the end, or the named group if 'group' is set. If 'language' is set, the main part is code which is passed to the
+# code lexer for the language in that named group. Patterns which don't start with LINE_START list the characters they can start with in 'start'.
 TokenMatchers = [
 
+    # Match: ```lang fenced code blocks, which continue to the end of the document if not closed
+    { 'name': 'code', 'group': 'fence_body', 'language': 'fence_lang', 'pattern': LINE_START + r" {0,3}(?P<fence>`{3,}|~{3,})(?P<fence_lang>[^`\n]*)(?:\n|\Z)(?P<fence_body>[\s\S]*?)(?:" + LINE_START + r" {0,3}(?P=fence)[`~]*[ \t]*(?:\n|\Z)|\Z)" },
+
     # Match: # Header Name
-    { 'name': 'header1', 'regex': re.compile("#[^#].*($|\n)"), 'skip_start': 1 },
-    { 'name': 'header2', 'regex': re.compile("##[^#].*($|\n)"), 'skip_start': 2 },
-    { 'name': 'header3', 'regex': re.compile("###[^#].*($|\n)"), 'skip_start': 3 }
+    { 'name': 'header1', 'pattern': LINE_START + r"#(?=[ \t\n]|\Z)[^\n]*\n?", 'skip_start': 1 },
+    { 'name': 'header2', 'pattern': LINE_START + r"##(?=[ \t\n]|\Z)[^\n]*\n?", 'skip_start': 2 },
+    { 'name': 'header3', 'pattern': LINE_START + r"###(?=[ \t\n]|\Z)[^\n]*\n?", 'skip_start': 3 },
+    { 'name': 'header4', 'pattern': LINE_START + r"####(?=[ \t\n]|\Z)[^\n]*\n?", 'skip_start': 4 },
+    { 'name': 'header5', 'pattern': LINE_START + r"#####(?=[ \t\n]|\Z)[^\n]*\n?", 'skip_start': 5 },
+    { 'name': 'header6', 'pattern': LINE_START + r"######(?=[ \t\n]|\Z)[^\n]*\n?", 'skip_start': 6 },
+
+    # Match: |---|:---:| table delimiter rows, and | table | rows
+    { 'name': 'table-delimiter', 'pattern': LINE_START + r"[ \t]*\|?[ \t]*:?-+:?[ \t]*(?:\|[ \t]*:?-+:?[ \t]*)+\|?[ \t]*(?=\n|\Z)" },
+    { 'name': 'table', 'pattern': LINE_START + r"[ \t]*\|[^\n]*" },
+
+    # Match: > Block quote
+    { 'name': 'quote', 'group': 'quote_text', 'pattern': LINE_START + r" {0,3}>[ \t]?(?P<quote_text>[^\n]*)" },
+
+    # Match: - List item, or 1. Numbered list item. Only the bullet or number is matched.
+    { 'name': 'list', 'pattern': LINE_START + r"[ \t]*(?:[-*+]|\d{1,9}[.)])(?=[ \t])" },
+
+    # Match: ![alt text](url)
+    { 'name': 'image', 'group': 'image_alt', 'start': '!', 'pattern': r"!\[(?P<image_alt>[^\]\n]*)\]\([^)\n]*\)" },
+
+    # Match: [link text](url) and <https://autolink>
+    { 'name': 'link', 'group': 'link_text', 'start': '[', 'pattern': r"\[(?P<link_text>[^\]\n]+)\]\([^)\n]*\)" },
+    { 'name': 'link', 'start': '<', 'pattern': r"<[a-zA-Z][a-zA-Z0-9+.-]{1,31}:[^<>\s]*>", 'skip_start': 1, 'skip_end': 1 },
+
+    # Match: ``inline code`` and `inline code`
+    { 'name': 'code', 'start': '`', 'pattern': r"``[^\n]+?``", 'skip_start': 2, 'skip_end': 2 },
+    { 'name': 'code', 'start': '`', 'pattern': r"`[^`\n]+`", 'skip_start': 1, 'skip_end': 1 },
+
+    # Match: **strong** and __strong__
+    { 'name': 'strong', 'start': '*', 'pattern': r"\*\*(?=\S)[^\n]*?\S\*\*", 'skip_start': 2, 'skip_end': 2 },
+    { 'name': 'strong', 'start': '_', 'pattern': r"(?<!\w)__(?=\S)[^\n]*?\S__(?!\w)", 'skip_start': 2, 'skip_end': 2 },
+
+    # Match: *emphasis* and _emphasis_
+    { 'name': 'emphasis', 'start': '*', 'pattern': r"\*(?=[^\s*])[^*\n]*?[^\s*]\*", 'skip_start': 1, 'skip_end': 1 },
+    { 'name': 'emphasis', 'start': '_', 'pattern': r"(?<!\w)_(?=[^\s_])[^_\n]*?[^\s_]_(?!\w)", 'skip_start': 1, 'skip_end': 1 }
+
+]
+
+
+# List of token type names. Token type codes index into this list. Code lexers for fenced code produce the code types.
+TokenTypes = ['plain', 'unimportant', 'code', 'code-keyword', 'code-string', 'code-comment', 'code-number']
+for m in TokenMatchers:
+    if m['name'] not in TokenTypes:
+        TokenTypes.append(m['name'])
+TOKEN_PLAIN = 0
+TOKEN_UNIMPORTANT = 1
+TOKEN_CODE = 2
+
+
+# Build the lexer tables
+TokenTables = LexerTables(TokenMatchers, TokenTypes)
+
+
+# Number of lines after the line a token starts on which can affect the token. Fenced code blocks are the exception, since they
+# continue until they are closed, so their matches are only trusted once the closing fence has been seen.
+LOOKAHEAD_LINES = 2
+
+
+# Returns a list of (type code, from index, to index) tuples for the parts of a match. Entry is the matcher's table entry. Offset is added to each index.
+def matchTokens(content, entry, match, offset=0):
+    """ Splits a match into tokens. """
+
+    # Find the main part of the match
+    typeCode, skipStart, skipEnd, group, language = entry
+    matchStart, matchEnd = match.span()
+    if group:
+        mainStart, mainEnd = match.span(group)
+    else:
+        mainStart = matchStart + skipStart
+        mainEnd = matchEnd - skipEnd
+
+    # Add skippable chars at the start
+    tokens = []
+    if mainStart > matchStart:
+        tokens.append((TOKEN_UNIMPORTANT, matchStart + offset, mainStart + offset))
+
+    # Add main token. Code is split up by the code lexer for its language, if there is one.
+    if language:
+        addCodeTokens(tokens, content, match.group(language), mainStart, mainEnd, offset)
+    else:
+        tokens.append((typeCode, mainStart + offset, mainEnd + offset))
+
+    # Add skippable chars at the end
+    if matchEnd > mainEnd:
+        tokens.append((TOKEN_UNIMPORTANT, mainEnd + offset, matchEnd + offset))
+
+    # Done
+    return tokens
+
+
+# Code lexer modules for each fenced code language. These are only imported the first time their language appears,
+# so notes without code don't pay for them.
+CodeLexerModules = {
+    'python': 'CodeLexerPython', 'py': 'CodeLexerPython', 'python3': 'CodeLexerPython',
+    'javascript': 'CodeLexerJavaScript', 'js': 'CodeLexerJavaScript', 'typescript': 'CodeLexerJavaScript', 'ts': 'CodeLexerJavaScript', 'json': 'CodeLexerJavaScript',
+    'shell': 'CodeLexerShell', 'sh': 'CodeLexerShell', 'bash': 'CodeLexerShell', 'zsh': 'CodeLexerShell', 'console': 'CodeLexerShell'
+}
+
+# Loaded code lexer modules, by language
+CodeLexers = {}
+
+
+# Returns the code lexer module for the specified language, or None if there isn't one
+def getCodeLexer(language):
+    """ Returns the code lexer module for a fenced code language, importing it if needed. """
+
+    # Check if already loaded
+    language = language.lower()
+    if language in CodeLexers:
+        return CodeLexers[language]
+
+    # Import it. Unknown languages are remembered as None.
+    moduleName = CodeLexerModules.get(language)
+    CodeLexers[language] = importlib.import_module(moduleName) if moduleName else None
+    return CodeLexers[language]
+
+
+# Adds tokens for a block of code in the specified language
+def addCodeTokens(tokens, content, language, fromIndex, toIndex, offset):
+
+    # Find the code lexer, using the first word of the info string
+    codeLexer = None
+    language = language.split()
+    if language and toIndex > fromIndex:
+        codeLexer = getCodeLexer(language[0])
+
+    # Without a code lexer, it's all plain code
+    if not codeLexer:
+        if toIndex > fromIndex:
+            tokens.append((TOKEN_CODE, fromIndex + offset, toIndex + offset))
+        return
+
+    # Go through the code lexer matches
+    index = fromIndex
+    regex, entries = codeLexer.Tables.combined
+    for match in regex.finditer(content, fromIndex, toIndex):
+
+        # Skip empty matches
+        if match.start() == match.end():
+            continue
+
+        # Add plain code before the match, then the match
+        if match.start() > index:
+            tokens.append((TOKEN_CODE, index + offset, match.start() + offset))
+        tokens.append((entries[match.lastindex][0], match.start() + offset, match.end() + offset))
+        index = match.end()
+
+    # Add remaining plain code
+    if toIndex > index:
+        tokens.append((TOKEN_CODE, index + offset, toIndex + offset))
+
+
+# Finds the token which matches closest to the specified index. Returns an (entry, match) tuple, where entry is the matcher's table entry.
+def findNextMatch(content, index):
+    """ Finds the closest token match at or after the specified index. """
+
+    # Check for tokens at the start of the line
+    lineStart = TokenTables.lineStart
+    if index == 0 or content[index - 1] == '\n':
+        regex, entries = lineStart
+        match = regex.match(content, index)
+        if match:
+            return entries[match.lastindex], match
+
+    # Go through the characters which can start a token
+    startChars = TokenTables.startChars
+    dispatch = TokenTables.dispatch
+    pos = index
+    while True:
+
+        # Skip to the next one. This is much faster than letting a combined pattern try each position.
+        start = startChars.search(content, pos)
+        if not start:
+            return None, None
+        pos = start.start()
+
+        # Try the matchers which can start with this character. At a line break, the line start matchers are tried on the next line.
+        regex, entries, skip = dispatch[content[pos]]
+        match = regex.match(content, pos + skip)
+        if match:
+            return entries[match.lastindex], match
+        pos += 1
+
+
+# Tokenizes the content into compact arrays. This gives the same tokens as MarkdownTokens, without creating an object for each one.
+def tokenizeToArrays(content, restartInterval=0, start=0, stop=None):
+    """ Tokenizes content into a TokenArrays. If restartInterval is set, restart points are recorded at most that many characters apart.
+    Tokenizing begins at start, which must be a restart point, and ends at the first token boundary at or after stop. """
+
+    # Create arrays
+    tokens = TokenArrays()
+    types = tokens.types
+    starts = tokens.starts
+    ends = tokens.ends
+
+    # Go through the content
+    currentIndex = start
+    length = len(content)
+    while currentIndex < length:
+
+        # Stop if we've reached the requested end
+        if stop is not None and currentIndex >= stop:
+            break
+
+        # Find the closest match
+        entry, match = findNextMatch(content, currentIndex)
+
+        # If no matches, the rest of the document is plain text
+        if not match:
+            types.append(TOKEN_PLAIN)
+            starts.append(currentIndex)
+            ends.append(length)
+            if restartInterval:
+                addRestartPoints(tokens, content, currentIndex, length, restartInterval)
+            currentIndex = length
+            break
+
+        # Get match info
+        matchStart, matchEnd = match.span()
+
+        # If match was not at the current position, add plain text up to it
+        if matchStart > currentIndex:
+            types.append(TOKEN_PLAIN)
+            starts.append(currentIndex)
+            ends.append(matchStart)
+            if restartInterval:
+                addRestartPoints(tokens, content, currentIndex, matchStart + 1, restartInterval)
+
+        # Add tokens for the match
+        for typeCode, fromIndex, toIndex in matchTokens(content, entry, match):
+            types.append(typeCode)
+            starts.append(fromIndex)
+            ends.append(toIndex)
+
+        # The end of a match is a restart point if it's at the start of a line
+        if restartInterval and content[matchEnd - 1] == '\n':
+            lastRestart = tokens.restartPoints[-1] if tokens.restartPoints else 0
+            if matchEnd - lastRestart >= restartInterval:
+                tokens.restartPoints.append(matchEnd)
+
+        # Update current position
+        currentIndex = matchEnd
+
+    # Done
+    tokens.endIndex = currentIndex
+    return tokens
+
+
+# Records restart points at line starts within plain text, from fromIndex up to but not including toIndex
+def addRestartPoints(tokens, content, fromIndex, toIndex, restartInterval):
+
+    # Find line starts, at most one per restart interval
+    lastRestart = tokens.restartPoints[-1] if tokens.restartPoints else 0
+    searchFrom = max(fromIndex, lastRestart + restartInterval) - 1
+    while searchFrom < toIndex - 1:
+
+        # Find the next line break
+        idx = content.find('\n', searchFrom, toIndex - 1)
+        if idx == -1:
+            break
+
+        # Record the start of the next line
+        tokens.restartPoints.append(idx + 1)
+        searchFrom = idx + restartInterval
+
+
+# Returns a generator of str chunks from a str, file object, mmap, or iterable of str or bytes chunks
+def readChunks(source, chunkSize):
+
+    # Check for a single string
+    if isinstance(source, str):
+        yield source
+        return
+
+    # Check for something we can read from, like a file or mmap
+    if hasattr(source, 'read'):
+        chunks = iter(lambda: source.read(chunkSize), None)
+    else:
+        chunks = iter(source)
+
+    # Go through the chunks
+    decoder = None
+    for chunk in chunks:
+
+        # Stop at the end of the file
+        if not chunk:
+            if hasattr(source, 'read'):
+                break
+            continue
+
+        # Decode bytes. An incremental decoder handles characters which are split across chunks.
+        if not isinstance(chunk, str):
+            if not decoder:
+                decoder = codecs.getincrementaldecoder('utf-8')()
+            chunk = decoder.decode(chunk)
+
+        # Deliver it
+        yield chunk
 
-]
\ No newline at end of file
+    # Flush any partial character left in the decoder
+    if decoder:
+        chunk = decoder.decode(b'', final=True)
+        if chunk:
+            yield chunk
@@ -0,0 +1,373 @@
+
+import os
+import sys
+import re
+import json
+import sqlite3
+import threading
+import Instrumentation
+
+# Version of the database layout. The index is rebuilt if it was made by a different version.
+SCHEMA_VERSION = 2
+
+# Number of notes indexed in each transaction while checking a folder
+RECONCILE_BATCH = 200
+
+# Most search results returned
+SEARCH_LIMIT = 1000
+
+# Weights of the title and body columns when ranking search results
+SEARCH_WEIGHTS = (5.0, 1.0)
+
+# Closing sequence of #s at the end of a heading, which is only one if it's on its own or has whitespace before it
+CLOSING_HASHES_REGEX = re.compile(r"(?:^|[ \t]+)#+$")
+
+
+class NoteIndex:
+    """ Stores the metadata and text of every note in an SQLite database, so the file list can be filled at startup without listing
+    the folders or reading the notes, and notes can be searched. The saved listings are checked against the folders on a background
+    thread, and notes which change after that are reindexed on another background thread. Searching uses an FTS5 full-text index,
+    if this build of SQLite has it. """
+
+    # Constructor
+    def __init__(self, path, callAfter):
+
+        # Store settings
+        self.path = path
+        self.callAfter = callAfter
+
+        # Called on the UI thread after notes passed to update() have been indexed
+        self.onUpdated = None
+
+        # Notes waiting to be reindexed, as a { path: folder } dict, and whether the indexer thread is running
+        self.pending = {}
+        self.running = False
+        self.lock = threading.Lock()
+
+        # Connection used for searching, which is only used on the UI thread
+        self.searchDb = None
+
+        # Create the tables if needed
+        db = self.connect()
+        try:
+            with db:
+                if db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                    db.execute('DROP TABLE IF EXISTS notes')
+                    db.execute('DROP TABLE IF EXISTS search')
+                    db.execute('CREATE TABLE notes (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, folder TEXT NOT NULL, mtime INTEGER NOT NULL, size INTEGER NOT NULL, title TEXT, description TEXT, headings TEXT)')
+                    db.execute('CREATE INDEX notes_folder ON notes (folder)')
+                    try:
+                        db.execute("CREATE VIRTUAL TABLE search USING fts5(title, body, tokenize='unicode61 remove_diacritics 2')")
+                    except sqlite3.OperationalError as e:
+                        print('NoteIndex: Full-text search is not available: ' + str(e), file=sys.stderr)
+                    db.execute('PRAGMA user_version = ' + str(SCHEMA_VERSION))
+
+            # Check if search is available
+            self.searchable = db.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'search'").fetchone()[0] > 0
+
+        finally:
+            db.close()
+
+
+    # Opens a connection to the database. Connections can't be shared between threads, so each thread opens its own.
+    def connect(self):
+
+        # Open it. Write-ahead logging lets the UI thread read while the background threads write.
+        db = sqlite3.connect(self.path, timeout=10)
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('PRAGMA synchronous = NORMAL')
+        return db
+
+
+    # Returns the saved listing of each folder, as a { folder: ({ path: (mtime, size) }, { path: description }) } dict. Folders
+    # which have never been indexed aren't included.
+    def load(self, folders):
+
+        # Read all the notes in one go
+        listings = { folder: ({}, {}) for folder in folders }
+        db = self.connect()
+        try:
+            rows = db.execute('SELECT folder, path, mtime, size, description FROM notes').fetchall()
+        finally:
+            db.close()
+
+        # Group them by folder
+        found = set()
+        for folder, path, mtime, size, description in rows:
+            listing = listings.get(folder)
+            if listing:
+                listing[0][path] = (mtime, size)
+                if description is not None:
+                    listing[1][path] = description
+                found.add(folder)
+
+        # Done
+        return { folder: listing for folder, listing in listings.items() if folder in found }
+
+
+    # Checks the saved listings against the folders on a background thread, indexing new and changed notes and forgetting removed ones.
+    # Each folder is listed by calling scan(folder), which returns a tuple of (tree, { path: (mtime, size) }). For each folder, onFolder
+    # is called on the UI thread with (folder, tree, { path: (mtime, size) }, { path: description }) where the descriptions are only those
+    # of new and changed notes. Notes in folders which aren't in allFolders, the full list of note folders, are forgotten.
+    def reconcile(self, folders, allFolders, scan, onFolder):
+        threading.Thread(target=self.runReconcile, args=(list(folders), list(allFolders), scan, onFolder), daemon=True).start()
+
+
+    # Runs on the reconcile thread
+    def runReconcile(self, folders, allFolders, scan, onFolder):
+
+        db = self.connect()
+        try:
+
+            # Forget notes in folders which are no longer listed. Notes in folders which are still listed are kept even if they weren't
+            # indexed before, since the indexer thread may be adding them now.
+            if allFolders:
+                with db:
+                    for (path,) in db.execute('SELECT path FROM notes WHERE folder NOT IN (' + ','.join('?' * len(allFolders)) + ')', allFolders).fetchall():
+                        self.deleteNote(db, path)
+
+            # Check each folder
+            for folder in folders:
+                try:
+                    result = self.reconcileFolder(db, folder, scan)
+                except (OSError, sqlite3.Error) as e:
+                    print('NoteIndex: Unable to index ' + folder + ': ' + str(e), file=sys.stderr)
+                    continue
+                self.callAfter(onFolder, folder, *result)
+
+        finally:
+            db.close()
+
+
+    # Checks one folder against the index, returning a tuple of (tree, listing, descriptions of new and changed notes)
+    def reconcileFolder(self, db, folder, scan):
+
+        # Get the saved listing
+        saved = { path: (mtime, size) for path, mtime, size in db.execute('SELECT path, mtime, size FROM notes WHERE folder = ?', (folder,)) }
+
+        # List the folder and its subfolders
+        tree, entries = scan(folder)
+
+        # Index new and changed notes. They're committed a batch at a time, so other threads aren't kept waiting to write.
+        descriptions = {}
+        changed = [(path, stamp) for path, stamp in entries.items() if saved.get(path) != stamp]
+        for i in range(0, len(changed), RECONCILE_BATCH):
+            with db:
+                for path, stamp in changed[i:i + RECONCILE_BATCH]:
+                    try:
+                        descriptions[path] = self.indexNote(db, path, folder, stamp)
+                    except (OSError, ValueError):
+                        continue
+
+        # Forget removed notes
+        with db:
+            for path in saved:
+                if path not in entries:
+                    self.deleteNote(db, path)
+
+        # Done
+        return tree, entries, descriptions
+
+
+    # Queues notes to be reindexed on a background thread, as a { path: folder } dict. Notes which no longer exist are removed from the index.
+    def update(self, notes):
+
+        with self.lock:
+
+            # Add them
+            self.pending.update(notes)
+
+            # Start the indexer thread if needed
+            if not self.running:
+                self.running = True
+                threading.Thread(target=self.runUpdate, daemon=True).start()
+
+
+    # Runs on the indexer thread
+    def runUpdate(self):
+
+        db = self.connect()
+        try:
+            while True:
+
+                # Get the queued notes, or stop if there are none
+                with self.lock:
+                    if not self.pending:
+                        self.running = False
+                        break
+                    notes = self.pending
+                    self.pending = {}
+
+                # Index them
+                try:
+                    with db:
+                        for path, folder in notes.items():
+                            try:
+                                stat = os.stat(path)
+                                self.indexNote(db, path, folder, (stat.st_mtime_ns, stat.st_size))
+                            except FileNotFoundError:
+                                self.deleteNote(db, path)
+                            except (OSError, ValueError):
+                                continue
+                except sqlite3.Error as e:
+                    print('NoteIndex: Unable to update the index: ' + str(e), file=sys.stderr)
+
+        finally:
+            db.close()
+
+        # Let the owner know
+        if self.onUpdated:
+            self.callAfter(self.onUpdated)
+
+
+    # Reads a note and saves its metadata and text. Returns its description.
+    def indexNote(self, db, path, folder, stamp):
+
+        # Read it
+        with open(path, errors='replace') as file:
+            text = file.read()
+        title, description, headings = readNoteInfo(path, text)
+
+        # Save metadata, keeping the note's row ID so its search entry can be found
+        row = db.execute('SELECT id FROM notes WHERE path = ?', (path,)).fetchone()
+        if row:
+            noteID = row[0]
+            db.execute('UPDATE notes SET folder = ?, mtime = ?, size = ?, title = ?, description = ?, headings = ? WHERE id = ?', (folder, stamp[0], stamp[1], title, description, json.dumps(headings), noteID))
+        else:
+            noteID = db.execute('INSERT INTO notes (path, folder, mtime, size, title, description, headings) VALUES (?, ?, ?, ?, ?, ?, ?)', (path, folder, stamp[0], stamp[1], title, description, json.dumps(headings))).lastrowid
+
+        # Save text
+        if self.searchable:
+            db.execute('DELETE FROM search WHERE rowid = ?', (noteID,))
+            db.execute('INSERT INTO search (rowid, title, body) VALUES (?, ?, ?)', (noteID, title, text))
+
+        # Done
+        return description
+
+
+    # Removes a note from the index
+    def deleteNote(self, db, path):
+        row = db.execute('SELECT id FROM notes WHERE path = ?', (path,)).fetchone()
+        if row:
+            db.execute('DELETE FROM notes WHERE id = ?', row)
+            if self.searchable:
+                db.execute('DELETE FROM search WHERE rowid = ?', row)
+
+
+    # Searches the notes, returning the paths of the best matches, best first. Words match the start of words in the notes, and text in
+    # quotes matches a phrase. Must be called on the UI thread.
+    def search(self, text):
+
+        # Stop if search isn't available or there's nothing to search for
+        query = buildQuery(text)
+        if not self.searchable or not query:
+            return []
+
+        # Open the connection if needed
+        if not self.searchDb:
+            self.searchDb = self.connect()
+
+        # Search. The best matches are found before joining with the notes table, so only those rows are looked up.
+        try:
+            rows = self.searchDb.execute('SELECT notes.path FROM (SELECT rowid, bm25(search, ?, ?) AS score FROM search WHERE search MATCH ? ORDER BY score LIMIT ?) AS results JOIN notes ON notes.id = results.rowid ORDER BY results.score', (*SEARCH_WEIGHTS, query, SEARCH_LIMIT)).fetchall()
+        except sqlite3.OperationalError as e:
+            print('NoteIndex: Search failed: ' + str(e), file=sys.stderr)
+            return []
+
+        # Done
+        return [path for (path,) in rows]
+
+
+
+# Converts text typed in the search box into an FTS5 query. Words and quoted phrases must all match. The last word matches as a prefix
+# while it's still being typed, as do words ending in *.
+def buildQuery(text):
+
+    # Go through words and phrases
+    terms = []
+    for match in re.finditer(r'"([^"]*)("?)|(\S+)', text):
+
+        # Get the text, and check if it should match as a prefix
+        phrase, closed, word = match.groups()
+        value = word if word is not None else phrase
+        atEnd = match.end() == len(text)
+        prefix = (word is not None and (word.endswith('*') or atEnd)) or (word is None and not closed and atEnd)
+        value = value.rstrip('*')
+
+        # Skip terms without any words, since they can't match anything
+        if not re.search(r'\w', value):
+            continue
+
+        # Add it, quoted so characters which mean something to FTS5 are searched for literally
+        terms.append('"' + value.replace('"', '""') + '"' + ('*' if prefix else ''))
+
+    # Done
+    return ' '.join(terms)
+
+
+# Returns the line shown under a note's name in the file list, which is the first line that isn't blank or a heading. If limit is set,
+# only that many characters are read from the start of the note.
+def readDescription(path, limit=None):
+
+    # Read file
+    with open(path, errors='replace') as file:
+        text = file.read(limit) if limit else file.read()
+
+    # Go through lines
+    for line in text.splitlines():
+
+        # Ignore blank lines
+        if not line.strip():
+            continue
+
+        # Ignore headings
+        if line[0] == '#':
+            continue
+
+        # Use this line
+        return line.strip()
+
+    # Nothing found
+    return "(none)"
+
+
+# Gets a note's title, description and headings from its text. Headings are a list of (level, text) tuples, and the title is the first
+# heading, or the file name if there isn't one.
+def readNoteInfo(path, text):
+
+    # Go through the lines
+    description = None
+    headings = []
+    inCode = False
+    for line in text.splitlines():
+
+        # Skip blank lines
+        if not line.strip():
+            continue
+
+        # Skip fenced code blocks when looking for headings
+        if line.startswith('```') or line.startswith('~~~'):
+            inCode = not inCode
+
+        # Check for a heading
+        if line[0] == '#':
+            level = len(line) - len(line.lstrip('#'))
+            if not inCode and level <= 6 and (len(line) == level or line[level] in ' \t'):
+                headings.append((level, CLOSING_HASHES_REGEX.sub('', line[level:].strip())))
+            continue
+
+        # Use the first other line as the description
+        if description is None:
+            description = line.strip()
+
+    # Get title
+    title = headings[0][1] if headings else os.path.splitext(os.path.basename(path))[0]
+
+    # Done
+    return title, description or "(none)", headings
+
+
+# Timers for the index
+Instrumentation.instrument(NoteIndex, 'load', 'NoteIndex.load')
+Instrumentation.instrument(NoteIndex, 'reconcileFolder', 'NoteIndex.reconcileFolder', lambda self, db, folder, scan: folder)
+Instrumentation.instrument(NoteIndex, 'search', 'NoteIndex.search', lambda self, text: text)
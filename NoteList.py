@@ -0,0 +1,206 @@
+
+import os
+import bisect
+
+# Orders the notes can be listed in
+SORT_MODIFIED = 'modified'
+SORT_TITLE = 'title'
+SORT_FOLDER = 'folder'
+SORT_ORDERS = (SORT_MODIFIED, SORT_TITLE, SORT_FOLDER)
+
+# Changes to more than this fraction of the notes at once are applied by sorting everything again, which is quicker than moving them one at a time
+REBUILD_FRACTION = 0.25
+
+
+class NoteList:
+    """ The notes shown in the file list, kept sorted so adding, removing or changing a note only moves that note. Each note's sort key
+    is kept by path, so its row is found with a binary search instead of going through the list. While searching, the list shows the
+    search results in their own order instead. The first row which changed since the list was last drawn is tracked, so only the rows
+    from there on need redrawing. """
+
+    # Constructor
+    def __init__(self, order=SORT_MODIFIED):
+
+        # Store settings
+        self.order = order if order in SORT_ORDERS else SORT_MODIFIED
+
+        # Position of each note folder, for sorting by folder
+        self.folders = {}
+
+        # Notes as { path: (folder, mtime) }, their sort keys by path, and the sort keys in order. Each key ends with the note's path.
+        self.notes = {}
+        self.keys = {}
+        self.sorted = []
+
+        # Search results which are listed, and their rows by path, or None if not searching
+        self.filter = None
+        self.filtered = None
+        self.filterRows = None
+
+        # First row which has changed since the last call to takeChanged, or None if nothing has
+        self.firstChanged = None
+
+
+    # Returns the number of rows
+    def __len__(self):
+        return len(self.filtered) if self.filter is not None else len(self.sorted)
+
+
+    # Returns the path of the note in a row
+    def __getitem__(self, row):
+        return self.filtered[row] if self.filter is not None else self.sorted[row][-1]
+
+
+    # Returns True if a note is listed
+    def __contains__(self, path):
+        return path in (self.filterRows if self.filter is not None else self.notes)
+
+
+    # Returns True if a note is in the list, even if it's not in the search results
+    def hasNote(self, path):
+        return path in self.notes
+
+
+    # Returns the first note in the list, ignoring any search, or None if there are none
+    def firstNote(self):
+        return self.sorted[0][-1] if self.sorted else None
+
+
+    # Returns the row of a note, or None if it's not listed
+    def rowOf(self, path):
+
+        # Search results have their rows stored
+        if self.filter is not None:
+            return self.filterRows.get(path)
+
+        # Find the key in the sorted list
+        key = self.keys.get(path)
+        if key is None:
+            return None
+        return bisect.bisect_left(self.sorted, key)
+
+
+    # Returns the modification time of a note, or None if it's not in the list
+    def mtime(self, path):
+        note = self.notes.get(path)
+        return note[1] if note else None
+
+
+    # Returns the note folder a note is listed from, or None if it's not in the list
+    def folder(self, path):
+        note = self.notes.get(path)
+        return note[0] if note else None
+
+
+    # Returns the sort key of a note
+    def sortKey(self, path, folder, mtime):
+
+        # Sort by name, ignoring case. This runs for every note when the list is sorted, so the name is found without os.path.
+        name = path[path.rfind(os.sep) + 1:].casefold()
+        if name.endswith('.md'):
+            name = name[:-3]
+
+        # Add the order's own fields in front
+        if self.order == SORT_MODIFIED:
+            return (-mtime, name, path)
+        elif self.order == SORT_FOLDER:
+            return (self.folders.get(folder, len(self.folders)), os.path.dirname(path).casefold(), name, path)
+        else:
+            return (name, path)
+
+
+    # Changes the order of the notes
+    def setOrder(self, order):
+        if order in SORT_ORDERS and order != self.order:
+            self.order = order
+            self.rebuild()
+
+
+    # Sets the note folders, in the order they're listed in when sorting by folder
+    def setFolders(self, folders):
+        positions = { folder: i for i, folder in enumerate(dict.fromkeys(folders)) }
+        if positions != self.folders:
+            self.folders = positions
+            if self.order == SORT_FOLDER:
+                self.rebuild()
+
+
+    # Lists only the search results, as a list of paths best first, or lists everything again if paths is None. Results which aren't
+    # in the list are left out.
+    def setFilter(self, paths):
+        self.filter = paths
+        self.updateFilter()
+        self.markChanged(0)
+
+
+    # Adds, changes and removes notes, as a { path: (folder, mtime) } dict where removed notes have None instead
+    def apply(self, changes):
+
+        # Sort everything again if a lot has changed
+        if len(changes) > max(1, len(self.sorted) * REBUILD_FRACTION):
+            for path, note in changes.items():
+                if note:
+                    self.notes[path] = note
+                else:
+                    self.notes.pop(path, None)
+            self.rebuild()
+            return
+
+        # Move each note to its new place
+        for path, note in changes.items():
+
+            # Remove its old key, unless it hasn't moved
+            key = self.sortKey(path, *note) if note else None
+            oldKey = self.keys.get(path)
+            if oldKey is not None and oldKey != key:
+                row = bisect.bisect_left(self.sorted, oldKey)
+                del self.sorted[row]
+                del self.keys[path]
+                self.markChanged(row)
+
+            # Add the new key
+            if note:
+                self.notes[path] = note
+                row = bisect.bisect_left(self.sorted, key)
+                if oldKey != key:
+                    self.sorted.insert(row, key)
+                    self.keys[path] = key
+                self.markChanged(row)
+            else:
+                self.notes.pop(path, None)
+
+        # Update the search results
+        if self.filter is not None and changes:
+            self.updateFilter()
+            self.markChanged(0)
+
+
+    # Sorts all the notes again
+    def rebuild(self):
+        self.keys = { path: self.sortKey(path, folder, mtime) for path, (folder, mtime) in self.notes.items() }
+        self.sorted = sorted(self.keys.values())
+        self.updateFilter()
+        self.markChanged(0)
+
+
+    # Lists the search results which are in the list
+    def updateFilter(self):
+        if self.filter is None:
+            self.filtered = None
+            self.filterRows = None
+        else:
+            self.filtered = [path for path in dict.fromkeys(self.filter) if path in self.notes]
+            self.filterRows = { path: row for row, path in enumerate(self.filtered) }
+
+
+    # Records that a row and the rows after it have changed
+    def markChanged(self, row):
+        if self.firstChanged is None or row < self.firstChanged:
+            self.firstChanged = row
+
+
+    # Returns the first row which has changed since the last call, or None if nothing has, and starts tracking changes again
+    def takeChanged(self):
+        row = self.firstChanged
+        self.firstChanged = None
+        return row
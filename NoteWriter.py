@@ -0,0 +1,180 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+
+# Fsync policies. 'none' leaves flushing to the OS, 'file' syncs the new file before it replaces the old one, and 'full' also syncs
+# the folder afterwards so the rename itself survives a power cut.
+FSYNC_NONE = 'none'
+FSYNC_FILE = 'file'
+FSYNC_FULL = 'full'
+
+
+class NoteWriter:
+    """ Saves notes on a writer thread. Each save is a snapshot of the text, and saves queued for the same file are coalesced so only
+    the newest one is written. Files are written to a temporary file next to the note and moved over it, so a crash mid-write leaves
+    the old version intact. """
+
+    # Constructor
+    def __init__(self, callAfter, fsyncPolicy=FSYNC_FILE):
+
+        # Store the function used to run code on the UI thread, and the fsync policy
+        self.callAfter = callAfter
+        self.fsyncPolicy = fsyncPolicy
+
+        # Called on the UI thread with (path, error) after each write. Error is None if the write succeeded.
+        self.onSaved = None
+
+        # Text waiting to be written, by path. Dicts keep insertion order, so files are written in the order they were first queued.
+        self.pending = {}
+
+        # Modification time of each file just after it was last written
+        self.writtenTimes = {}
+
+        # Path being written right now, if any
+        self.writing = None
+
+        # True while the writer thread is running
+        self.running = False
+
+        # Lock protecting the state above, and a condition signalled whenever a write finishes
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+
+
+    # Queues a snapshot of a note to be written. Replaces any older snapshot of the same file which hasn't been written yet.
+    # If onWritten is set, it's called on the writer thread once this snapshot, or a newer one, has been written.
+    def save(self, path, text, onWritten=None):
+
+        with self.lock:
+
+            # Replace the pending text, moving the file to the back of the queue. Callbacks for the older snapshot move to the new one.
+            callbacks = self.pending.pop(path, (None, []))[1]
+            if onWritten:
+                callbacks.append(onWritten)
+            self.pending[path] = (text, callbacks)
+
+            # Start the writer thread if needed. It isn't a daemon, so pending saves are finished before the app exits.
+            if not self.running:
+                self.running = True
+                threading.Thread(target=self.run).start()
+
+
+    # Drops any pending save of a file, for example when it's about to be deleted. A write already in progress still completes.
+    def cancel(self, path):
+        with self.lock:
+            self.pending.pop(path, None)
+
+
+    # Waits until the specified file, or all files if not specified, have been written
+    def wait(self, path=None):
+        with self.lock:
+            if path is None:
+                self.changed.wait_for(lambda: not self.running)
+            else:
+                self.changed.wait_for(lambda: path not in self.pending and self.writing != path)
+
+
+    # Returns True if a file has a save which hasn't finished yet
+    def isPending(self, path):
+        with self.lock:
+            return path in self.pending or self.writing == path
+
+
+    # Returns the modification time of a file just after we last wrote it, or None if we haven't. A different time means it was changed by something else.
+    def writtenTime(self, path):
+        with self.lock:
+            return self.writtenTimes.get(path)
+
+
+    # Runs on the writer thread
+    def run(self):
+
+        while True:
+
+            # Get the oldest pending save, or stop if there are none
+            with self.lock:
+                if not self.pending:
+                    self.running = False
+                    self.changed.notify_all()
+                    return
+                path = next(iter(self.pending))
+                text, callbacks = self.pending.pop(path)
+                self.writing = path
+
+            # Write it
+            error = None
+            mtime = None
+            try:
+                writeFileAtomic(path, text, self.fsyncPolicy)
+                mtime = os.stat(path).st_mtime_ns
+            except Exception as e:
+                error = e
+
+            # Let the callers know it's been written. Their failures aren't save errors, since the note is safely on disk.
+            if error is None:
+                for callback in callbacks:
+                    try:
+                        callback()
+                    except Exception as e:
+                        print('NoteWriter: Callback failed after saving ' + path + ': ' + str(e), file=sys.stderr)
+
+            # Mark as done
+            with self.lock:
+                if mtime is not None:
+                    self.writtenTimes[path] = mtime
+                self.writing = None
+                self.changed.notify_all()
+
+            # Report back to the UI thread
+            if self.onSaved:
+                self.callAfter(self.onSaved, path, error)
+
+
+
+# Writes text to a file by writing a temporary file in the same folder and moving it into place
+def writeFileAtomic(path, text, fsyncPolicy=FSYNC_FILE):
+
+    # Create the temporary file. It's hidden, and doesn't end in .md, so it won't show up in the note list.
+    folder, filename = os.path.split(os.path.abspath(path))
+    fd, tempPath = tempfile.mkstemp(dir=folder, prefix='.' + filename + '.', suffix='.tmp')
+    try:
+
+        # Write the content
+        with os.fdopen(fd, 'w') as file:
+            file.write(text)
+            if fsyncPolicy != FSYNC_NONE:
+                file.flush()
+                os.fsync(file.fileno())
+
+        # Keep the permissions of the existing file
+        try:
+            shutil.copymode(path, tempPath)
+        except OSError:
+            pass
+
+        # Move it into place
+        os.replace(tempPath, path)
+
+    except BaseException:
+
+        # Remove the temporary file
+        try:
+            os.remove(tempPath)
+        except OSError:
+            pass
+        raise
+
+    # Sync the folder so the rename is durable. Not all platforms allow opening a folder, in which case this is skipped.
+    if fsyncPolicy == FSYNC_FULL:
+        try:
+            dirFd = os.open(folder, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dirFd)
+        except OSError:
+            pass
+        finally:
+            os.close(dirFd)
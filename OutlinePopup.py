@@ -0,0 +1,74 @@
+
+import wx
+from Theme import *
+
+# Height of each row, and the most rows to show before scrolling
+ROW_HEIGHT = 24
+MAX_VISIBLE_ROWS = 16
+
+
+class OutlinePopup(wx.PopupTransientWindow):
+    """ Popup listing the headings of a note. Selecting one calls onSelect with its index in the outline. Rows are drawn on demand,
+    so it opens instantly even for notes with thousands of headings. """
+
+    # Constructor
+    def __init__(self, parent, document, currentLine, onSelect):
+        super().__init__(parent)
+
+        # Store callback
+        self.onSelect = onSelect
+
+        # Create list
+        self.list = OutlineList(self, document)
+        rows = document.headingCount()
+        self.list.SetSize(320, ROW_HEIGHT * max(1, min(rows, MAX_VISIBLE_ROWS)))
+        self.SetSize(self.list.GetSize())
+
+        # Select the heading of the section the cursor is in, and scroll to it
+        index = document.headingIndex(currentLine)
+        if index >= 0:
+            self.list.SetSelection(index)
+            self.list.ScrollToRow(max(0, index - MAX_VISIBLE_ROWS // 2))
+
+        # Listen for events
+        self.list.Bind(wx.EVT_LISTBOX, self.onItemSelected)
+
+
+    # Called when the user selects a heading
+    def onItemSelected(self, e):
+        self.Dismiss()
+        self.onSelect(self.list.GetSelection())
+
+
+
+class OutlineList(wx.VListBox):
+
+    # Constructor
+    def __init__(self, parent, document):
+        super().__init__(parent)
+
+        # Store the document model
+        self.document = document
+
+        # Setup list
+        self.SetBackgroundColour(Theme.getColor('root/file-list', 'background-color'))
+        self.SetSelectionBackground(Theme.getColor('root/file-list/selected', 'background-color'))
+        self.SetRowCount(document.headingCount())
+
+
+    # Called to determine the height of each row
+    def OnMeasureItem(self, n):
+        return ROW_HEIGHT
+
+
+    # Called to draw the specified row, indented by heading level
+    def OnDrawItem(self, dc, rect, n):
+
+        # Get heading
+        level, text, line, position = self.document.heading(n)
+
+        # Draw it
+        selector = 'root/file-list/title' if level == 1 else 'root/file-list/subtitle'
+        dc.SetFont(Theme.getFont(selector))
+        dc.SetTextForeground(Theme.getColor(selector, 'foreground-color'))
+        dc.DrawText(text=text or '(untitled)', x=rect.x + 10 + (level - 1) * 12, y=rect.y + 4)
@@ -0,0 +1,99 @@
+
+import wx
+import json
+import Instrumentation
+
+
+class PerformanceOverlay(wx.Frame):
+    """ Debug window showing the timings collected by Instrumentation, refreshed every second. """
+
+    # Constructor
+    def __init__(self, parent):
+        super().__init__(parent, title="Performance", size=(640, 480), style=wx.DEFAULT_FRAME_STYLE | wx.FRAME_TOOL_WINDOW | wx.FRAME_FLOAT_ON_PARENT)
+
+        # Setup sizer
+        sizer = wx.BoxSizer(orient=wx.VERTICAL)
+        self.SetSizer(sizer)
+        self.SetAutoLayout(True)
+
+        # Add results text
+        self.text = wx.TextCtrl(self, style=wx.TE_MULTILINE | wx.TE_READONLY | wx.TE_DONTWRAP)
+        self.text.SetFont(wx.Font(9, wx.FONTFAMILY_TELETYPE, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL))
+        sizer.Add(self.text, proportion=1, flag=wx.EXPAND)
+
+        # Add buttons
+        buttons = wx.BoxSizer()
+        sizer.Add(buttons, flag=wx.ALIGN_RIGHT | wx.ALL, border=4)
+        resetBtn = wx.Button(self, label="Reset")
+        resetBtn.Bind(wx.EVT_BUTTON, lambda e: self.onResetPressed())
+        buttons.Add(resetBtn)
+        exportBtn = wx.Button(self, label="Export JSON...")
+        exportBtn.Bind(wx.EVT_BUTTON, lambda e: self.onExportPressed())
+        buttons.Add(exportBtn, flag=wx.LEFT, border=4)
+
+        # Refresh every second
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, lambda e: self.refresh(), self.timer)
+        self.timer.Start(1000)
+        self.Bind(wx.EVT_CLOSE, self.onClose)
+        self.refresh()
+
+
+    # Updates the results text
+    def refresh(self):
+
+        # Check if enabled
+        if not Instrumentation.enabled:
+            self.text.SetValue("Instrumentation is off. Add 'instrumentation = yes' to the [debug] section of settings.ini and restart the app.")
+            return
+
+        # Add a row for each timer
+        results = Instrumentation.results()
+        lines = ['%-32s %8s %9s %9s %9s %9s' % ('Timer', 'Count', 'p50 ms', 'p95 ms', 'p99 ms', 'Max ms')]
+        for name, timer in results['timers'].items():
+            if 'p50Ms' in timer:
+                lines.append('%-32s %8d %9.3f %9.3f %9.3f %9.3f' % (name, timer['count'], timer['p50Ms'], timer['p95Ms'], timer['p99Ms'], timer['maxMs']))
+
+        # Add the slowest calls which have details
+        lines.append('')
+        lines.append('Slowest calls')
+        for name, timer in results['timers'].items():
+            for call in timer.get('slowest', []):
+                if call['detail']:
+                    lines.append('%-32s %9.3f  %s' % (name, call['ms'], call['detail']))
+
+        # Add counters and other values
+        lines.append('')
+        for name, value in results['counters'].items():
+            lines.append('%-32s %8d' % (name, value))
+        for name, value in results['sources'].items():
+            lines.append('%-32s %s' % (name, json.dumps(value)))
+
+        # Update text, keeping the scroll position
+        pos = self.text.GetScrollPos(wx.VERTICAL)
+        self.text.SetValue('\n'.join(lines))
+        self.text.SetScrollPos(wx.VERTICAL, pos)
+
+
+    # Called when the user presses the reset button
+    def onResetPressed(self):
+        Instrumentation.reset()
+        self.refresh()
+
+
+    # Called when the user presses the export button
+    def onExportPressed(self):
+
+        # Ask where to save
+        path = wx.FileSelector("Export performance results", default_filename="performance.json", wildcard="JSON files (*.json)|*.json", flags=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT, parent=self)
+        if not path:
+            return
+
+        # Save it
+        Instrumentation.exportJSON(path)
+
+
+    # Called when the window is closed
+    def onClose(self, e):
+        self.timer.Stop()
+        e.Skip()
@@ -5,6 +5,7 @@ import configparser
 import glob
 import os
 import ctypes
+import Instrumentation
 
 class ThemeManager:
 
@@ -107,9 +108,10 @@ class ThemeManager:
         fontFamily = self.getStyle(selector, 'font-family')
         fontStyles = self.getStyle(selector, 'font-styles')
         isBold = "bold" in fontStyles
+        isItalic = "italic" in fontStyles
 
         # Build font description
-        value = self.fontCache.FindOrCreateFont(point_size=int(fontSize), family=wx.FONTFAMILY_DEFAULT, style=wx.FONTSTYLE_NORMAL, weight=wx.FONTWEIGHT_BOLD if isBold else wx.FONTWEIGHT_NORMAL, underline=False, facename=fontFamily)
+        value = self.fontCache.FindOrCreateFont(point_size=int(fontSize), family=wx.FONTFAMILY_DEFAULT, style=wx.FONTSTYLE_ITALIC if isItalic else wx.FONTSTYLE_NORMAL, weight=wx.FONTWEIGHT_BOLD if isBold else wx.FONTWEIGHT_NORMAL, underline=False, facename=fontFamily)
         
         # Store in cache
         self.cache[cacheID] = value
@@ -163,4 +165,11 @@ class ThemeManager:
 
 
 # Load default theme
-Theme = ThemeManager("Sunlight")
\ No newline at end of file
+Theme = ThemeManager("Sunlight")
+
+
+# Timers for theme lookups
+Instrumentation.instrument(ThemeManager, 'getStyle', 'Theme.getStyle')
+Instrumentation.instrument(ThemeManager, 'getColor', 'Theme.getColor')
+Instrumentation.instrument(ThemeManager, 'getFont', 'Theme.getFont')
+Instrumentation.instrument(ThemeManager, 'getIcon', 'Theme.getIcon')
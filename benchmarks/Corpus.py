@@ -0,0 +1,103 @@
+#
+# Synthetic Markdown corpora for the benchmarks
+
+import random
+
+
+# Corpus sizes, in bytes
+SIZES = [1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024, 50 * 1024 * 1024]
+
+# Words used to build prose
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "notes", "markdown", "#tag", "issue#12", "text", "meeting", "todo"]
+
+
+# Returns a line of prose
+def prose(rnd):
+    return " ".join(rnd.choice(WORDS) for w in range(rnd.randint(0, 16)))
+
+
+# Generates a block of lines where about half are headings
+def headingHeavy(rnd):
+
+    # Create lines
+    lines = []
+    for i in range(1000):
+        lines.append(rnd.choice(["# ", "## ", "### "]) + prose(rnd))
+        if rnd.random() < 0.5:
+            lines.append(prose(rnd))
+
+    # Done
+    return "\n".join(lines) + "\n"
+
+
+# Generates a block of lines which are almost all prose
+def proseHeavy(rnd):
+
+    # Create lines
+    lines = []
+    for i in range(1000):
+        if rnd.random() < 0.01:
+            lines.append("# " + prose(rnd))
+        else:
+            lines.append(prose(rnd))
+
+    # Done
+    return "\n".join(lines) + "\n"
+
+
+# Generates a block of lines with runs of # characters, which are the worst case for the header matchers
+def hashRuns(rnd):
+
+    # Create lines
+    lines = []
+    for i in range(1000):
+        kind = rnd.random()
+        if kind < 0.3: lines.append("#" * rnd.randint(1, 40))
+        elif kind < 0.5: lines.append("# " * rnd.randint(1, 20))
+        elif kind < 0.7: lines.append("#")
+        else: lines.append("#" * rnd.randint(1, 6) + prose(rnd))
+
+    # Done
+    return "\n".join(lines) + "\n"
+
+
+# Generates a block of notes using most of the Markdown syntax, including fenced code
+def mixed(rnd):
+
+    # Create lines
+    lines = []
+    for i in range(200):
+        kind = rnd.random()
+        if kind < 0.1: lines.append("## " + prose(rnd))
+        elif kind < 0.3: lines.append("- " + prose(rnd) + " **" + prose(rnd) + "x**")
+        elif kind < 0.4: lines.append("> " + prose(rnd) + " *em*")
+        elif kind < 0.5: lines.append("| " + prose(rnd) + " | `code` |")
+        elif kind < 0.55: lines += ["```python", "def f(x):", "    return x + 1  # " + prose(rnd), "```"]
+        elif kind < 0.6: lines += ["```sh", "echo \"" + prose(rnd) + "\" $HOME", "```"]
+        else: lines.append(prose(rnd) + " [" + prose(rnd) + "link](https://example.com) _" + prose(rnd) + "x_")
+
+    # Done
+    return "\n".join(lines) + "\n"
+
+
+# Available corpus generators
+CORPORA = {
+    'heading-heavy': headingHeavy,
+    'prose-heavy': proseHeavy,
+    'hash-runs': hashRuns,
+    'mixed': mixed
+}
+
+
+# Generates a corpus of the specified kind and size, in bytes of ASCII text
+def generate(kind, size, seed=1):
+
+    # Create a block of text, and repeat it until we reach the size
+    block = CORPORA[kind](random.Random(seed))
+    return block * (size // len(block)) + block[:size % len(block)]
+
+
+# Returns a short label for a size in bytes
+def sizeLabel(size):
+    if size >= 1024 * 1024: return str(size // (1024 * 1024)) + "MB"
+    return str(size // 1024) + "KB"
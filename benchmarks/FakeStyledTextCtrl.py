@@ -0,0 +1,112 @@
+#
+# Stand-in for wx.stc.StyledTextCtrl, with just enough of its API to run the lexer without wx
+
+import bisect
+
+
+class FakeStyledTextCtrl:
+    """ Stores text and styles as bytes, with positions in bytes like Scintilla. """
+
+    # Constructor
+    def __init__(self, text=''):
+
+        # Store text and a style byte for each text byte
+        self.data = bytearray(text.encode('utf-8'))
+        self.styles = bytearray(len(self.data))
+
+        # Styling state
+        self.endStyled = 0
+        self.stylePos = 0
+
+        # Sorted list of the position of the start of each line
+        self.lineStarts = [0]
+        idx = self.data.find(b'\n')
+        while idx != -1:
+            self.lineStarts.append(idx + 1)
+            idx = self.data.find(b'\n', idx + 1)
+
+        # Functions called with (position, length, inserted) when text is inserted or deleted, like EVT_STC_MODIFIED
+        self.onModified = []
+
+
+    def GetText(self):
+        return self.data.decode('utf-8')
+
+    def GetTextRange(self, startPos, endPos):
+        return self.data[startPos:endPos].decode('utf-8')
+
+    def GetLength(self):
+        return len(self.data)
+
+    def GetTextLength(self):
+        return len(self.data)
+
+    def GetLineCount(self):
+        return len(self.lineStarts)
+
+    def LineFromPosition(self, pos):
+        return bisect.bisect_right(self.lineStarts, pos) - 1
+
+    def PositionFromLine(self, line):
+        return self.lineStarts[line] if line < len(self.lineStarts) else -1
+
+    def GetLineEndPosition(self, line):
+        if line + 1 < len(self.lineStarts): return self.lineStarts[line + 1] - 1
+        return len(self.data)
+
+    def GetEndStyled(self):
+        return self.endStyled
+
+    def StartStyling(self, pos, mask=31):
+        self.stylePos = pos
+
+    def SetStyling(self, length, style):
+        self.styles[self.stylePos:self.stylePos + length] = bytes([style]) * length
+        self.stylePos += length
+        self.endStyled = self.stylePos
+
+    def SetStyleBytes(self, length, styleBytes):
+        self.styles[self.stylePos:self.stylePos + length] = styleBytes[:length]
+        self.stylePos += length
+        self.endStyled = self.stylePos
+
+    def GetStyleAt(self, pos):
+        return self.styles[pos]
+
+
+    # Inserts text at a position
+    def InsertText(self, pos, text):
+
+        # Insert it
+        data = text.encode('utf-8')
+        self.data[pos:pos] = data
+        self.styles[pos:pos] = bytes(len(data))
+
+        # Shift the line starts after it, then index the new lines
+        line = self.LineFromPosition(pos)
+        self.lineStarts[line+1:] = [p + len(data) for p in self.lineStarts[line+1:]]
+        if b'\n' in data:
+            self.lineStarts[line+1:line+1] = [pos + i + 1 for i in range(len(data)) if data[i] == 10]
+
+        # Scintilla marks everything after the change as unstyled
+        self.endStyled = min(self.endStyled, pos)
+        for callback in self.onModified:
+            callback(pos, len(data), True)
+
+
+    # Deletes a range of text
+    def DeleteRange(self, pos, length):
+
+        # Delete it
+        del self.data[pos:pos + length]
+        del self.styles[pos:pos + length]
+
+        # Remove line starts inside the deleted range, and shift the ones after it
+        first = bisect.bisect_right(self.lineStarts, pos)
+        last = bisect.bisect_right(self.lineStarts, pos + length)
+        self.lineStarts[first:] = [p - length for p in self.lineStarts[last:]]
+
+        # Scintilla marks everything after the change as unstyled
+        self.endStyled = min(self.endStyled, pos)
+        for callback in self.onModified:
+            callback(pos, length, False)
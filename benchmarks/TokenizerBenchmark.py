@@ -0,0 +1,379 @@
+#
+# Tokenizer benchmark and regression suite. Run from the project root with:
+#
+#   python benchmarks/TokenizerBenchmark.py [--sizes 1KB,1MB] [--out results.json] [--compare baseline.json]
+#
+# First checks that the tokenizer and lexer give the same output as the reference implementation, then measures
+# tokens/sec, peak memory and time to first token for MarkdownTokens on each synthetic corpus, and the per-keystroke
+# styling latency of a simulated typing session. With --compare, exits with an error if throughput has dropped by
+# more than the threshold compared to a previous results file.
+
+import io
+import re
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+
+# Allow importing the app modules from the project root
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, "../..")))
+from MarkdownStreamingTokenizer import *
+from MarkdownLexer import *
+import Corpus
+from FakeStyledTextCtrl import *
+
+
+# Style codes used when running the lexer
+STYLES = { name: code for code, name in enumerate(TokenTypes) if code != TOKEN_PLAIN }
+STYLE_DEFAULT = 32
+
+# Largest corpus to run the typing workload on
+TYPING_MAX_SIZE = 10 * 1024 * 1024
+
+# Number of keystrokes in the typing workload
+TYPING_KEYSTROKES = 200
+
+# Minimum time to spend on each round of timing the tokenizer, repeating small corpora until we reach it
+MIN_TIME = 0.1
+
+# Number of timing rounds for each corpus
+ROUNDS = 3
+
+# Corpora at least this size are only tokenized once per round
+LARGE_SIZE = 10 * 1024 * 1024
+
+# Metric used to detect regressions for each kind of result
+REGRESSION_METRICS = { 'tokenize': 'tokensPerSecond', 'typing': 'keystrokesPerSecond' }
+
+
+# Each matcher compiled on its own, with its table entry, for the reference implementation
+LegacyMatchers = [(matcherEntry(m), re.compile(m['pattern'], m.get('flags', 0))) for m in TokenMatchers]
+
+
+# Reference implementation: the original tokenizer, which searched with each matcher separately
+def legacyTokens(content):
+
+    # Go through the content
+    currentIndex = 0
+    while currentIndex < len(content):
+
+        # Try each regex until we get the closest match
+        entry = None
+        match = None
+        for e, regex in LegacyMatchers:
+            pmatch = regex.search(content, currentIndex)
+            if pmatch and (not match or pmatch.start() < match.start()):
+                entry = e
+                match = pmatch
+
+        # If no matches, the rest of the document is plain text
+        if not match:
+            yield ('plain', currentIndex, len(content))
+            return
+
+        # Create tokens
+        if match.start() > currentIndex: yield ('plain', currentIndex, match.start())
+        for typeCode, fromIndex, toIndex in matchTokens(content, entry, match):
+            yield (TokenTypes[typeCode], fromIndex, toIndex)
+        currentIndex = match.end()
+
+
+# Returns the style bytes for an entire document, styled in one pass
+def fullStyles(text):
+
+    # Style each token
+    styles = bytearray()
+    for token in MarkdownTokens(text):
+        length = len(text[token.fromIndex:token.toIndex].encode('utf-8'))
+        styles += bytes([STYLES.get(token.typeName, STYLE_DEFAULT)]) * length
+
+    # Done
+    return styles
+
+
+# Checks that the tokenizer output matches the reference implementation
+def checkTokenizer():
+
+    # Samples, including edge cases around the end of the document and runs of hashes
+    samples = [
+        "", "#", "# ", "#\n", "# a", "# a\n", "## a\n\n", "#\n#\n", "####x\n", "a # b ## c\n### d",
+        "text\n# a\n## b\n### c\n#### d\n", "###", "# a\n\n\n", "\n\n# x", "# é\n## ü\nñ"
+    ]
+    for kind in Corpus.CORPORA:
+        samples.append(Corpus.generate(kind, 100000, seed=2))
+
+    # Check each one
+    for content in samples:
+        expected = list(legacyTokens(content))
+        outputs = {
+            'MarkdownTokens': MarkdownTokens(content),
+            'tokenizeToArrays': tokenizeToArrays(content),
+            'MarkdownStreamTokens': MarkdownStreamTokens(io.BytesIO(content.encode('utf-8')), chunkSize=7)
+        }
+        for name, tokens in outputs.items():
+            if [(t.typeName, t.fromIndex, t.toIndex) for t in tokens] != expected:
+                raise Exception(name + " output differs from the reference implementation for: " + repr(content[:40]))
+
+    print("Tokenizer output matches the reference implementation for " + str(len(samples)) + " samples.")
+
+
+# Checks that incremental styling after random edits matches styling the whole document at once
+def checkLexer():
+
+    # Run a number of random editing sessions
+    rnd = random.Random(5)
+    alphabet = ['#', '#', '##', 'a', ' ', '\n', '\n', 'é']
+    for session in range(200):
+
+        # Create control and lexer. Use a small checkpoint interval so checkpoints are actually used.
+        control = FakeStyledTextCtrl(''.join(rnd.choice(alphabet) for i in range(rnd.randint(0, 200))))
+        lexer = MarkdownLexer(control, STYLES, STYLE_DEFAULT)
+        lexer.checkpointInterval = 16
+        control.onModified.append(lambda pos, length, inserted: lexer.invalidate(pos))
+
+        # Make edits
+        for edit in range(20):
+
+            # Insert or delete some text, keeping to character boundaries
+            text = control.GetText()
+            idx = rnd.randint(0, len(text))
+            pos = len(text[:idx].encode('utf-8'))
+            if rnd.random() < 0.6 or not text:
+                control.InsertText(pos, ''.join(rnd.choice(alphabet) for i in range(rnd.randint(1, 5))))
+            else:
+                control.DeleteRange(pos, len(text[idx:idx + rnd.randint(1, 5)].encode('utf-8')))
+
+            # Style in random steps, like Scintilla does as it paints
+            while True:
+                lexer.styleTo(min(control.GetLength(), control.GetEndStyled() + rnd.randint(1, 60)))
+                if control.GetEndStyled() >= control.GetLength():
+                    break
+
+            # Compare
+            if control.styles != fullStyles(control.GetText()):
+                raise Exception("Incremental styling differs from a full restyle for: " + repr(control.GetText()[:40]))
+
+    print("Incremental styling matches a full restyle for 200 editing sessions.")
+
+
+# Measures peak memory of holding every token of a 100k heading note, as Token objects and as compact arrays
+def compareTokenMemory():
+
+    # Create note
+    content = "# Heading\nSome text under the heading.\n" * 100000
+
+    # Measure Token objects
+    tracemalloc.start()
+    tokens = list(MarkdownTokens(content))
+    objectPeak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del tokens
+
+    # Measure arrays
+    tracemalloc.start()
+    tokens = tokenizeToArrays(content)
+    arrayPeak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # Show results
+    print("Peak memory for " + str(len(tokens)) + " tokens: %.1f MB as objects, %.1f MB as arrays" % (objectPeak / 1024 / 1024, arrayPeak / 1024 / 1024))
+
+
+# Measures tokenizing a corpus
+def benchmarkTokenize(content, measureMemory):
+
+    # Get size
+    size = len(content)
+
+    # Measure time to first token
+    start = time.perf_counter()
+    next(iter(MarkdownTokens(content)), None)
+    timeToFirstToken = time.perf_counter() - start
+
+    # Measure throughput, repeating small corpora until we've spent enough time. Keep the best of a few rounds to reduce noise.
+    best = None
+    for round in range(ROUNDS):
+        runs = 0
+        tokens = 0
+        start = time.perf_counter()
+        while True:
+            for token in MarkdownTokens(content):
+                tokens += 1
+            runs += 1
+            seconds = time.perf_counter() - start
+            if seconds >= MIN_TIME or size >= LARGE_SIZE:
+                break
+        if not best or tokens / seconds > best[0] / best[1]:
+            best = (tokens, seconds, runs)
+
+    # Get best round
+    tokens, seconds, runs = best
+
+    # Measure peak memory while iterating
+    peakMemory = None
+    if measureMemory:
+        tracemalloc.start()
+        for token in MarkdownTokens(content):
+            pass
+        peakMemory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    # Done
+    return {
+        'bytes': size,
+        'tokens': tokens // runs,
+        'seconds': seconds / runs,
+        'tokensPerSecond': tokens / seconds,
+        'timeToFirstToken': timeToFirstToken,
+        'peakMemory': peakMemory
+    }
+
+
+# Simulates typing near the end of a note, styling after each keystroke like onStyleNeeded does
+def benchmarkTyping(content):
+
+    # Create control and lexer, and style the whole document first
+    control = FakeStyledTextCtrl(content)
+    lexer = MarkdownLexer(control, STYLES, STYLE_DEFAULT)
+    control.onModified.append(lambda pos, length, inserted: lexer.invalidate(pos))
+    start = time.perf_counter()
+    lexer.styleTo(control.GetLength())
+    initialStyle = time.perf_counter() - start
+
+    # Type characters near the end
+    rnd = random.Random(3)
+    latencies = []
+    for i in range(TYPING_KEYSTROKES):
+
+        # Pick a position in the last few percent of the note, at the start of a line so we stay on a character boundary
+        line = control.LineFromPosition(control.GetLength() - rnd.randint(0, control.GetLength() // 50))
+        pos = control.PositionFromLine(line)
+
+        # Type, then style up to the end of a screenful of lines, which is what Scintilla would ask for
+        start = time.perf_counter()
+        control.InsertText(pos, rnd.choice("abc #\n"))
+        lastLine = min(control.GetLineCount() - 1, line + 50)
+        lexer.styleTo(control.GetLineEndPosition(lastLine))
+        latencies.append(time.perf_counter() - start)
+
+    # Done. Throughput is based on the median latency, so a few slow outliers don't make the comparison noisy.
+    latencies.sort()
+    return {
+        'bytes': len(content),
+        'initialStyle': initialStyle,
+        'keystrokes': len(latencies),
+        'p50': latencies[len(latencies) // 2],
+        'p95': latencies[int(len(latencies) * 0.95)],
+        'max': latencies[-1],
+        'keystrokesPerSecond': 1 / latencies[len(latencies) // 2]
+    }
+
+
+# Runs the benchmarks and returns the results
+def runBenchmarks(sizes, corpora, measureMemory):
+
+    # Go through each corpus and size
+    results = {}
+    for kind in corpora:
+        for size in sizes:
+
+            # Create corpus
+            content = Corpus.generate(kind, size)
+            label = kind + "/" + Corpus.sizeLabel(size)
+
+            # Tokenize
+            result = benchmarkTokenize(content, measureMemory)
+            results['tokenize/' + label] = result
+            print("tokenize/%-22s %12.0f tokens/s  %8.4f ms first token  %s peak" % (label, result['tokensPerSecond'], result['timeToFirstToken'] * 1000,
+                  "-" if result['peakMemory'] is None else "%.1f KB" % (result['peakMemory'] / 1024)))
+
+            # Type
+            if size <= TYPING_MAX_SIZE:
+                result = benchmarkTyping(content)
+                results['typing/' + label] = result
+                print("typing/%-24s %12.0f keys/s    %8.3f ms p50  %8.3f ms p95" % (label, result['keystrokesPerSecond'], result['p50'] * 1000, result['p95'] * 1000))
+
+    # Done
+    return results
+
+
+# Compares results against a baseline. Returns a list of regressions.
+def compareResults(baseline, results, threshold):
+
+    # Check each result which is in both
+    regressions = []
+    print("")
+    for key in sorted(results):
+
+        # Skip if not in the baseline
+        if key not in baseline:
+            continue
+
+        # Compare the metric for this kind of result
+        metric = REGRESSION_METRICS[key.split('/')[0]]
+        old = baseline[key][metric]
+        new = results[key][metric]
+        change = (new - old) / old
+        flag = ""
+        if change < -threshold:
+            regressions.append(key)
+            flag = "  REGRESSION"
+
+        # Show result
+        print("%-40s %14.0f -> %14.0f %s %+6.1f%%%s" % (key, old, new, metric, change * 100, flag))
+
+    # Done
+    return regressions
+
+
+# Parses a size like 10KB or 1MB
+def parseSize(text):
+    text = text.strip().upper()
+    if text.endswith("MB"): return int(text[:-2]) * 1024 * 1024
+    if text.endswith("KB"): return int(text[:-2]) * 1024
+    return int(text)
+
+
+# Entry point
+if __name__ == "__main__":
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Benchmarks the Markdown tokenizer.")
+    parser.add_argument("--sizes", help="comma separated corpus sizes, like 1KB,10MB", default=",".join(Corpus.sizeLabel(s) for s in Corpus.SIZES))
+    parser.add_argument("--corpora", help="comma separated corpus names", default=",".join(Corpus.CORPORA))
+    parser.add_argument("--out", help="file to write JSON results to")
+    parser.add_argument("--compare", help="baseline JSON results file to compare against")
+    parser.add_argument("--threshold", help="fractional drop in throughput which counts as a regression", type=float, default=0.1)
+    parser.add_argument("--skip-memory", help="don't measure peak memory, which is slow on large corpora", action="store_true")
+    parser.add_argument("--skip-checks", help="don't check output against the reference implementation", action="store_true")
+    args = parser.parse_args()
+
+    # Check output first
+    if not args.skip_checks:
+        checkTokenizer()
+        checkLexer()
+        compareTokenMemory()
+        print("")
+
+    # Run benchmarks
+    sizes = [parseSize(s) for s in args.sizes.split(",")]
+    results = runBenchmarks(sizes, args.corpora.split(","), not args.skip_memory)
+
+    # Write results
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump({ 'python': sys.version, 'platform': platform.platform(), 'time': time.time(), 'results': results }, file, indent=2)
+
+    # Compare with the baseline
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+        regressions = compareResults(baseline, results, args.threshold)
+        if regressions:
+            print("")
+            print(str(len(regressions)) + " result(s) regressed by more than " + str(int(args.threshold * 100)) + "%")
+            sys.exit(1)
@@ -2,8 +2,14 @@
 # Entry point
 
 import wx
+import Config
+import Instrumentation
 from MainWindow import *
 
+# Turn on instrumentation if requested, before any windows are created
+if Config.getboolean('debug', 'instrumentation'):
+    Instrumentation.enable(Config.getint('debug', 'instrumentation_samples', 1000))
+
 # Create app
 app = wx.App()
 frame = MainWindow()